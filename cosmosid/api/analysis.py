@@ -9,6 +9,7 @@ from cosmosid.helpers.exceptions import (
     CosmosidException,
     NotFoundException,
 )
+from cosmosid.helpers.transport import default_transport
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,12 +19,17 @@ class Analysis(object):
 
     __resource_path = "/api/metagenid/v1/runs/{run_id}/analysis"
 
-    def __init__(self, base_url=None, api_key=None):
+    def __init__(self, base_url=None, api_key=None, transport=None):
         self.base_url = base_url
         self.logger = LOGGER
         self.header = {"X-Api-Key": api_key}
         self.request_url = f"{self.base_url}{self.__resource_path}"
-        self.runs = Runs(base_url=self.base_url, api_key=self.header["X-Api-Key"])
+        self.transport = transport or default_transport()
+        self.runs = Runs(
+            base_url=self.base_url,
+            api_key=self.header["X-Api-Key"],
+            transport=self.transport,
+        )
 
     def __is_runid_in_file(self, run_id, file_id):
         """Get given run meta and check is the run in sample."""
@@ -52,7 +58,7 @@ class Analysis(object):
             if not single_run_meta["status"]:
                 raise NotFoundException(single_run_meta["message"])
 
-            results = requests.get(request_url, headers=self.header)
+            results = self.transport.get(request_url, headers=self.header)
             if results.status_code == 403:
                 raise AuthenticationFailed("Authentication Failed. " "Wrong API Key.")
             if results.status_code == 404:
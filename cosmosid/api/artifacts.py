@@ -7,11 +7,20 @@ from os.path import isfile, split, splitext
 from urllib.parse import urlparse
 
 import requests
+
 from cosmosid.api.files import Runs
+from cosmosid.config import CHUNK_SIZE
+from cosmosid.helpers.downloader import Downloader
 from cosmosid.helpers.exceptions import (
+    CosmosidConnectionError,
     CosmosidException,
+    CosmosidServerError,
     FileExistsException,
+    NotFoundException,
 )
+from cosmosid.helpers.stream import STDOUT, is_stream, open_stream
+from cosmosid.helpers.transport import default_transport
+from cosmosid.helpers.writer import BlockWriter
 from cosmosid.utils import progress
 
 LOGGER = logging.getLogger(__name__)
@@ -23,17 +32,22 @@ class Artifacts(object):
     __get_all_artifacts = "api/metagenid/v1/runs/{run_id}/artifacts"
     __get_one_artifact = "api/metagenid/v1/runs/{run_id}/artifacts/{artifact_type}"
 
-    def __init__(self, base_url=None, api_key=None):
+    def __init__(self, base_url=None, api_key=None, transport=None):
         self.base_url = base_url
         self.logger = LOGGER
         self.header = {"X-Api-Key": api_key}
         self.get_one_endpoint = f"{self.base_url}/{self.__get_one_artifact}"
         self.get_all_endpoint = f"{self.base_url}/{self.__get_all_artifacts}"
-        self.runs = Runs(base_url=self.base_url, api_key=self.header["X-Api-Key"])
+        self.transport = transport or default_transport()
+        self.runs = Runs(
+            base_url=self.base_url,
+            api_key=self.header["X-Api-Key"],
+            transport=self.transport,
+        )
 
     def get_artifacts(self, run_id):
         request_url = self.get_all_endpoint.format(run_id=run_id)
-        results = requests.get(request_url, headers=self.header)
+        results = self.transport.get(request_url, headers=self.header)
         return results.json()
 
     def get_artifacts_by_run_id(self, run_id, artifact_type):
@@ -45,13 +59,12 @@ class Artifacts(object):
             raise CosmosidException(
                 f"Response from service is empty for run id {run_id}"
             )
-        results = requests.get(request_url, headers=self.header)
+        results = self.transport.get(request_url, headers=self.header)
         return results.json()
 
     def save_artifacts(self, url, output_file, output_dir, chunk_size=8192):
-        # TODO: exception handling
-        r = requests.get(url, stream=True)
-        total_size = r.headers["content-length"]
+        if output_file == STDOUT:
+            return self.stream_artifacts(url, STDOUT)
         if output_file:
             file_name, _ = splitext(output_file)
             output_file = f"{file_name}.zip"
@@ -62,15 +75,50 @@ class Artifacts(object):
         if not output_dir:
             output_dir = os.getcwd()
         file_full_path = f"{output_dir}/{output_file}"
+        if is_stream(file_full_path):
+            return self.stream_artifacts(url, file_full_path)
         if isfile(file_full_path):
             raise FileExistsException(f"Destination File exists: {file_full_path}")
-        with open(file_full_path, "wb") as f:
-            for i, chunk in enumerate(r.iter_content(chunk_size=chunk_size)):
-                progress(i * chunk_size, total_size, "Downloading...")
-                f.write(chunk)
-            progress(1, 1, "Completed.           \n")
+        r = self._get_archive(url)
+        total_size = r.headers["content-length"]
+        try:
+            with BlockWriter(file_full_path, int(total_size)) as f:
+                for i, chunk in enumerate(r.iter_content(chunk_size=chunk_size)):
+                    progress(i * chunk_size, total_size, "Downloading...")
+                    f.write(chunk)
+                progress(1, 1, "Completed.           \n")
+        except requests.exceptions.RequestException as err:
+            raise CosmosidConnectionError(f"Artifact download failed: {err}") from err
         return file_full_path
 
+    def _get_archive(self, url):
+        """Request the archive by presigned URL, without the API key and cache."""
+        try:
+            r = self.transport.session.get(
+                url, stream=True, timeout=self.transport.timeout
+            )
+        except requests.exceptions.RequestException as err:
+            raise CosmosidConnectionError(f"Artifact download failed: {err}") from err
+        if r.status_code == 404:
+            raise NotFoundException("Artifact archive not found.")
+        if r.status_code >= 500:
+            raise CosmosidServerError(
+                f"Artifact download failed. Response code: {r.status_code}"
+            )
+        if r.status_code != 200:
+            # e.g. 403 of an expired URL
+            raise CosmosidException(
+                f"Artifact download failed. Response code: {r.status_code}"
+            )
+        return r
+
+    @staticmethod
+    def stream_artifacts(url, output):
+        """Write the archive to stdout ("-") or a named pipe."""
+        with open_stream(output) as stream:
+            Downloader.stream_file(url, stream, CHUNK_SIZE)
+        return output
+
     def get_list(self, run_id=None, artifact_type=None):
 
         if artifact_type and run_id:
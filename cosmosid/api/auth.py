@@ -1,10 +1,29 @@
-import requests
+from cosmosid.helpers.transport import default_transport
 
+# user id is cached for this time (seconds), it never changes
+USER_ID_TTL = 24 * 60 * 60
 
-def get_profile(base_url, headers):
-    response = requests.get(f"{base_url}/api/auth/profile", json={}, headers=headers)
+
+def get_profile(base_url, headers, transport=None):
+    transport = transport or default_transport()
+    response = transport.get(f"{base_url}/api/auth/profile", json={}, headers=headers)
 
     if response.status_code == 200:
         return response.json()
     else:
         raise response.raise_for_status()
+
+
+def get_user_id(base_url, headers, transport=None):
+    """Return id of the user, it's cached apart from the rest of the profile."""
+    transport = transport or default_transport()
+    cache = transport.cache
+    if cache is None:
+        return get_profile(base_url, headers, transport)["id"]
+    key = cache.key(f"{base_url}/api/auth/profile#id", headers)
+    entry = cache.load(key)
+    if entry and cache.fresh(entry):
+        return entry["value"]
+    user_id = get_profile(base_url, headers, transport)["id"]
+    cache.store_value(key, user_id, USER_ID_TTL)
+    return user_id
@@ -1,22 +1,30 @@
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from contextlib import suppress
 
 import requests
 from cosmosid.config import CHUNK_SIZE, CONCURRENT_DOWNLOADS
-from cosmosid.helpers.downloader import Downloader
+from cosmosid.helpers.concurrency import concurrency_controller
+from cosmosid.helpers.downloader import IS_AIOHTTP_INSTALLED, Downloader
+from cosmosid.helpers.rate_limiter import DOWNLOAD_BUCKET, download_limiter
+from cosmosid.helpers.transport import default_transport
 from cosmosid.utils import retry, get_valid_name
 from cosmosid.enums import ComparativeExportType
 
+if IS_AIOHTTP_INSTALLED:
+    from cosmosid.helpers.async_downloader import AsyncDownloader
+
 logger = logging.getLogger(__name__)
 
 
 class ComparativeAnalyses:
 
-    def __init__(self, base_url, api_key):
+    def __init__(self, base_url, api_key, transport=None):
         self.base_url = base_url
         self.api_key = api_key
+        self.transport = transport or default_transport()
         api_url = f'{base_url}/api/metagenid/v1/comparative'
         comparative_api_url = f'{base_url}/api/comparative/v1/users/{{user_id}}/comparatives'
         export_by_analysis_id_api_url = f'{api_url}/{{analysis_id}}/tsv'
@@ -53,7 +61,7 @@ class ComparativeAnalyses:
         return True
 
     def _get_data(self, url_key, **kwargs):
-        resp = requests.get(
+        resp = self.transport.get(
             self._urls[url_key].format(**kwargs),
             headers={
                 'X-Api-key': self.api_key
@@ -151,6 +159,9 @@ class ComparativeAnalyses:
             url,
             filename,
             directory,
+            file_rate_limit=None,
+            backend=None,
+            controller=None,
     ):
         path = os.path.join(directory, filename)
         try:
@@ -160,6 +171,9 @@ class ComparativeAnalyses:
                 filename,
                 directory,
                 CHUNK_SIZE,
+                limiter=download_limiter(file_rate_limit, controller),
+                backend=backend,
+                controller=controller,
             )
             return path
         except FileExistsError:
@@ -244,8 +258,16 @@ class ComparativeAnalyses:
             concurrent_downloads,
             output_dir,
             log_scale,
-            tax_levels
+            tax_levels,
+            rate_limit=None,
+            file_rate_limit=None,
+            backend=None,
+            tuning=None,
     ):
+        backend = Downloader.get_backend(backend)
+        controller = concurrency_controller(concurrent_downloads, tuning)
+        if rate_limit is not None:
+            DOWNLOAD_BUCKET.set_rate(rate_limit)
 
         logger.info("Looking for available comparative analyses...")
 
@@ -266,20 +288,73 @@ class ComparativeAnalyses:
 
         logger.info('\nLoading...')
         success = False
+        if backend == 'async':
+            # thousands of small exports are loaded by a single thread
+            for filepath in AsyncDownloader(
+                max_transfers=(
+                    None if controller else concurrent_downloads or CONCURRENT_DOWNLOADS
+                ),
+                display_loading=False,
+                limiter_factory=lambda: download_limiter(file_rate_limit, controller),
+                controller=controller,
+            ).download(
+                [
+                    {
+                        'url': option['url'],
+                        'size': None,
+                        'file_name': option['filename'],
+                        'directory': option['directory'],
+                    }
+                    for option in all_options
+                ],
+                output_dir,
+            ):
+                success = True
+                logger.info(f'The file: {filepath} downloaded')
+        else:
+            success = self._export_with_threads(
+                all_options, concurrent_downloads, file_rate_limit, backend, controller
+            )
+        if success:
+            logger.info('Completed')
+        else:
+            logger.error('\nThe operation has failed')
+
+    def _export_with_threads(
+        self,
+        all_options,
+        concurrent_downloads,
+        file_rate_limit,
+        backend,
+        controller=None,
+    ):
+        success = False
+        workers = concurrent_downloads or CONCURRENT_DOWNLOADS
+        options = deque(all_options)
         with ThreadPoolExecutor(
-                max_workers=concurrent_downloads or CONCURRENT_DOWNLOADS
+                max_workers=controller.maximum if controller else workers
         ) as executor:
-            future_to_url = {
-                executor.submit(
-                    self.export_analysis,
-                    directory=option['directory'],
-                    filename=option['filename'],
-                    url=option['url'],
-                ): option['analysis']['id']
-                for option in all_options
-            }
-            for future in as_completed(future_to_url):
-                if future.done():
+            futures = set()
+            while options or futures:
+                if controller:
+                    workers = controller.update(len(futures) + len(options))
+                while options and len(futures) < workers:
+                    option = options.popleft()
+                    futures.add(executor.submit(
+                        self.export_analysis,
+                        directory=option['directory'],
+                        filename=option['filename'],
+                        url=option['url'],
+                        file_rate_limit=file_rate_limit,
+                        backend=backend,
+                        controller=controller,
+                    ))
+                done, futures = wait(
+                    futures,
+                    timeout=controller.interval if controller else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
                     error = future.exception(1)
                     if error is None:
                         filepath = future.result()
@@ -289,7 +364,4 @@ class ComparativeAnalyses:
                                 f'The file: {filepath} downloaded')
                     else:
                         logger.error(error)
-        if success:
-            logger.info('Completed')
-        else:
-            logger.error('\nThe operation has failed')
+        return success
@@ -1,32 +1,105 @@
 """
 Representation of folder structure.
 """
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from importlib.util import find_spec
 from logging import getLogger
-from os.path import join
+from os.path import getsize, isfile, join
 from typing import List, Tuple
 
-from requests import post
+from requests import Session
 
-from cosmosid.api.auth import get_profile
-from cosmosid.config import CHUNK_SIZE, CONCURRENT_DOWNLOADS
-from cosmosid.helpers.downloader import Downloader
+from cosmosid.api.auth import get_user_id
+from cosmosid.config import (
+    CHUNK_SIZE,
+    CONCURRENT_DOWNLOADS,
+    DOWNLOAD_SEGMENTS,
+    DOWNLOAD_URLS_BATCH_SIZE,
+)
+from cosmosid.helpers.checksum import UNVERIFIED, verify_file
+from cosmosid.helpers.concurrency import concurrency_controller
+from cosmosid.helpers.download_manifest import DownloadManifest
+from cosmosid.helpers.downloader import (
+    IS_AIOHTTP_INSTALLED,
+    IS_PYCURL_INSTALLED,
+    Downloader,
+)
 from cosmosid.helpers.exceptions import CosmosidException
+from cosmosid.helpers.rate_limiter import DOWNLOAD_BUCKET, download_limiter
+from cosmosid.helpers.stream import GunzipWriter, open_stream
 from cosmosid.helpers.thread_logger import ThreadLogger
+from cosmosid.helpers.transport import default_transport
+
+if IS_PYCURL_INSTALLED:
+    from cosmosid.helpers.curl_multi import CurlMultiDownloader
+if IS_AIOHTTP_INSTALLED:
+    from cosmosid.helpers.async_downloader import AsyncDownloader
 
 logger = getLogger(__name__)
 
 
+class FilesBatches:
+    """Files of samples whose download URLs are requested by batches.
+
+    URLs of the next batch are requested in a background thread while the
+    files of the previous batch are downloaded, so URL generation and
+    transfers overlap and only a batch of URLs is kept in memory.
+    """
+
+    def __init__(self, get_files, samples_ids, batch_size):
+        self._get_files = get_files
+        self._batches = deque(
+            samples_ids[i : i + batch_size]
+            for i in range(0, len(samples_ids), batch_size)
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._future = None
+        self._request_next()
+
+    def _request_next(self):
+        self._future = (
+            self._executor.submit(self._get_files, self._batches.popleft())
+            if self._batches
+            else None
+        )
+
+    @property
+    def exhausted(self):
+        return self._future is None
+
+    def ready(self):
+        """Check if files of the next batch are received."""
+        return self._future is None or self._future.done()
+
+    def next(self):
+        """Return files of the next batch, wait for them if needed."""
+        if self._future is None:
+            return []
+        files = self._future.result()
+        self._request_next()
+        return files
+
+    def close(self):
+        if self._future:
+            self._future.cancel()
+        self._batches.clear()
+        self._executor.shutdown(wait=False)
+
+
 class SamplesDownloader:
     """Samples structure."""
 
-    def __init__(self, base_url=None, api_key=None):
+    def __init__(self, base_url=None, api_key=None, transport=None):
         self.base_url = base_url
         self.auth_header = {"X-Api-Key": api_key}
+        self.transport = transport or default_transport()
         self.original_file = (
             "{self.base_url}/api/metagenid/v3/users/{user_uuid}/download"
         )
+        self._download_url = None
         self.check_pycurl()
 
     @staticmethod
@@ -38,12 +111,17 @@ We recommend installing pycurl for the best experience with a sample download, s
             )
 
     def get_sample_data(self, samples_ids) -> dict:
-        user_profile = get_profile(base_url=self.base_url, headers=self.auth_header)
-        request_url = (
-            f"{self.base_url}/api/metagenid/v3/users/{user_profile['id']}/download"
-        )
-        response = post(
-            request_url,
+        if self._download_url is None:
+            user_id = get_user_id(
+                base_url=self.base_url,
+                headers=self.auth_header,
+                transport=self.transport,
+            )
+            self._download_url = (
+                f"{self.base_url}/api/metagenid/v3/users/{user_id}/download"
+            )
+        response = self.transport.post(
+            self._download_url,
             headers=self.auth_header,
             json={"samples": samples_ids, "notification": "false"},
         )
@@ -52,20 +130,31 @@ We recommend installing pycurl for the best experience with a sample download, s
 
     @staticmethod
     def get_errors(data) -> List[dict]:
+        """Return unique errors in the order of the response."""
         errors = []
+        seen = set()
         for error in data.get("errors", []):
-            if error not in errors:
+            key = json.dumps(error, sort_keys=True, default=str)
+            if key not in seen:
+                seen.add(key)
                 errors.append(error)
         return errors
 
     @staticmethod
     def get_available_samples(samples, errors) -> List[dict]:
-        result = samples.copy()
-        for error in errors:
-            for sample in samples:
-                if error["sample_id"] == sample:
-                    result.remove(sample)
-        return result
+        """Return samples without the ones which have errors."""
+        failed = {error["sample_id"] for error in errors}
+        return [
+            sample
+            for sample in samples
+            if SamplesDownloader.get_sample_id(sample) not in failed
+        ]
+
+    @staticmethod
+    def get_sample_id(sample):
+        if isinstance(sample, dict):
+            return sample.get("sample_id") or sample.get("id")
+        return sample
 
     @classmethod
     def handle_data(cls, data) -> Tuple[List[str], List[dict]]:
@@ -73,65 +162,235 @@ We recommend installing pycurl for the best experience with a sample download, s
             return ["No data"], []
 
         errors = cls.get_errors(data)
-        samples = cls.get_available_samples(data.get("samples"), errors)
-
         errors_texts = ["{error} ({sample_id})".format(**error) for error in errors]
-
-        if not samples:
-            return errors_texts, []
-
         files = [
             {
+                "sample_id": sample.get("sample_id", sample.get("id")),
                 "file_name": file["file_name"],
                 "url": file["url"],
                 "size": file["size"],
             }
-            for sample in samples
+            for sample in cls.get_available_samples(data.get("samples"), errors)
             for file in sample.get("files", [])
         ]
         return errors_texts, files
 
     @staticmethod
-    def download_sample(file, output_dir, display_loading):
+    def download_sample(
+        file,
+        output_dir,
+        display_loading,
+        file_rate_limit=None,
+        segments=None,
+        manifest=None,
+        backend=None,
+        controller=None,
+    ):
         thread_logger = ThreadLogger()
         try:
-            Downloader.load_file(
+            checksum = Downloader.load_file(
                 file["url"],
                 file["size"],
                 file["file_name"],
                 output_dir,
                 CHUNK_SIZE,
                 display_loading,
+                limiter=download_limiter(file_rate_limit, controller),
+                segments=segments,
+                backend=backend,
+                controller=controller,
             )
+            if manifest:
+                manifest.finish(file["file_name"], checksum=checksum)
+            if checksum is None:
+                # load_file doesn't retry after cancellation or Ctrl+C
+                thread_logger.info(file["file_name"], "Interrupted.")
+                return None
             return join(output_dir, file["file_name"])
         except Exception as error:
+            if manifest:
+                manifest.finish(file["file_name"], error)
             thread_logger.info(file["file_name"], str(error).strip())
 
-    def download_samples(
-        self, samples_ids, output_dir, concurrent_downloads, display_loading=True
+    @staticmethod
+    def download_with_curl_multi(
+        files,
+        output_dir,
+        concurrent_downloads,
+        display_loading,
+        file_rate_limit=None,
+        segments=None,
+        manifest=None,
+        batches=None,
+        tuning=None,
     ):
-        try:
-            data = self.get_sample_data(samples_ids)
-            errors, files = self.handle_data(data)
+        """Download all files by a single thread with pycurl multi interface.
+
+        Files of the next ``batches`` are added while the files are loaded.
+        """
+        segments = segments or DOWNLOAD_SEGMENTS
+        controller = concurrency_controller(concurrent_downloads, tuning, segments)
+        return CurlMultiDownloader(
+            max_transfers=(
+                controller.maximum
+                if controller
+                else (concurrent_downloads or CONCURRENT_DOWNLOADS) * segments
+            ),
+            display_loading=display_loading,
+            limiter_factory=lambda: download_limiter(file_rate_limit, controller),
+            segments=segments,
+            on_complete=manifest.finish if manifest else None,
+            controller=controller,
+        ).download(files, output_dir, batches)
+
+    @staticmethod
+    def download_with_asyncio(
+        files,
+        output_dir,
+        concurrent_downloads,
+        display_loading,
+        file_rate_limit=None,
+        segments=None,
+        manifest=None,
+        batches=None,
+        tuning=None,
+    ):
+        """Download all files as tasks of a shared event loop with aiohttp."""
+        controller = concurrency_controller(concurrent_downloads, tuning)
+        return AsyncDownloader(
+            # the controller adapts the number of transfers instead
+            max_transfers=(
+                None if controller else concurrent_downloads or CONCURRENT_DOWNLOADS
+            ),
+            display_loading=display_loading,
+            limiter_factory=lambda: download_limiter(file_rate_limit, controller),
+            segments=segments or DOWNLOAD_SEGMENTS,
+            on_complete=manifest.finish if manifest else None,
+            controller=controller,
+        ).download(files, output_dir, batches)
+
+    def get_files(self, samples_ids, manifest):
+        """Return files of the samples which aren't loaded yet.
+
+        URLs are requested in a single request only for the samples which
+        aren't in the manifest or whose URLs expired.
+        """
+        _, files, request = manifest.split_samples(samples_ids)
+        if not request:
+            return files
+        errors, requested_files = self.handle_data(self.get_sample_data(request))
+        for error in errors:
+            logger.error(error)
+        samples_files = {}
+        for file in requested_files:
+            sample_id = file.pop("sample_id")
+            if sample_id is None and len(request) == 1:
+                sample_id = request[0]
+            samples_files.setdefault(sample_id, []).append(file)
+        for sample_id, sample_files in samples_files.items():
+            files.extend(manifest.add_files(sample_id, sample_files))
+        manifest.save(force=True)
+        return files
+
+    @staticmethod
+    def verify_sample(session, file, output_dir):
+        """Compare the downloaded file with ETag of the original file."""
+        filepath = join(output_dir, file["file_name"])
+        if not isfile(filepath):
+            return "missing"
+        if getsize(filepath) != file["size"]:
+            return "incomplete"
+        _, etag = Downloader.probe(session, file["url"])
+        if not etag:
+            return UNVERIFIED
+        return verify_file(filepath, etag, file["size"])
+
+    def verify_samples(self, samples_ids, output_dir, concurrent_downloads):
+        """Verify checksums of downloaded files without loading them again.
+
+        :return: list of (file name, status) rows
+        """
+        files = []
+        for start in range(0, len(samples_ids), DOWNLOAD_URLS_BATCH_SIZE):
+            data = self.get_sample_data(
+                samples_ids[start:start + DOWNLOAD_URLS_BATCH_SIZE]
+            )
+            errors, batch_files = self.handle_data(data)
             for error in errors:
                 logger.error(error)
-            if not files:
-                return
-            if display_loading:
-                ThreadLogger().start()
-            else:
-                logger.info("Loading..")
-            files_paths = []
-            with ThreadPoolExecutor(
-                max_workers=concurrent_downloads or CONCURRENT_DOWNLOADS
-            ) as executor:
-                future_to_url = {
-                    executor.submit(
-                        self.download_sample, file, output_dir, display_loading
-                    ): file
-                    for file in files
-                }
-                for future in as_completed(future_to_url):
+            files.extend(batch_files)
+        with Session() as session, ThreadPoolExecutor(
+            max_workers=concurrent_downloads or CONCURRENT_DOWNLOADS
+        ) as executor:
+            statuses = executor.map(
+                lambda file: self.verify_sample(session, file, output_dir), files
+            )
+            return [
+                (file["file_name"], status) for file, status in zip(files, statuses)
+            ]
+
+    def download_with_threads(
+        self,
+        files,
+        output_dir,
+        concurrent_downloads,
+        display_loading,
+        file_rate_limit=None,
+        segments=None,
+        manifest=None,
+        batches=None,
+        backend=None,
+        tuning=None,
+    ):
+        """Download files by a pool of threads, a thread per file.
+
+        With a concurrency controller the pool has its maximum of threads
+        and only the allowed number of files is loaded at once.
+        """
+        files_paths = []
+        controller = concurrency_controller(concurrent_downloads, tuning)
+        workers = concurrent_downloads or CONCURRENT_DOWNLOADS
+        files = deque(files)
+        with ThreadPoolExecutor(
+            max_workers=controller.maximum if controller else workers
+        ) as executor:
+            futures = set()
+            while files or futures or (batches and not batches.exhausted):
+                if controller:
+                    workers = controller.update(len(futures) + len(files))
+                # files of the next batch are taken when the pool is about to idle
+                if (
+                    not files
+                    and batches
+                    and not batches.exhausted
+                    and len(futures) <= workers
+                ):
+                    files.extend(batches.next())
+                    continue
+                # without a controller files are queued for the busy threads
+                while files and len(futures) < (workers if controller else 2 * workers):
+                    futures.add(
+                        executor.submit(
+                            self.download_sample,
+                            files.popleft(),
+                            output_dir,
+                            display_loading,
+                            file_rate_limit,
+                            segments,
+                            manifest,
+                            backend,
+                            controller,
+                        )
+                    )
+                if not futures:
+                    continue
+                # the limit of the controller may grow while all files are loaded
+                done, futures = wait(
+                    futures,
+                    timeout=controller.interval if controller else None,
+                    return_when=FIRST_COMPLETED,
+                )
+                for future in done:
                     error = future.exception(1)
                     if error is None:
                         filepath = future.result()
@@ -139,10 +398,111 @@ We recommend installing pycurl for the best experience with a sample download, s
                             files_paths.append(filepath)
                     else:
                         logger.error(error)
+        return files_paths
+
+    def download_samples(
+        self,
+        samples_ids,
+        output_dir,
+        concurrent_downloads,
+        display_loading=True,
+        rate_limit=None,
+        file_rate_limit=None,
+        segments=None,
+        backend=None,
+        tuning=None,
+    ):
+        backend = Downloader.get_backend(backend)
+        if rate_limit is not None:
+            DOWNLOAD_BUCKET.set_rate(rate_limit)
+        manifest = DownloadManifest(output_dir)
+        loaded_paths = manifest.completed_files(samples_ids)
+        if loaded_paths:
+            logger.info("%s files are already downloaded", len(loaded_paths))
+        batches = FilesBatches(
+            lambda batch: self.get_files(batch, manifest),
+            samples_ids,
+            DOWNLOAD_URLS_BATCH_SIZE,
+        )
+        try:
+            files = batches.next()
+            while not files and not batches.exhausted:
+                files = batches.next()
+            if not files:
+                return loaded_paths
+            if display_loading:
+                ThreadLogger().start()
+            else:
+                logger.info("Loading..")
+            download = {
+                "curl": self.download_with_curl_multi,
+                "async": self.download_with_asyncio,
+                "requests": partial(self.download_with_threads, backend=backend),
+            }[backend]
+            files_paths = download(
+                files,
+                output_dir,
+                concurrent_downloads,
+                display_loading,
+                file_rate_limit,
+                segments,
+                manifest,
+                batches,
+                tuning=tuning,
+            )
             if display_loading:
                 ThreadLogger().stop()
-            return files_paths
+            return loaded_paths + files_paths
         except CosmosidException as error:
             if display_loading:
                 ThreadLogger().stop()
             raise CosmosidException(f"{error}") from error
+        finally:
+            batches.close()
+            manifest.save(force=True)
+
+    def _get_stream_files(self, samples_ids):
+        errors, files = self.handle_data(self.get_sample_data(samples_ids))
+        for error in errors:
+            logger.error(error)
+        return files
+
+    def stream_samples(
+        self, samples_ids, output, gunzip=False, rate_limit=None, file_rate_limit=None
+    ):
+        """Write files of the samples one after another to stdout or a named pipe.
+
+        :param output: "-" for stdout or path of a named pipe
+        :param gunzip: decompress gzipped files
+        :return: names of the streamed files, the reader of the output may
+            stop reading before the end
+        """
+        if rate_limit is not None:
+            DOWNLOAD_BUCKET.set_rate(rate_limit)
+        streamed = []
+        found = False
+        batches = FilesBatches(
+            self._get_stream_files, samples_ids, DOWNLOAD_URLS_BATCH_SIZE
+        )
+        try:
+            with open_stream(output) as stream:
+                while not batches.exhausted:
+                    for file in batches.next():
+                        found = True
+                        writer = GunzipWriter(stream) if gunzip else stream
+                        checksum = Downloader.stream_file(
+                            file["url"],
+                            writer,
+                            CHUNK_SIZE,
+                            limiter=download_limiter(file_rate_limit),
+                        )
+                        if gunzip:
+                            writer.finish()
+                        stream.flush()
+                        logger.info("%s is streamed (%s)", file["file_name"], checksum)
+                        streamed.append(file["file_name"])
+        finally:
+            batches.close()
+        if not found:
+            logger.error("There are not available files for downloading")
+        return streamed
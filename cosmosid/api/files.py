@@ -3,118 +3,204 @@ Representation of folder structure.
 """
 import json
 import logging
+import posixpath
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from operator import itemgetter
 
 import requests
 
 import cosmosid.utils as utils
+from cosmosid.config import CONCURRENT_METADATA_REQUESTS, RUN_METADATA_CACHE_TTL
 from cosmosid.helpers.exceptions import (
     AuthenticationFailed,
+    CosmosidConnectionError,
     CosmosidException,
     NotFound,
     NotFoundException,
 )
+from cosmosid.helpers.transport import default_transport
+from cosmosid.helpers.ttl_cache import TTLCache
 
 LOGGER = logging.getLogger(__name__)
+# type of dashboard items which are folders
+FOLDER_TYPE = 1
+# metadata of runs found by id, keyed by base url, api key and run id
+RUNS_CACHE = TTLCache(
+    RUN_METADATA_CACHE_TTL, cacheable=lambda run: bool(run and run.get("status"))
+)
+
 
 class Files(object):
     """Files structure."""
 
-    def __init__(self, base_url, api_key):
+    def __init__(self, base_url, api_key, transport=None):
         self.base_url = base_url
         self.logger = LOGGER
+        self.transport = transport or default_transport()
         self.auth_header = {"X-Api-Key": api_key}
         self.request_url = f"{self.base_url}/api/metagenid/v3/dashboard"
         self.request_url_files = f"{self.base_url}/api/metagenid/v2/files"
 
     def get_dashboard(self, parent_id):
+        try:
+            return self._request_dashboard(parent_id)
+        except AuthenticationFailed as err:
+            utils.log_traceback(err)
+        except NotFound as err:
+            utils.log_traceback(err)
+        except requests.exceptions.RequestException as err:
+            self.logger.error("Error occurred during request")
+            utils.log_traceback(err)
+
+    def _request_dashboard(self, parent_id):
         params = {}
         if parent_id:
             params["folder_id"] = parent_id
         result = {"items": [], "total": 0, "status": 1}
         result_set = False
-        try:
-            response = requests.get(
-                self.request_url, headers=self.auth_header, params=params
+        response = self.transport.get(
+            self.request_url, headers=self.auth_header, params=params
+        )
+        if response.status_code == 400:
+            content = json.loads(response.text)
+            if content["error_code"] == "NotUUID":
+                raise NotFound("Invalid ID specified.")
+
+        if response.status_code == 404:
+            result = response.json()
+            result.update({"status": 0})
+            return result
+
+        if response.status_code == 403:
+            raise AuthenticationFailed(
+                "Authentication Failed. Wrong API Key.")
+
+        response.raise_for_status()
+
+        if requests.codes.ok:
+            content = response.json()
+            if not result_set:
+                result["status"] = 1
+                result["is_public"] = content["is_public"]
+            result["items"].extend(content["files"])
+            result["total"] += len(content["files"])
+
+        return result
+
+    def walk(self, parent_id=None, max_workers=CONCURRENT_METADATA_REQUESTS):
+        """Iterate items of the folder and all its subfolders breadth first.
+
+        Subfolders are listed by ``max_workers`` concurrent requests, items
+        of a folder are yielded as soon as it's listed, with "path" of the
+        folder (the listed folder is "/"). Every folder is listed once, even
+        if it's found again. Subfolders which can't be listed are skipped.
+        :raises NotFoundException: if the folder doesn't exist
+        """
+        content = self.get_dashboard(parent_id)
+        if not content:
+            raise CosmosidException(
+                f"Response from service is empty for directory {parent_id}"
             )
-            if response.status_code == 400:
-                content = json.loads(response.text)
-                if content["error_code"] == "NotUUID":
-                    raise NotFound("Invalid ID specified.")
+        if not content["status"]:
+            raise NotFoundException(content["message"])
+        return self._walk(parent_id, content["items"], max_workers)
 
-            if response.status_code == 404:
-                result = response.json()
-                result.update({"status": 0})
-                return result
+    def _walk(self, parent_id, items, max_workers):
+        listed = {parent_id}
+        folders = deque()
 
-            if response.status_code == 403:
-                raise AuthenticationFailed(
-                    "Authentication Failed. Wrong API Key.")
+        def _visit(items, path):
+            for item in items:
+                item["path"] = path
+                if item.get("type") == FOLDER_TYPE and item["id"] not in listed:
+                    listed.add(item["id"])
+                    folders.append((item["id"], posixpath.join(path, item["name"])))
+            return items
 
-            response.raise_for_status()
+        found = _visit(items, "/")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            while True:
+                # subfolders are requested before the found items are consumed
+                while folders and len(futures) < max_workers:
+                    folder_id, path = folders.popleft()
+                    futures[executor.submit(self._request_dashboard, folder_id)] = (
+                        folder_id,
+                        path,
+                    )
+                yield from found
+                if not futures:
+                    return
+                found = []
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder_id, path = futures.pop(future)
+                    try:
+                        content = future.result()
+                    except (NotFound, requests.exceptions.RequestException) as err:
+                        content = {"status": 0, "message": err}
+                    if not content.get("status"):
+                        self.logger.warning(
+                            "Folder %s (id: %s) can't be listed: %s",
+                            path,
+                            folder_id,
+                            content.get("message"),
+                        )
+                        continue
+                    found.extend(_visit(content["items"], path))
 
-            if requests.codes.ok:
-                content = response.json()
-                if not result_set:
-                    result["status"] = 1
-                    result["is_public"] = content["is_public"]
-                result["items"].extend(content["files"])
-                result["total"] += len(content["files"])
+    def get_list(
+        self, parent_id=None, limit=1000, max_workers=CONCURRENT_METADATA_REQUESTS
+    ):
+        """Get the folder with "items" of all its pages and their "total".
 
+        Pages are requested concurrently as by ``iter_list``.
+        """
+        result = self.iter_list(parent_id, limit, max_workers)
+        if not result["status"]:
             return result
-
-        except AuthenticationFailed as err:
-            utils.log_traceback(err)
-        except NotFound as err:
-            utils.log_traceback(err)
-        except requests.exceptions.RequestException as err:
+        try:
+            result["items"] = list(result["items"])
+        except CosmosidException as err:
             self.logger.error("Error occurred during request")
             utils.log_traceback(err)
+        result["total"] = len(result["items"])
+        del result["server_total"]
+        return result
+
+    def iter_list(
+        self, parent_id=None, limit=1000, max_workers=CONCURRENT_METADATA_REQUESTS
+    ):
+        """Get the folder, its "items" is an iterator over items of all pages.
 
-    def get_list(self, parent_id=None, limit=1000):
+        The first page is requested at once and gives the total number of
+        items. The rest pages of ``limit`` items are requested by up to
+        ``max_workers`` concurrent requests while the items are consumed,
+        items are yielded in order. "server_total" is the number of items on
+        the server, the items without export are skipped by the iterator.
+        Errors of the rest pages are raised by the iterator as
+        CosmosidException.
+        """
         params = {"limit": limit, "offset": 0}
         if parent_id:
             params["folder_id"] = parent_id
-        result = {"items": [], "total": 0, "status": 1}
-        result_set = False
         try:
-            while True:
-                response = requests.get(
-                    self.request_url_files, headers=self.auth_header, params=params
-                )
-                if response.status_code == 400:
-                    content = json.loads(response.text)
-                    if content["error_code"] == "NotUUID":
-                        raise NotFound("Invalid ID specified.")
-
-                if response.status_code == 404:
-                    result = response.json()
-                    result.update({"status": 0})
-                    return result
-
-                if response.status_code == 403:
-                    raise AuthenticationFailed(
-                        "Authentication Failed. Wrong API Key.")
-
-                response.raise_for_status()
-
-                if requests.codes.ok:
-                    content = response.json()
-                    if not result_set:
-                        result["status"] = 1
-                        result["name"] = content["name"]
-                        result["is_public"] = content["is_public"]
-                        result["breadcrumbs"] = content["breadcrumbs"]
-                    # microbiom standard doesn't have an export
-                    items = [i for i in content["items"]
-                             if i["content_type"] != 7]
-                    result["items"].extend(items)
-                    result["total"] += len(items)
-                    if content["total"] < limit:
-                        break
-                    params["offset"] += limit
-            return result
-
+            response = self._request_files_page(params)
+            if response.status_code == 404:
+                result = response.json()
+                result.update({"status": 0})
+                return result
+            content = response.json()
+            return {
+                "status": 1,
+                "name": content["name"],
+                "is_public": content["is_public"],
+                "breadcrumbs": content["breadcrumbs"],
+                "server_total": content["total"],
+                "items": self._iter_items(content, params, limit, max_workers),
+            }
         except AuthenticationFailed as err:
             utils.log_traceback(err)
         except NotFound as err:
@@ -123,12 +209,61 @@ class Files(object):
             self.logger.error("Error occurred during request")
             utils.log_traceback(err)
 
+    def _request_files_page(self, params):
+        response = self.transport.get(
+            self.request_url_files, headers=self.auth_header, params=params
+        )
+        if response.status_code == 400:
+            content = json.loads(response.text)
+            if content["error_code"] == "NotUUID":
+                raise NotFound("Invalid ID specified.")
+        if response.status_code == 403:
+            raise AuthenticationFailed(
+                "Authentication Failed. Wrong API Key.")
+        if response.status_code != 404:
+            response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _exportable(items):
+        # microbiom standard doesn't have an export
+        return [i for i in items if i["content_type"] != 7]
+
+    def _iter_items(self, content, params, limit, max_workers):
+        yield from self._exportable(content["items"])
+        offsets = deque(range(limit, content["total"], limit))
+        if not offsets:
+            return
+        pages = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                try:
+                    while offsets or pages:
+                        # at most max_workers pages are requested or kept ahead
+                        while offsets and len(pages) < max_workers:
+                            page_params = dict(params, offset=offsets.popleft())
+                            pages.append(
+                                executor.submit(self._request_files_page, page_params)
+                            )
+                        response = pages.popleft().result()
+                        response.raise_for_status()
+                        yield from self._exportable(response.json()["items"])
+                finally:
+                    # the caller may stop before the last page
+                    for page in pages:
+                        page.cancel()
+        except requests.exceptions.RequestException as err:
+            # the consumer handles errors, the process isn't exited mid-iteration
+            raise CosmosidConnectionError(
+                f"Error occurred during request: {err}"
+            ) from err
+
     def get_file(self, file_id=None):
         request_url = self.request_url_files + \
             (f"/{file_id}" if file_id else "")
         results = {}
         try:
-            results = requests.get(request_url, headers=self.auth_header)
+            results = self.transport.get(request_url, headers=self.auth_header)
             if (
                 results.status_code == 400
                 and json.loads(results.text)["error_code"] == "NotUUID"
@@ -169,7 +304,7 @@ class Files(object):
             parent_id = 0 # to make falsy value
         data = {"type": 1, "parent": parent_id, "name": name}
         try:
-            response = requests.post(
+            response = self.transport.post(
                 request_url, headers=self.auth_header, json=data
             )
         except requests.exceptions.RequestException as err:
@@ -219,13 +354,35 @@ class Runs(Files):
             utils.log_traceback(err)
 
     def get_single_run(self, run_id):
+        """Get metadata of the run, found runs are cached for a short time."""
+        run = RUNS_CACHE.get(
+            (self.base_url, self.auth_header["X-Api-Key"], run_id),
+            partial(self._request_single_run, run_id),
+        )
+        # callers may change the result, the cached one stays intact
+        return dict(run) if run else run
+
+    def get_runs_metadata(self, runs_ids):
+        """Get metadata of runs by concurrent requests.
+
+        :return: dict of metadata by run id, None for failed requests
+        """
+        runs_ids = list(dict.fromkeys(runs_ids))
+        if not runs_ids:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=min(CONCURRENT_METADATA_REQUESTS, len(runs_ids))
+        ) as executor:
+            return dict(zip(runs_ids, executor.map(self.get_single_run, runs_ids)))
+
+    def _request_single_run(self, run_id):
         run_metadata_url = (
             f"{self.base_url}{self.__single_run_path.format(run_id=run_id)}"
         )
 
         results = {}
         try:
-            results = requests.get(run_metadata_url, headers=self.auth_header)
+            results = self.transport.get(run_metadata_url, headers=self.auth_header)
             if (
                 results.status_code == 400
                 and json.loads(results.text)["error_code"] == "NotUUID"
@@ -268,7 +425,7 @@ class Runs(Files):
 
             if not file_metadata.get("status"):
                 raise NotFoundException(file_metadata["message"])
-            results = requests.get(sample_runs_url, headers=self.auth_header)
+            results = self.transport.get(sample_runs_url, headers=self.auth_header)
             if (
                 results.status_code == 400
                 and json.loads(results.text)["error_code"] == "NotUUID"
@@ -284,22 +441,24 @@ class Runs(Files):
                     "Authentication Failed. Wrong API Key.")
             results.raise_for_status()
             if requests.codes.ok:
-                results = results.json()
-                if results:
-                    file_name = ""
-                    for index, run in enumerate(results["runs"]):
-                        run_url = f"{self.base_url}{self.__single_run_path.format(run_id=run['id'])}"
-                        run_results = requests.get(run_url, headers=self.auth_header)
-                        run_results = run_results.json()
-                        if run_results["workflows"]["name"] in ("import",):
-                            del results["runs"][index]
-                        run["workflow_name"] = run_results["workflows"]["name"]
-                        run["workflow_version"] = run_results["workflows"]["version"]
-                        run["artifact_types"] = ",".join(run_results["artifacts"])
-                        if not file_name:
-                            file_name = run_results["file"]["name"]
-                        results["file_name"] = file_name
-                    return results
+                results = results.json() or {}
+                runs = results.get("runs", [])
+                runs_metadata = self.get_runs_metadata(run["id"] for run in runs)
+                results["runs"] = []
+                for run in runs:
+                    run_metadata = runs_metadata[run["id"]]
+                    if not (run_metadata and run_metadata.get("status")):
+                        self.logger.warning(
+                            "Metadata of run %s is not available", run["id"]
+                        )
+                        run_metadata = {}
+                    workflow = run_metadata.get("workflows") or {}
+                    if workflow.get("name") in ("import",):
+                        continue
+                    run["workflow_name"] = workflow.get("name")
+                    run["workflow_version"] = workflow.get("version")
+                    run["artifact_types"] = ",".join(run_metadata.get("artifacts", []))
+                    results["runs"].append(run)
 
                 results.update({"status": 1})
                 results.update({"file_name": file_metadata["name"]})
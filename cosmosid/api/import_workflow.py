@@ -2,18 +2,19 @@
 import json
 import logging
 
-from requests import post
 from requests.exceptions import JSONDecodeError, RequestException, HTTPError
 from cosmosid.enums import Workflows
+from cosmosid.helpers.transport import default_transport
 
 LOGGER = logging.getLogger(__name__)
 
 
 class ImportWorkflow(object):
-    def __init__(self, base_url=None, api_key=None):
+    def __init__(self, base_url=None, api_key=None, transport=None):
         self.base_url = base_url
         self.logger = LOGGER
         self.header = {"X-Api-Key": api_key, "Content-Type": "application/json"}
+        self.transport = transport or default_transport()
 
     def import_workflow(self, workflow_ids, pairs, file_type, folder_id=None, host_name=None, forward_primer=None, reverse_primer=None):
         upload_url = f'{self.base_url}/api/workflow/v1/workflows/{Workflows.BatchImport}/start'
@@ -50,7 +51,7 @@ class ImportWorkflow(object):
             "workflows": workflows_with_parameters
         }
         try:
-            response = post(
+            response = self.transport.post(
                 upload_url,
                 data=json.dumps(payload),
                 headers=self.header,
@@ -17,7 +17,9 @@ from cosmosid.helpers.exceptions import (
     ReportGenerationTimeout,
     ValidationError,
 )
-from cosmosid.utils import progress, requests_retry_session
+from cosmosid.helpers.writer import BlockWriter
+from cosmosid.helpers.transport import default_transport
+from cosmosid.utils import progress
 
 LOGEGR = logging.getLogger(__name__)
 
@@ -32,15 +34,20 @@ class RunReportResponseStatus:
 class Reports(object):
     _resource_path = "/api/metagenid/v2/files/report/tsv"
 
-    def __init__(self, base_url=None, api_key=None, file_id=None, timeout=5 * 60):
+    def __init__(
+        self, base_url=None, api_key=None, file_id=None, timeout=5 * 60, transport=None
+    ):
         self.base_url = base_url
         self.logger = LOGEGR
         self.header = {"X-Api-Key": api_key}
         self.report_type = None
         self.file_id = file_id
-        self.run_o = Runs(base_url=self.base_url, api_key=self.header["X-Api-Key"])
-        self.session = requests_retry_session(self.header)
-        self.session.headers.update()
+        self.transport = transport or default_transport()
+        self.run_o = Runs(
+            base_url=self.base_url,
+            api_key=self.header["X-Api-Key"],
+            transport=self.transport,
+        )
         self.timeout = timeout
 
     def await_report_task(self, task_id, timeout=5 * 60):
@@ -48,7 +55,7 @@ class Reports(object):
         start_time = time.time()
         self.logger.info("Awaiting the report task to be scheduled and complete.")
         while time.time() < start_time + timeout:
-            result = self.session.get(task_url, headers=self.header)
+            result = self.transport.get(task_url, headers=self.header)
             result.raise_for_status()
             task_data = json.loads(result.text)
             if task_data["status"] == RunReportResponseStatus.COMPLETED:
@@ -76,7 +83,7 @@ class Reports(object):
 
         # TODO: propagate supported type and tax_level
         params = {"files": [self.file_id]}
-        results = self.session.post(request_url, json=params, headers=self.header)
+        results = self.transport.post(request_url, json=params, headers=self.header)
 
         if results.status_code == 403:
             raise AuthenticationFailed("Authentication Failed. Wrong API Key")
@@ -130,8 +137,8 @@ class Reports(object):
             out_file = join(out_dir, file_name)
             if isfile(out_file):
                 raise FileExistsException("Destination File exists: %s" % out_file)
-            with open(out_file, "wb") as output:
-                with urllib.request.urlopen(report_data["url"]) as response:
+            with urllib.request.urlopen(report_data["url"]) as response:
+                with BlockWriter(out_file, response.length) as output:
                     _download_helper(response, output)
 
             return {"status": 1, "saved_report": out_file}
@@ -1,9 +1,14 @@
 """Interactions with CosmosID's and S3's APIs regarding file uploads to S3."""
 
+import json
 import logging
+import math
 import os
 import sys
+import threading
+import time
 import types
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import boto3
 import requests
@@ -16,13 +21,33 @@ from s3transfer.utils import OSUtils, ReadFileChunk
 
 from cosmosid.api import urls
 from cosmosid.api.files import Files
+from cosmosid.config import (
+    CACHE_DIR,
+    CONCURRENT_UPLOADS,
+    UPLOAD_BYTES_IN_FLIGHT,
+    UPLOAD_CACHE,
+    UPLOAD_MMAP,
+    UPLOAD_TUNING,
+)
 from cosmosid.helpers.exceptions import (
     AuthenticationFailed,
     NotEnoughCredits,
     NotFoundException,
     UploadException,
 )
-from cosmosid.utils import LOCK, do_not_retry_event, requests_retry_session, retry
+from cosmosid.helpers.rate_limiter import UPLOAD_BUCKET, upload_limiter
+from cosmosid.helpers.thread_logger import ThreadLogger
+from cosmosid.helpers.transport import default_transport
+from cosmosid.helpers.upload import MmapFileChunk
+from cosmosid.helpers.upload_cache import ContentHasher, UploadCache
+from cosmosid.helpers.upload_journal import UploadJournal
+from cosmosid.utils import (
+    LOCK,
+    do_not_retry_event,
+    presigned_url_expiry,
+    requests_retry_session,
+    retry,
+)
 
 LOGGER = logging.getLogger(__name__)
 KB = 1024
@@ -34,12 +59,52 @@ if sys.platform.startswith("win"):
     MAX_CHUNK_SIZE = 1.9 * GB
 MIN_CHUNK_SIZE = 1 * GB
 MAX_CONCURRENCY = 5
+# parameters of "adaptive" upload tuning
+MIN_PART_SIZE = 64 * MB
+MAX_PART_SIZE = 256 * MB
+MAX_PARTS = 10000
+ADAPTIVE_MAX_CONCURRENCY = 10
+PART_UPLOAD_TIME = 30  # seconds
+PREFETCH_THREADS = 2
+# pre-signed URL which expires sooner is requested again
+URL_EXPIRATION_MARGIN = 60  # seconds
+THROUGHPUT_FILE = os.path.join(CACHE_DIR, "upload_throughput.json")
+# set in the thread which reports a part uploaded before resume as transferred
+RESUMED_PART = threading.local()
 
 
 class OSUtilsWithCallbacks(OSUtils):
-    """Abstruction for manipulations on file[-like] objects."""
+    """Abstruction for manipulations on file[-like] objects.
+
+    Parts of the uploaded file are read through memory maps if ``filename``
+    is given, and hashed by ``hasher`` if it's given.
+    """
+
+    def __init__(self, filename=None, hasher=None):
+        super().__init__()
+        self._filename = filename if UPLOAD_MMAP else None
+        self._hasher = hasher
+
+    def _open_mmap_chunk(self, start_byte, size, callbacks, close_callbacks=None):
+        try:
+            return MmapFileChunk(
+                self._filename,
+                start_byte,
+                size,
+                callbacks,
+                enable_callbacks=True,
+                close_callbacks=close_callbacks,
+                hasher=self._hasher,
+            )
+        except (OSError, ValueError) as error:
+            LOGGER.debug("Can't map %s: %s", self._filename, error)
+            return None
 
     def open_file_chunk_reader(self, filename, start_byte, size, callbacks):
+        if self._filename == filename:
+            chunk = self._open_mmap_chunk(start_byte, size, callbacks)
+            if chunk:
+                return chunk
         return ReadFileChunk.from_filename(
             filename, start_byte, size, callbacks, enable_callbacks=True
         )
@@ -47,6 +112,14 @@ class OSUtilsWithCallbacks(OSUtils):
     def open_file_chunk_reader_from_fileobj(
         self, fileobj, chunk_size, full_file_size, callbacks, close_callbacks=None
     ):
+        if self._filename:
+            # fileobj is a deferred file, it's not opened by tell()
+            chunk = self._open_mmap_chunk(
+                fileobj.tell(), chunk_size, callbacks, close_callbacks
+            )
+            if chunk:
+                fileobj.close()
+                return chunk
         return ReadFileChunk(
             fileobj,
             chunk_size,
@@ -60,17 +133,25 @@ class OSUtilsWithCallbacks(OSUtils):
 class ProgressSubscriber(BaseSubscriber):
     """Progress subscriber for any number of upload threads."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, thread_logger=None):
         self._filename = filename
         self._size = float(os.path.getsize(filename))
         self._seen_so_far = 0
         self._lock = LOCK
+        self._thread_logger = thread_logger
 
     def on_progress(self, future, bytes_transferred, **kwargs):
         """Callback to be invoked when progress is made on transfer."""
         with self._lock:
             self._seen_so_far += bytes_transferred
-            percentage = (self._seen_so_far / self._size) * 100
+            percentage = (self._seen_so_far / self._size) * 100 if self._size else 100
+            if self._thread_logger:
+                self._thread_logger.info(
+                    self._filename,
+                    "%sMB / %sMB  (%.2f%%)"
+                    % (int(self._seen_so_far / MB), int(self._size / MB), percentage),
+                )
+                return
             sys.stdout.write(
                 "\r%s  %sMB / %sMB  (%.2f%%)"
                 % (
@@ -83,17 +164,130 @@ class ProgressSubscriber(BaseSubscriber):
             sys.stdout.flush()
 
 
-def create_client(base_url, api_key):
+class RateLimitSubscriber(BaseSubscriber):
+    """Throttles reading of the uploaded file by the rate limiter.
+
+    Progress callbacks are invoked by the thread which reads the file body
+    for the S3 request, so waiting here slows the request down.
+    """
+
+    def __init__(self, limiter):
+        self._limiter = limiter
+
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        # negative progress means retry of the part, its bytes are sent again
+        if not getattr(RESUMED_PART, "reported", False):
+            self._limiter.consume(bytes_transferred)
+
+
+class PresignedUrlPrefetcher:
+    """Requests pre-signed URLs of upcoming parts ahead of their upload.
+
+    URLs of the window of parts following the requested one are fetched in
+    background threads, so S3 PUTs don't wait for CosmosID's API.
+    """
+
+    def __init__(self, client, template, parts_count, window):
+        self._client = client
+        # arguments of upload_part request without PartNumber and Body
+        self._template = template
+        self._parts_count = parts_count
+        self._window = window
+        self._futures = {}
+        self._requested = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+
+    def _request_url(self, part_number):
+        data = dict(self._template, PartNumber=part_number)
+        response = self._client.api_session.get(
+            self._client.burl, json=data, headers=self._client.header, timeout=5
+        )
+        if response.status_code == requests.codes.ok:
+            return response.json()
+        return None
+
+    def _schedule(self, part_number):
+        journal = self._client.journal
+        last_part = min(part_number + self._window, self._parts_count + 1)
+        for number in range(part_number + 1, last_part):
+            if number in self._requested or (journal and journal.get_etag(number)):
+                continue
+            self._requested.add(number)
+            self._futures[number] = self._executor.submit(self._request_url, number)
+
+    def get(self, part_number):
+        """Return pre-signed URL of the part, None if it wasn't prefetched."""
+        with self._lock:
+            self._requested.add(part_number)
+            self._schedule(part_number)
+            future = self._futures.pop(part_number, None)
+        if future is None:
+            return None
+        try:
+            url = future.result()
+        except Exception as error:
+            LOGGER.debug("URL of part %s was not prefetched: %s", part_number, error)
+            return None
+        expiry = url and presigned_url_expiry(url)
+        if expiry and expiry < time.time() + URL_EXPIRATION_MARGIN:
+            return None
+        return url
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False)
+
+
+class BytesInFlight:
+    """Limits the total size of files transferred at the same time.
+
+    A file bigger than the limit is still allowed, but only when nothing
+    else is being transferred.
+    """
+
+    def __init__(self, limit):
+        self._limit = limit
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: not self._in_flight or self._in_flight + size <= self._limit
+            )
+            self._in_flight += size
+
+    def release(self, size):
+        with self._condition:
+            self._in_flight -= size
+            self._condition.notify_all()
+
+
+def create_client(base_url, api_key, pool_size=MAX_CONCURRENCY, transport=None):
     """Create boto3 s3 client.
 
     Addss methods to the client for CosmosID's and S3's upload/download
-    operations.
+    operations. Requests of all threads reuse keep-alive connections of
+    the client's sessions: ``api_session`` is the session of the shared
+    ``transport`` for CosmosID's API, ``s3_session`` for S3 has its own
+    pool of ``pool_size`` connections to upload parts of the file at once.
     """
     client = boto3.client("s3")
+    client.pool_size = pool_size
+    client.api_session = (transport or default_transport()).session
+    client.s3_session = requests_retry_session(pool_maxsize=pool_size)
     client.base_url = base_url
     client.header = {"X-Api-Key": api_key}
     client.burl = client.base_url + urls.UPLOAD_BFILE_URL
     client.surl = client.base_url + urls.UPLOAD_SFILE_URL
+    client.journal = None
+    # amount of parts of the current multipart upload, enables URLs prefetching
+    client.parts_count = None
+    client.url_prefetcher = None
     client.create_multipart_upload = types.MethodType(create_multipart_upload, client)
     client.abort_multipart_upload = types.MethodType(abort_multipart_upload, client)
     client.upload_part = types.MethodType(upload_part, client)
@@ -108,10 +302,14 @@ def create_client(base_url, api_key):
 def create_multipart_upload(self, *args, **kwargs):
     """Requests to CosmosID's API to initiate the multipart upload."""
     data = dict(kwargs)
-    mp_up = requests.put(self.burl, json=data, headers=self.header, timeout=10)
+    if self.journal and self.journal.upload_id:
+        return {"UploadId": self.journal.upload_id}
+    mp_up = self.api_session.put(self.burl, json=data, headers=self.header, timeout=10)
     resp = dict()
     if mp_up.status_code == requests.codes.ok:
         resp = mp_up.json()
+        if self.journal and resp.get("UploadId"):
+            self.journal.set_upload_id(resp["UploadId"])
     return resp
 
 
@@ -122,29 +320,72 @@ def abort_multipart_upload(self, *args, **kwargs):
     Amazon S3 retains all the parts until you either complete or abort the
     upload. Throughout its lifetime, you are billed for all storage,
     bandwidth, and requests for this multipart upload and its associated parts.
+
+    Uploads recorded in the journal are kept, so they can be resumed.
     """
     data = dict(kwargs)
-    ab_mp = requests.delete(self.burl, json=data, headers=self.header, timeout=5)
+    if self.journal and self.journal.upload_id == data.get("UploadId"):
+        LOGGER.info("Uploaded parts of %s are kept to resume upload", data.get("Key"))
+        return {}
+    ab_mp = self.api_session.delete(
+        self.burl, json=data, headers=self.header, timeout=5
+    )
     if not ab_mp:
         raise Exception
     return ab_mp.json()
 
 
+def get_part_url(client, data):
+    """Return pre-signed URL for upload_part request."""
+    if client.parts_count:
+        with LOCK:
+            if client.url_prefetcher is None:
+                template = {
+                    key: value for key, value in data.items() if key != "PartNumber"
+                }
+                client.url_prefetcher = PresignedUrlPrefetcher(
+                    client, template, client.parts_count, 2 * client.pool_size
+                )
+        url = client.url_prefetcher.get(data["PartNumber"])
+        if url:
+            return url
+    url_ = client.api_session.get(
+        client.burl, json=data, headers=client.header, timeout=5
+    )
+    if url_.status_code == requests.codes.ok:
+        return url_.json()
+    return None
+
+
 @retry(logger=LOGGER, tries=3)
 def upload_part(self, *args, **kwargs):
     """Uploads data part to S3.
 
     Requests pre-signed URL from CosmosID's API. Uses it to upload data
-    to S3.
+    to S3. Parts recorded in the journal are not uploaded again.
     """
     data = dict(kwargs)
     resp = None
     upload_body = data.pop("Body")
-    url_ = requests.get(self.burl, json=data, headers=self.header, timeout=5)
-    if url_.status_code == requests.codes.ok:
-        resp = requests.put(url_.json(), upload_body)
+    etag = self.journal and self.journal.get_etag(data["PartNumber"])
+    if etag:
+        # report the part as transferred without reading it
+        RESUMED_PART.reported = True
+        try:
+            upload_body.seek(0, 2)
+        finally:
+            RESUMED_PART.reported = False
+        return {"ETag": etag}
+    url = get_part_url(self, data)
+    if url:
+        # the body could be partially sent by the previous try
+        upload_body.seek(0)
+        resp = self.s3_session.put(url, upload_body)
         if resp.headers:
-            return dict(resp.headers)
+            headers = dict(resp.headers)
+            if self.journal and headers.get("ETag"):
+                self.journal.add_part(data["PartNumber"], headers["ETag"])
+            return headers
     raise Exception("Upload issues.")
 
 
@@ -157,9 +398,10 @@ def put_object(self, *args, **kwargs):
     data = dict(kwargs)
     upload_body = data.pop("Body")
     resp = None
-    url_ = requests.get(self.surl, json=data, headers=self.header)
+    url_ = self.api_session.get(self.surl, json=data, headers=self.header)
     if url_.status_code == requests.codes.ok:
-        resp = requests.put(url_.json(), upload_body)
+        upload_body.seek(0)
+        resp = self.s3_session.put(url_.json(), upload_body)
         if resp.headers:
             return dict(resp.headers)
     raise Exception("Upload issues.")
@@ -175,57 +417,181 @@ def complete_multipart_upload(self, *args, **kwargs):
     for a short period after the upload is successfully completed.
     """
     data = dict(kwargs)
-    cmp_up = requests.post(self.burl, json=data, headers=self.header, timeout=60)
+    cmp_up = self.api_session.post(
+        self.burl, json=data, headers=self.header, timeout=60
+    )
     if cmp_up:
         return cmp_up.json()
     raise Exception("complete_multipart_upload did not succeed.")
 
 
+def load_throughput():
+    """Return upload throughput (bytes/s) measured on previous uploads."""
+    try:
+        with open(THROUGHPUT_FILE, "r") as throughput_file:
+            return float(json.load(throughput_file)["throughput"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_throughput(file_size, elapsed):
+    """Store smoothed upload throughput for planning of next uploads."""
+    if file_size < MIN_PART_SIZE or elapsed <= 0:
+        return
+    throughput = file_size / elapsed
+    previous = load_throughput()
+    if previous:
+        throughput = (throughput + previous) / 2
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with LOCK, open(THROUGHPUT_FILE, "w") as throughput_file:
+            json.dump({"throughput": throughput}, throughput_file)
+    except OSError as error:
+        LOGGER.debug("Upload throughput is not saved: %s", error)
+
+
+def plan_upload(file_size, tuning=UPLOAD_TUNING, throughput=None):
+    """Choose multipart threshold, part size and amount of threads for a file.
+
+    :param file_size: size of the file in bytes
+    :param tuning: "adaptive" or "fixed"
+    :param throughput: measured upload throughput in bytes/s
+    :return: (multipart_threshold, multipart_chunksize, max_concurrency)
+    """
+    if tuning == "fixed":
+        multipart_chunksize = file_size
+        if file_size > MULTIPART_THRESHOLD:
+            # parts are aligned to MB for ContentHasher
+            multipart_chunksize = min(
+                MB * math.ceil(file_size / 10 / MB), int(MAX_CHUNK_SIZE)
+            )
+            multipart_chunksize = max(multipart_chunksize, int(MIN_CHUNK_SIZE))
+        return MULTIPART_THRESHOLD, multipart_chunksize, MAX_CONCURRENCY
+
+    multipart_chunksize = MIN_PART_SIZE
+    if throughput:
+        # a part should be uploaded by one of the threads in PART_UPLOAD_TIME
+        multipart_chunksize = throughput / ADAPTIVE_MAX_CONCURRENCY * PART_UPLOAD_TIME
+    multipart_chunksize = min(max(multipart_chunksize, MIN_PART_SIZE), MAX_PART_SIZE)
+    # S3 doesn't allow more than 10000 parts
+    multipart_chunksize = max(multipart_chunksize, math.ceil(file_size / MAX_PARTS))
+    multipart_chunksize = min(
+        MB * math.ceil(multipart_chunksize / MB), int(MAX_CHUNK_SIZE)
+    )
+    max_concurrency = min(
+        ADAPTIVE_MAX_CONCURRENCY, max(1, math.ceil(file_size / multipart_chunksize))
+    )
+    return multipart_chunksize, multipart_chunksize, max_concurrency
+
+
+def check_parent_folder(parent_id, base_url, api_key, transport=None):
+    """Raise NotFoundException if given parent folder doesn't exist."""
+    fl_obj = Files(base_url=base_url, api_key=api_key, transport=transport)
+    res = fl_obj.iter_list(parent_id=parent_id, limit=1)
+    if not res["status"]:
+        raise NotFoundException("Parent folder for upload doesn't exist.")
+
+
+def discard_stale_upload(client, journal):
+    """Abort the upload of the previous version of the file."""
+    stale = journal.stale
+    if stale and stale.get("upload_id"):
+        LOGGER.info(
+            "%s was changed, its unfinished upload is aborted", journal.filename
+        )
+        client.abort_multipart_upload(
+            Bucket=stale["upload_source"],
+            Key=stale["upload_key"],
+            UploadId=stale["upload_id"],
+        )
+    journal.stale = None
+
+
 def upload_file(**kwargs):
     """Upload manager."""
     filename = kwargs.get("file")
     parent_id = kwargs.get("parent_id", None)
     base_url = kwargs.get("base_url")
     api_key = kwargs.get("api_key")
-    multipart_chunksize = file_size = os.stat(filename)[6]  # get size of file in bytes
-    client = create_client(base_url=base_url, api_key=api_key)
+    check_parent = kwargs.get("check_parent", True)
+    thread_logger = kwargs.get("thread_logger")
+    tuning = kwargs.get("tuning") or UPLOAD_TUNING
+    use_cache = kwargs.get("use_cache", UPLOAD_CACHE)
+    file_rate_limit = kwargs.get("file_rate_limit")
+    transport = kwargs.get("transport")
+    file_size = os.stat(filename)[6]  # get size of file in bytes
+    cache = hasher = None
+    if use_cache:
+        cache = UploadCache(base_url, api_key)
+        upload_key = cache.lookup(filename)
+        if upload_key:
+            LOGGER.info("%s was already uploaded, the upload is reused", filename)
+            return upload_key
+        hasher = ContentHasher(file_size)
+    journal = None
+    multipart_threshold, multipart_chunksize, max_concurrency = plan_upload(
+        file_size, tuning, load_throughput()
+    )
+    client = create_client(
+        base_url=base_url,
+        api_key=api_key,
+        pool_size=max_concurrency,
+        transport=transport,
+    )
 
-    if file_size > MULTIPART_THRESHOLD:  # bigger that 1GB
-        multipart_chunksize = min(int(file_size / 10), int(MAX_CHUNK_SIZE))
-        multipart_chunksize = max(multipart_chunksize, int(MIN_CHUNK_SIZE))
+    if file_size >= multipart_threshold:
+        journal = UploadJournal(filename, base_url, api_key)
+        discard_stale_upload(client, journal)
+        if journal.chunksize:
+            # parts of the resumed upload must keep their boundaries
+            multipart_chunksize = journal.chunksize
+        client.journal = journal
+        client.parts_count = math.ceil(file_size / multipart_chunksize)
         LOGGER.info("File size: %s MB", file_size / MB)
         LOGGER.info("Chunk size: %s MB", int(multipart_chunksize / MB))
     config = TransferConfig(
-        multipart_threshold=MULTIPART_THRESHOLD,
-        max_concurrency=MAX_CONCURRENCY,
+        multipart_threshold=multipart_threshold,
+        max_concurrency=max_concurrency,
         multipart_chunksize=multipart_chunksize,
     )
-    osutil = OSUtilsWithCallbacks()
+    osutil = OSUtilsWithCallbacks(filename, hasher)
     # Check if given parent folder exists
-    if parent_id:
-        fl_obj = Files(base_url=base_url, api_key=api_key)
-        res = fl_obj.get_list(parent_id=parent_id, limit=1)
-        if not res["status"]:
-            raise NotFoundException("Parent folder for upload doesn't exist.")
+    if parent_id and check_parent:
+        check_parent_folder(parent_id, base_url, api_key, transport)
 
     transfer_manager = TransferManager(client, config=config, osutil=osutil)
 
     subscribers = [
-        ProgressSubscriber(filename),
+        ProgressSubscriber(filename, thread_logger=thread_logger),
+        RateLimitSubscriber(upload_limiter(file_rate_limit)),
     ]
 
     _, file_name = os.path.split(filename)
+    resumed = bool(journal and journal.sources)
     try:
-        init_url = client.base_url + urls.UPLOAD_INIT_URL
-        response = requests_retry_session().put(
-            init_url, json=dict(file_name=file_name), headers=client.header
-        )
-        if response.status_code == 402:
-            raise NotEnoughCredits("Insufficient credits for upload.")
-        if response.status_code == 403:
-            raise AuthenticationFailed("Authentication Failed. Wrong API Key.")
-        if response.status_code == requests.codes.ok:
-            sources = response.json()
+        if resumed:
+            LOGGER.info(
+                "Resuming upload of %s, %s parts were already uploaded",
+                filename,
+                len(journal.parts),
+            )
+            response = None
+            sources = journal.sources
+        else:
+            init_url = client.base_url + urls.UPLOAD_INIT_URL
+            response = client.api_session.put(
+                init_url, json=dict(file_name=file_name), headers=client.header
+            )
+            if response.status_code == 402:
+                raise NotEnoughCredits("Insufficient credits for upload.")
+            if response.status_code == 403:
+                raise AuthenticationFailed("Authentication Failed. Wrong API Key.")
+        if resumed or response.status_code == requests.codes.ok:
+            if not resumed:
+                sources = response.json()
+                if journal:
+                    journal.start(sources, multipart_chunksize)
+            started = time.time()
             future = transfer_manager.upload(
                 filename,
                 sources["upload_source"],
@@ -247,6 +613,21 @@ def upload_file(**kwargs):
         except KeyboardInterrupt:
             do_not_retry_event.set()
             return
+        except Exception:
+            if resumed and not journal.parts_added:
+                # the stored upload can't be continued, start from scratch next time
+                journal.remove()
+            raise
+        finally:
+            if client.url_prefetcher:
+                client.url_prefetcher.close()
+        if journal:
+            journal.remove()
+        if not resumed:
+            save_throughput(file_size, time.time() - started)
+        digest = hasher and hasher.hexdigest()
+        if digest:
+            cache.add(filename, digest, sources["upload_key"])
         return sources["upload_key"]
 
         # If a client error was raised, add the backwards compatibility layer
@@ -260,7 +641,95 @@ def upload_file(**kwargs):
         ) from error
 
 
-def upload_and_save(files, parent_id, file_type, base_url, api_key):
+def upload_pairs(
+    pairs,
+    file_type,
+    parent_id,
+    base_url,
+    api_key,
+    concurrent_uploads=None,
+    bytes_in_flight=None,
+    tuning=None,
+    use_cache=UPLOAD_CACHE,
+    rate_limit=None,
+    file_rate_limit=None,
+    transport=None,
+):
+    """
+    Upload files of all pairs concurrently.
+    :param pairs: list of dicts, each of them has 'files' - list of file paths
+    :param concurrent_uploads: max amount of files uploaded at the same time
+    :param bytes_in_flight: max total size of files uploaded at the same time
+    :param tuning: upload tuning mode, see plan_upload
+    :param use_cache: reuse uploads of identical files, see UploadCache
+    :param rate_limit: max total upload rate (bytes per second, 0 - no limit)
+    :param file_rate_limit: max upload rate of a single file
+    :param transport: Transport of requests to the API
+    :return: list of uploaded S3 keys for every pair, in order of pair['files']
+    """
+    if parent_id:
+        check_parent_folder(parent_id, base_url, api_key, transport)
+
+    limit = BytesInFlight(bytes_in_flight or UPLOAD_BYTES_IN_FLIGHT)
+    if rate_limit is not None:
+        UPLOAD_BUCKET.set_rate(rate_limit)
+    thread_logger = ThreadLogger()
+
+    def _upload(filename):
+        size = os.path.getsize(filename)
+        limit.acquire(size)
+        try:
+            upload_key = upload_file(
+                file=filename,
+                file_type=file_type,
+                parent_id=parent_id,
+                api_key=api_key,
+                base_url=base_url,
+                check_parent=False,
+                thread_logger=thread_logger,
+                tuning=tuning,
+                use_cache=use_cache,
+                file_rate_limit=file_rate_limit,
+                transport=transport,
+            )
+        finally:
+            limit.release(size)
+        if not upload_key:
+            raise UploadException(f"{filename} was not uploaded.")
+        thread_logger.info(filename, "Uploaded.")
+        return upload_key
+
+    keys = [[None] * len(pair["files"]) for pair in pairs]
+    thread_logger.start()
+    cancelled = False
+    try:
+        with ThreadPoolExecutor(
+            max_workers=concurrent_uploads or CONCURRENT_UPLOADS
+        ) as executor:
+            future_to_position = {
+                executor.submit(_upload, filename): (pair_index, file_index)
+                for pair_index, pair in enumerate(pairs)
+                for file_index, filename in enumerate(pair["files"])
+            }
+            try:
+                for future in as_completed(future_to_position):
+                    pair_index, file_index = future_to_position[future]
+                    keys[pair_index][file_index] = future.result()
+            except BaseException:
+                # running uploads stop retrying, the executor waits for them
+                cancelled = True
+                do_not_retry_event.set()
+                for future in future_to_position:
+                    future.cancel()
+                raise
+    finally:
+        if cancelled:
+            do_not_retry_event.clear()
+        thread_logger.stop()
+    return keys
+
+
+def upload_and_save(files, parent_id, file_type, base_url, api_key, transport=None):
     """
     Upload list of files and save them
     :param files: list of dicts where each file is:
@@ -273,8 +742,9 @@ def upload_and_save(files, parent_id, file_type, base_url, api_key):
     :param file_type: type of analysis (shotgun, amplicon, ...)
     :param base_url: base url of api
     :param api_key: api key of current user
+    :param transport: Transport of requests to the API
     """
-    client = create_client(base_url=base_url, api_key=api_key)
+    client = create_client(base_url=base_url, api_key=api_key, transport=transport)
     try:
         items = []
         for file_name in files["files"]:
@@ -285,6 +755,7 @@ def upload_and_save(files, parent_id, file_type, base_url, api_key):
                     parent_id=parent_id,
                     api_key=api_key,
                     base_url=base_url,
+                    transport=transport,
                 )
             )
         data = dict(
@@ -294,7 +765,7 @@ def upload_and_save(files, parent_id, file_type, base_url, api_key):
             file_type=file_type,
         )
         create_file_url = client.base_url + urls.SAMPLES_URL
-        create_response = requests_retry_session().post(
+        create_response = client.api_session.post(
             create_file_url, json=data, headers=client.header
         )
         if create_response.status_code == 200:
@@ -312,10 +783,10 @@ def upload_and_save(files, parent_id, file_type, base_url, api_key):
         return False
 
 
-def pricing(data, base_url, api_key):
-    client = create_client(base_url=base_url, api_key=api_key)
+def pricing(data, base_url, api_key, transport=None):
+    client = create_client(base_url=base_url, api_key=api_key, transport=transport)
     pricing_url = client.base_url + urls.SAMPLES_PRICING_URL
-    pricing_response = requests_retry_session().post(
+    pricing_response = client.api_session.post(
         url=pricing_url, json={"data": data}, headers=client.header
     )
     if pricing_response.status_code == 200:
@@ -1,15 +1,15 @@
 """Representation of Workflow."""
 import logging
-import requests
 from requests.exceptions import RequestException
 
 from cosmosid.helpers.exceptions import CosmosidConnectionError, CosmosidServerError, AuthenticationFailed
+from cosmosid.helpers.transport import default_transport
 
 LOGGER = logging.getLogger(__name__)
 
 
 class Workflow(object):
-    def __init__(self, base_url=None, api_key=None, logger=LOGGER):
+    def __init__(self, base_url=None, api_key=None, logger=LOGGER, transport=None):
         
         if base_url is None:
             raise ValueError("base_url must be provided") # pragma: no cover
@@ -20,11 +20,12 @@ class Workflow(object):
         self.base_url = base_url
         self.logger = logger
         self.header = {"X-Api-Key": api_key, "Content-Type": "application/json"}
+        self.transport = transport or default_transport()
 
     def get_workflows(self):
         
         try:
-            res = requests.get(
+            res = self.transport.get(
                 f"{self.base_url}/api/workflow/v1/workflows",
                 params={"enabled": "true"},
                 headers=self.header,
@@ -16,6 +16,8 @@ from cosmosid.api.import_workflow import ImportWorkflow
 from cosmosid.api.reports import Reports
 from cosmosid.api.workflow import Workflow
 from cosmosid.helpers.auth import ApiKeyAuth
+from cosmosid.helpers.response_cache import default_response_cache
+from cosmosid.helpers.transport import Transport
 from cosmosid.helpers.exceptions import (
     CosmosidException,
     DownloadSamplesException,
@@ -33,8 +35,12 @@ class CosmosidApi:
     logger = logging.getLogger(__name__)
     BASE_URL = "https://app.cosmosid.com"
 
-    def __init__(self, api_key=None, base_url=None):
-        """Initialize a client with the given params."""
+    def __init__(self, api_key=None, base_url=None, transport=None):
+        """Initialize a client with the given params.
+
+        All requests to the API share the ``transport``, its connection pool
+        is kept alive between requests.
+        """
         try:
             if not api_key:
                 api_key = self.__auth()
@@ -52,6 +58,7 @@ class CosmosidApi:
             base_url = f'https://{base_url}'
         self.base_url = base_url
         self.api_key = api_key
+        self.transport = transport or Transport(cache=default_response_cache())
 
     def __auth(self):
         """Read api_key for authentication."""
@@ -66,7 +73,9 @@ class CosmosidApi:
         return api_key
 
     def dashboard(self, parent):
-        file_obj = Files(base_url=self.base_url, api_key=self.api_key)
+        file_obj = Files(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         try:
             res = file_obj.get_dashboard(parent_id=parent)
             if res:
@@ -88,31 +97,69 @@ class CosmosidApi:
             self.logger.error("Failed to get listing of directory %s", parent)
             utils.log_traceback(err)
 
+    def walk(self, parent=None):
+        """Iterate items of the folder and all its subfolders with their "path"."""
+        file_obj = Files(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
+        try:
+            # folders are listed lazily, so errors are raised while items are consumed
+            yield from file_obj.walk(parent_id=parent)
+        except NotFoundException as err:
+            utils.log_traceback(err)
+        except CosmosidException as err:
+            self.logger.error("Get directory list exception")
+            utils.log_traceback(err)
+
     def make_dir(self, name, parent_id=None):
-        file_obj = Files(base_url=self.base_url, api_key=self.api_key)
+        file_obj = Files(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         new_folder_id = file_obj.make_dir(name=name, parent_id=parent_id)
         return new_folder_id    
 
-
     def get_enabled_workflows(self):
-        workflow_api = Workflow(base_url=self.base_url, api_key=self.api_key)
+        workflow_api = Workflow(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         return workflow_api.get_workflows()
 
-    def import_workflow(self, workflow_ids, pairs, file_type, parent_id=None, host_name=None, forward_primer=None, reverse_primer=None):
-        import_wf = ImportWorkflow(base_url=self.base_url, api_key=self.api_key)
+    def import_workflow(
+        self,
+        workflow_ids,
+        pairs,
+        file_type,
+        parent_id=None,
+        host_name=None,
+        forward_primer=None,
+        reverse_primer=None,
+        concurrent_uploads=None,
+        upload_tuning=None,
+        use_upload_cache=True,
+        upload_rate_limit=None,
+        upload_file_rate_limit=None,
+    ):
+        import_wf = ImportWorkflow(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         try:
-            for pair in pairs:
+            uploaded_keys = upload.upload_pairs(
+                pairs=pairs,
+                file_type=file_type,
+                parent_id=parent_id,
+                base_url=self.base_url,
+                api_key=self.api_key,
+                concurrent_uploads=concurrent_uploads,
+                tuning=upload_tuning,
+                use_cache=use_upload_cache,
+                rate_limit=upload_rate_limit,
+                file_rate_limit=upload_file_rate_limit,
+                transport=self.transport,
+            )
+            for pair, files_s3 in zip(pairs, uploaded_keys):
+                pair['files_s3'] = files_s3
                 for file in pair['files']:
-                    pair.setdefault('files_s3', []).append(
-                        upload.upload_file(
-                            file=file,
-                            file_type=file_type,
-                            parent_id=parent_id,
-                            api_key=self.api_key,
-                            base_url=self.base_url,
-                        )
-                    )
-                    self.logger.info(f'\r{file} was uploaded.' + ' ' * 30)
+                    self.logger.info(f'{file} was uploaded.')
 
             import_wf.import_workflow(
                 workflow_ids,
@@ -144,6 +191,7 @@ class CosmosidApi:
                 file_type=file_type,
                 base_url=self.base_url,
                 api_key=self.api_key,
+                transport=self.transport,
             )
             if upload_res:
                 return upload_res["id"]
@@ -157,7 +205,9 @@ class CosmosidApi:
         """Get list of analysis for a given file id."""
         if not file_id:
             raise CosmosidException('Wrong file id')
-        analysis = Analysis(base_url=self.base_url, api_key=self.api_key)
+        analysis = Analysis(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         try:
             analysis_list = analysis.get_list(file_id=file_id, run_id=run_id)
             if analysis_list:
@@ -188,7 +238,9 @@ class CosmosidApi:
             url=None,
     ):
         """Get list of artifact for a given file id."""
-        artifacts = Artifacts(base_url=self.base_url, api_key=self.api_key)
+        artifacts = Artifacts(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         artifacts_content = artifacts.get_list(
             run_id=run_id, artifact_type=artifact_type
         )
@@ -234,10 +286,17 @@ class CosmosidApi:
 
     def report(self, file_id=None, output_file=None, output_dir=None, timeout=300):
         """Upload single file."""
-        report = Reports(base_url=self.base_url,
-                         api_key=self.api_key, file_id=file_id, timeout=timeout)
+        report = Reports(
+            base_url=self.base_url,
+            api_key=self.api_key,
+            file_id=file_id,
+            timeout=timeout,
+            transport=self.transport,
+        )
         try:
-            file_obj = Files(base_url=self.base_url, api_key=self.api_key)
+            file_obj = Files(
+                base_url=self.base_url, api_key=self.api_key, transport=self.transport
+            )
             res = file_obj.get_file(file_id=file_id)
             if not res:
                 raise CosmosidException(
@@ -257,7 +316,9 @@ class CosmosidApi:
 
     def sample_run_list(self, file_id):
         """Get list of runs for a given file id."""
-        sample_runs = Runs(base_url=self.base_url, api_key=self.api_key)
+        sample_runs = Runs(
+            base_url=self.base_url, api_key=self.api_key, transport=self.transport
+        )
         return sample_runs.get_runs_list(file_id=file_id)
 
     def pricing(self, data):
@@ -270,7 +331,10 @@ class CosmosidApi:
         """
         try:
             return upload.pricing(
-                data=data, base_url=self.base_url, api_key=self.api_key
+                data=data,
+                base_url=self.base_url,
+                api_key=self.api_key,
+                transport=self.transport,
             )
         except Exception as err:
             self.logger.error(err)
@@ -279,22 +343,47 @@ class CosmosidApi:
     def profile(self):
         """ "Get profile information for current user"""
         try:
-            return auth.get_profile(self.base_url, {"X-Api-Key": self.api_key})
+            return auth.get_profile(
+                self.base_url, {"X-Api-Key": self.api_key}, transport=self.transport
+            )
         except Exception as err:
             self.logger.error("Client exception occurred")
             utils.log_traceback(err)
             raise
 
+    def user_id(self):
+        """Get id of the current user, it's cached unlike the profile."""
+        return auth.get_user_id(
+            self.base_url, {"X-Api-Key": self.api_key}, transport=self.transport
+        )
+
     def download_samples(
-            self, samples, concurrent_downloads, display_loading=True, output_dir=None
+            self,
+            samples,
+            concurrent_downloads,
+            display_loading=True,
+            output_dir=None,
+            rate_limit=None,
+            file_rate_limit=None,
+            segments=None,
+            backend=None,
+            download_tuning=None,
     ):
         try:
             original_samples = SamplesDownloader(
-                base_url=self.base_url, api_key=self.api_key
+                base_url=self.base_url, api_key=self.api_key, transport=self.transport
             )
 
             file_paths = original_samples.download_samples(
-                samples, output_dir, concurrent_downloads, display_loading
+                samples,
+                output_dir,
+                concurrent_downloads,
+                display_loading,
+                rate_limit=rate_limit,
+                file_rate_limit=file_rate_limit,
+                segments=segments,
+                backend=backend,
+                tuning=download_tuning,
             )
             if file_paths:
                 file_paths_text = "\n".join(file_paths)
@@ -307,15 +396,51 @@ class CosmosidApi:
         except Exception as err:
             raise DownloadSamplesException(f"{err}") from err
 
+    def stream_samples(
+            self,
+            samples,
+            output,
+            gunzip=False,
+            rate_limit=None,
+            file_rate_limit=None,
+    ):
+        """Write files of the samples to stdout ("-") or a named pipe."""
+        try:
+            SamplesDownloader(
+                base_url=self.base_url, api_key=self.api_key, transport=self.transport
+            ).stream_samples(
+                samples,
+                output,
+                gunzip=gunzip,
+                rate_limit=rate_limit,
+                file_rate_limit=file_rate_limit,
+            )
+            return "", ""
+        except Exception as err:
+            raise DownloadSamplesException(f"{err}") from err
+
+    def verify_samples(self, samples, concurrent_downloads, output_dir=None):
+        try:
+            rows = SamplesDownloader(
+                base_url=self.base_url, api_key=self.api_key, transport=self.transport
+            ).verify_samples(samples, output_dir, concurrent_downloads)
+            return ("File", "Status"), rows
+        except Exception as err:
+            raise DownloadSamplesException(f"{err}") from err
+
     def get_analyses(self, comparative_ids):
         if comparative_ids:
             return ComparativeAnalyses(
-                self.base_url, self.api_key
-            ).get_analyses_of_comparative(self.profile()['id'], comparative_ids)
-        return ComparativeAnalyses(self.base_url, self.api_key).get_analyses_out_of_comparatives()
+                self.base_url, self.api_key, self.transport
+            ).get_analyses_of_comparative(self.user_id(), comparative_ids)
+        return ComparativeAnalyses(
+            self.base_url, self.api_key, self.transport
+        ).get_analyses_out_of_comparatives()
 
     def get_comparatives(self):
-        return ComparativeAnalyses(self.base_url, self.api_key).get_comparatives(self.profile()['id'])
+        return ComparativeAnalyses(
+            self.base_url, self.api_key, self.transport
+        ).get_comparatives(self.user_id())
 
     def export_analyses(self,
                         analyses_ids,
@@ -323,13 +448,23 @@ class CosmosidApi:
                         concurrent_downloads,
                         output_dir,
                         log_scale,
-                        tax_levels
+                        tax_levels,
+                        rate_limit=None,
+                        file_rate_limit=None,
+                        backend=None,
+                        download_tuning=None,
                         ):
-        return ComparativeAnalyses(self.base_url, self.api_key).export_analyses(
+        return ComparativeAnalyses(
+            self.base_url, self.api_key, self.transport
+        ).export_analyses(
             analyses_ids,
             export_types,
             concurrent_downloads,
             output_dir,
             log_scale,
-            tax_levels
+            tax_levels,
+            rate_limit=rate_limit,
+            file_rate_limit=file_rate_limit,
+            backend=backend,
+            tuning=download_tuning,
         )
@@ -9,6 +9,7 @@ from cosmosid.helpers.exceptions import (
     NotValidFileExtension,
     WrongFlagException,
 )
+from cosmosid.helpers.stream import STDOUT, reserve_stdout
 
 
 class Artifacts(Lister):
@@ -43,8 +44,8 @@ class Artifacts(Lister):
             action="store",
             type=str,
             default=None,
-            help="output file name. Must have .zip extension. \
-                               Default: is equivalent to cosmosid file name.",
+            help="output file name. Must have .zip extension, '-' writes the archive "
+                 "to stdout. Default: is equivalent to cosmosid file name.",
         )
         parser_builders.directory(parser)
 
@@ -74,6 +75,16 @@ class Artifacts(Lister):
                 raise NotValidFileExtension(
                     "Not allowed to set path with --output/-o flag, If you want to set path you can use --dir/-d flag!"
                 )
+        if output_file == STDOUT:
+            if not parsed_args.type:
+                raise WrongFlagException("--type flag is required!")
+            with reserve_stdout():
+                return self.app.cosmosid.artifacts_list(
+                    artifact_type=parsed_args.type,
+                    run_id=run_id,
+                    output_file=output_file,
+                    output_dir=output_dir,
+                )
         return self.app.cosmosid.artifacts_list(
             artifact_type=parsed_args.type,
             run_id=run_id,
@@ -81,3 +92,9 @@ class Artifacts(Lister):
             output_dir=output_dir,
             url=parsed_args.url,
         )
+
+    def produce_output(self, parsed_args, column_names, data):
+        if parsed_args.output == STDOUT:
+            # stdout carries the archive
+            return 0
+        return super().produce_output(parsed_args, column_names, data)
@@ -42,6 +42,9 @@ class ComparativeAnalysesExport(Command):
             help="Limit concurrent files downloads",
         )
         parser_builders.directory(parser)
+        parser_builders.rate_limit(parser)
+        parser_builders.download_backend(parser)
+        parser_builders.download_tuning(parser)
         return parser
 
     def take_action(self, parsed_args):
@@ -61,4 +64,8 @@ class ComparativeAnalysesExport(Command):
             parsed_args.dir,
             parsed_args.log_scale,
             parsed_args.tax_level or [TaxonomicRank.species.value, ],
+            rate_limit=parsed_args.rate_limit,
+            file_rate_limit=parsed_args.file_rate_limit,
+            backend=parsed_args.backend,
+            download_tuning=parsed_args.download_tuning,
         )
@@ -5,6 +5,7 @@ from typing import List
 from cliff.lister import Lister
 from cosmosid.helpers import argument_validators, parser_builders
 from cosmosid.helpers.exceptions import NotFoundException, ValidationError
+from cosmosid.helpers.stream import STDOUT, is_stream, reserve_stdout
 
 
 class Downloads(Lister):
@@ -15,6 +16,13 @@ class Downloads(Lister):
             raise ValueError("Please, specify '--samples_ids' or '--input-file' option")
         elif parsed_args.samples_ids and parsed_args.input_file:
             raise ValueError("Please, specify only one of '--samples_ids', '--input-file' options")
+        if parsed_args.output:
+            if not is_stream(parsed_args.output):
+                raise ValueError("--output must be '-' (stdout) or a named pipe")
+            if parsed_args.verify_only:
+                raise ValueError("Can't use --output with --verify-only")
+        elif parsed_args.gunzip:
+            raise ValueError("--gunzip can be used only with --output")
 
     def get_parser(self, prog_name):
         parser = super(Downloads, self).get_parser(prog_name)
@@ -36,8 +44,46 @@ class Downloads(Lister):
 
         parser_builders.directory(parser)
         parser_builders.concurrent_download(parser)
+        parser_builders.rate_limit(parser)
+        parser_builders.download_backend(parser)
+        parser_builders.download_tuning(parser)
+        parser.add_argument(
+            "--segments",
+            action="store",
+            type=int,
+            default=None,
+            help="Download every large file by this number of concurrent ranged "
+                 "requests. Default: DOWNLOAD_SEGMENTS env variable or 1",
+        )
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            default=False,
+            help="Verify checksums of already downloaded files without downloading",
+        )
+        parser.add_argument(
+            "--output",
+            "-o",
+            action="store",
+            type=str,
+            default=None,
+            help="Write files of the samples one after another to stdout (-) or to "
+                 "a named pipe instead of the output directory",
+        )
+        parser.add_argument(
+            "--gunzip",
+            action="store_true",
+            default=False,
+            help="Decompress gzipped files written to --output",
+        )
         return parser
 
+    def produce_output(self, parsed_args, column_names, data):
+        if parsed_args.output == STDOUT:
+            # stdout carries the data of the samples
+            return 0
+        return super().produce_output(parsed_args, column_names, data)
+
     def read_samples_from_file(self, filepath: str)->List[str]:
         res = []
         with open(filepath, 'r') as file:
@@ -58,6 +104,16 @@ class Downloads(Lister):
         else:
             samples = self.read_samples_from_file(parsed_args.input_file)
 
+        if parsed_args.output:
+            with reserve_stdout():
+                return self.app.cosmosid.stream_samples(
+                    samples,
+                    parsed_args.output,
+                    gunzip=parsed_args.gunzip,
+                    rate_limit=parsed_args.rate_limit,
+                    file_rate_limit=parsed_args.file_rate_limit,
+                )
+
         output_dir = parsed_args.dir
         if output_dir:
             output_dir = os.path.expanduser(os.path.normpath(output_dir))
@@ -68,9 +124,18 @@ class Downloads(Lister):
         if not output_dir:
             output_dir = os.getcwd()
 
+        if parsed_args.verify_only:
+            return self.app.cosmosid.verify_samples(
+                samples, parsed_args.concurrent_downloads, output_dir
+            )
         return self.app.cosmosid.download_samples(
             samples,
             parsed_args.concurrent_downloads,
             not parsed_args.no_display,
             output_dir,
+            rate_limit=parsed_args.rate_limit,
+            file_rate_limit=parsed_args.file_rate_limit,
+            segments=parsed_args.segments,
+            backend=parsed_args.backend,
+            download_tuning=parsed_args.download_tuning,
         )
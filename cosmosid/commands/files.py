@@ -28,12 +28,18 @@ class Files(Lister):
         parser.add_argument(
             "--up", action="store_true", default=False, help="order direction"
         )
+        parser.add_argument(
+            "--recursive",
+            "-r",
+            action="store_true",
+            default=False,
+            help="list files of all subfolders too, with path of their folder",
+        )
         return parser
 
     def take_action(self, parsed_args):
         """get json with items and prepare for output"""
         parent = utils.key_len(parsed_args.parent)
-        folder_content = self.app.cosmosid.dashboard(parent)
         content_type_map = {
             "1": "Folder",
             "2": "Metagenomics Sample",
@@ -43,13 +49,19 @@ class Files(Lister):
             "6": "Amplicon ITS Sample",
         }
         header = ["type", "name", "id", "status", "reads", "created"]
-        if folder_content:
-            if not folder_content["items"]:
-                self.app.logger.info(f"\nFolder {parent} is empty")
-                for_output = [[" ", " ", " ", " ", " ", " "]]
-                return (header, for_output)
+        if parsed_args.recursive:
+            header.insert(0, "path")
+            items = self.app.cosmosid.walk(parent)
         else:
-            raise Exception("Exception accured.")
+            folder_content = self.app.cosmosid.dashboard(parent)
+            if folder_content:
+                if not folder_content["items"]:
+                    self.app.logger.info(f"\nFolder {parent} is empty")
+                    for_output = [[" ", " ", " ", " ", " ", " "]]
+                    return (header, for_output)
+            else:
+                raise Exception("Exception accured.")
+            items = folder_content["items"]
 
         def _set_date(input_date):
             try:
@@ -93,6 +105,7 @@ class Files(Lister):
             return inp
 
         field_maps = {
+            "path": ["path", "str", _del_none],
             "type": ["type", "str", _set_type],
             "id": ["id", "str", _del_none],
             "name": ["name", "str", _del_none],
@@ -101,7 +114,8 @@ class Files(Lister):
             "created": ["created", "str", _set_date],
         }
 
-        items_data = [_convert(item) for item in folder_content["items"]]
+        # items of a recursive listing are printed while subfolders are listed
+        items_data = (_convert(item) for item in items)
 
         # order regarding order parameters
         if parsed_args.order:
@@ -111,7 +125,7 @@ class Files(Lister):
                     key=itemgetter(field_maps[parsed_args.order.lower()][0]),
                     reverse=(not parsed_args.up),
                 )
-        for_output = [
+        for_output = (
             [
                 item[field_maps[f][0]]
                 if f != "reads"
@@ -119,6 +133,9 @@ class Files(Lister):
                 for f in header
             ]
             for item in items_data
-        ]
-        self.app.logger.info(f"\nContent of the Folder {parent}")
+        )
+        if parsed_args.recursive:
+            self.app.logger.info(f"\nContent of the Folder {parent} and its subfolders")
+        else:
+            self.app.logger.info(f"\nContent of the Folder {parent}")
         return (header, for_output)
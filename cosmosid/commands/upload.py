@@ -1,10 +1,21 @@
 import os
 import re
+import shutil
+import tempfile
+import time
 from pathlib import Path
 from distutils.version import StrictVersion
 
 from cliff.command import Command
+from cosmosid.config import (
+    SYNC_SETTLE_TIME,
+    UPLOAD_CACHE,
+    UPLOAD_TUNING,
+    UPLOAD_TUNING_MODES,
+)
 from cosmosid.helpers import parser_builders, argument_actions, argument_validators
+from cosmosid.helpers.compression import COMPRESSED_EXTENSIONS, gzip_file
+from cosmosid.helpers.sync_manifest import SyncManifest
 from cosmosid.enums import AMPLICON_PRESETS, HOST_REMOVAL_OPTIONS, FILE_TYPES, Workflows, CLI_NAME_TO_WF_NAME
 from cosmosid.helpers.exceptions import CosmosidConnectionError, CosmosidServerError, AuthenticationFailed
 
@@ -41,6 +52,45 @@ class Upload(Command):
             return paired_end_file_base_name.group(1), extension
         return base_name, extension
 
+    def compress_pairs(self, pairs, directory):
+        """Replace uncompressed fasta/fastq files of pairs by their gzip copies.
+
+        Copies of every pair are in its own subdirectory, so files with the
+        same name from different directories keep their names.
+        """
+        for index, pair in enumerate(pairs):
+            compressed_ext = COMPRESSED_EXTENSIONS.get(pair["ext"])
+            if not compressed_ext:
+                continue
+            pair_directory = os.path.join(directory, str(index))
+            os.makedirs(pair_directory, exist_ok=True)
+            compressed_files = []
+            for fname in pair["files"]:
+                base_name = os.path.basename(fname)[:-len(pair["ext"])]
+                compressed_file = os.path.join(
+                    pair_directory, base_name + compressed_ext
+                )
+                self.app.logger.info(f"Compressing {fname}")
+                gzip_file(fname, compressed_file)
+                compressed_files.append(compressed_file)
+            pair.update(files=compressed_files, ext=compressed_ext)
+
+    def filter_synced_pairs(self, pairs, manifest):
+        """Return pairs which are not uploaded yet or changed since the upload."""
+        settled_time = time.time() - SYNC_SETTLE_TIME
+        result = []
+        for pair in pairs:
+            if manifest.is_uploaded(pair["files"]):
+                continue
+            if any(os.path.getmtime(f) > settled_time for f in pair["files"]):
+                self.app.logger.info(
+                    f"{', '.join(pair['files'])} modified recently, "
+                    "skipped until the next sync"
+                )
+                continue
+            result.append(pair)
+        return result
+
     def get_parser(self, prog_name):
         parser = super(Upload, self).get_parser(prog_name)
         parser.add_argument(
@@ -126,12 +176,52 @@ class Upload(Command):
             choices=HOST_REMOVAL_OPTIONS.keys(),
             default=None,
         )
-        
+
         parser_builders.directory(
             parser,
             help="directory with files for upload e.g. cosmosid upload -d /path/my_dir"
         )
 
+        parser.add_argument(
+            "--concurrent-uploads",
+            action="store",
+            type=int,
+            default=None,
+            help="Limit concurrent files uploads",
+        )
+        parser_builders.rate_limit(parser, "upload")
+        parser.add_argument(
+            "--upload-tuning",
+            choices=UPLOAD_TUNING_MODES,
+            type=str,
+            default=UPLOAD_TUNING,
+            help="adaptive - part size and threads of a file upload depend on file "
+                 "size and measured throughput, fixed - big files are uploaded by 1GB "
+                 "parts in 5 threads. Default: %(default)s",
+        )
+        parser.add_argument(
+            "--compress",
+            action="store_true",
+            default=False,
+            help="Compress uncompressed fasta/fastq files with gzip before upload. "
+            "Compressed copies are stored in the temporary directory (see TMPDIR).",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            default=False,
+            help="Upload only files of the directory which are new or changed since "
+                 "the previous sync of the directory. Files modified recently "
+                 f"(SYNC_SETTLE_TIME env variable, {SYNC_SETTLE_TIME} seconds) are "
+                 "skipped until the next sync",
+        )
+        parser.add_argument(
+            "--no-upload-cache",
+            action="store_true",
+            default=not UPLOAD_CACHE,
+            help="Upload files again even if identical files were uploaded recently",
+        )
+
         return parser
 
     def take_action(self, parsed_args):
@@ -141,7 +231,7 @@ class Upload(Command):
         directory = parsed_args.dir if parsed_args.dir else None
         files = parsed_args.file if parsed_args.file else None
         fastqc_only = parsed_args.fastqc_only
-        
+
         try:
             enabled_workflows = self.app.cosmosid.get_enabled_workflows()
         except CosmosidServerError:
@@ -162,6 +252,8 @@ class Upload(Command):
                 "\nInvalid input parameters. Files or directory must be specified."
                 " It is not permitted to specify both file and directory in one command."
             )
+        elif parsed_args.sync and not directory:
+            raise Exception("\nSync mode is available only for directory upload.")
         elif files:
             if not all([os.path.exists(f) for f in files]):
                 raise Exception("Not all specified files exist: %s", files)
@@ -190,17 +282,17 @@ class Upload(Command):
             for wf in parsed_args.workflow.split(","):
                 try:
                     wf_name, wf_version, *_ = (wf+':').split(':')
-                    
+
                     version_to_wf = {
                         workflow['version']: workflow 
                         for workflow in filter(lambda x: x["name"] == CLI_NAME_TO_WF_NAME.get(wf_name, wf_name), enabled_workflows)
                     }
-                    
+
                     wf_version = wf_version or max(version_to_wf.keys(), key=StrictVersion)
                     wf = version_to_wf.get(wf_version)
                     if not wf:
                         raise Exception(f'Workflow version {wf_version} is not available for {wf_name}')
-                    
+
                     workflow_ids.append(wf['id'])
                 except IndexError as e:
                     raise Exception(f"'{wf}' workflow is not enabled") from e
@@ -220,17 +312,17 @@ class Upload(Command):
                 'Next arguments are required for Amplicon 16S Batch: '
                 '`--amplicon-preset` or  `--forward-primer` with `--reverse-primer`'
             )
-        
+
         if parsed_args.amplicon_preset or parsed_args.forward_primer or parsed_args.reverse_primer:
             if Workflows.AmpliseqBatchGroup not in workflow_ids:
                 raise Exception (
                     'Next arguments are available only for Amplicon 16S Batch: '
                     '`--amplicon-preset`, `--forward-primer`, `--reverse-primer`'
                 )
-            
+
             if parsed_args.amplicon_preset and (parsed_args.forward_primer or parsed_args.reverse_primer):
                 raise Exception('--amplicon-preset cannot be used with forward or reverse primers')
-            
+
             if parsed_args.amplicon_preset:
                 forward_primer = AMPLICON_PRESETS[parsed_args.amplicon_preset]['forward_primer']
                 reverse_primer = AMPLICON_PRESETS[parsed_args.amplicon_preset]['reverse_primer']
@@ -268,6 +360,56 @@ class Upload(Command):
                 prev_ext = cur_ext
 
         pairs.append(paired_ended)
+        manifest = None
+        if parsed_args.sync:
+            manifest = SyncManifest(
+                directory,
+                self.app.cosmosid.base_url,
+                self.app.cosmosid.api_key,
+                parent_id,
+            )
+            pairs = self.filter_synced_pairs(pairs, manifest)
+            manifest.save()
+            if not pairs:
+                self.app.logger.info(
+                    "\nAll files of the directory are already uploaded."
+                )
+                return
+        # compression replaces files of pairs, the manifest keeps the original ones
+        sources = [list(pair["files"]) for pair in pairs]
+        compression_dir = None
+        try:
+            if parsed_args.compress:
+                compression_dir = tempfile.mkdtemp(prefix="cosmosid-")
+                self.compress_pairs(pairs, compression_dir)
+            self.upload_pairs(
+                parsed_args,
+                pairs,
+                balance,
+                workflow_ids,
+                parent_id,
+                forward_primer,
+                reverse_primer,
+            )
+        finally:
+            if compression_dir:
+                shutil.rmtree(compression_dir, ignore_errors=True)
+        if manifest:
+            for pair, files in zip(pairs, sources):
+                if pair.get("files_s3"):
+                    manifest.add(files, pair["sample_name"], pair["files_s3"])
+            manifest.save()
+
+    def upload_pairs(
+        self,
+        parsed_args,
+        pairs,
+        balance,
+        workflow_ids,
+        parent_id,
+        forward_primer,
+        reverse_primer,
+    ):
         pricing_req = []
         for pair in pairs:
             pricing_req.append(
@@ -305,7 +447,12 @@ class Upload(Command):
              parent_id=parent_id,
              host_name=parsed_args.host_name,
              forward_primer=forward_primer,
-             reverse_primer=reverse_primer,             
+             reverse_primer=reverse_primer,
+             concurrent_uploads=parsed_args.concurrent_uploads,
+             upload_tuning=parsed_args.upload_tuning,
+             use_upload_cache=not parsed_args.no_upload_cache,
+             upload_rate_limit=parsed_args.rate_limit,
+             upload_file_rate_limit=parsed_args.file_rate_limit,
         )
         self.app.logger.info("\nFiles have been sent to analysis.")
         self.app.logger.info("Task Done")
@@ -1,4 +1,7 @@
 from os import cpu_count, getenv
+from os.path import expanduser, join
+
+GB = 1024**3
 
 MAX_CONCURRENT_DOWNLOADS = 4
 CHUNK_SIZE = int(getenv("CHUNK_SIZE", 4 * 1024**2))
@@ -6,3 +9,69 @@ CHUNK_SIZE = int(getenv("CHUNK_SIZE", 4 * 1024**2))
 CONCURRENT_DOWNLOADS = int(
     getenv("CONCURRENT_DOWNLOADS", min(cpu_count() * 2, MAX_CONCURRENT_DOWNLOADS))
 )
+# "fixed" keeps the number of concurrent downloads constant, "adaptive" grows it
+# while throughput improves and halves it on server errors and timeouts
+DOWNLOAD_TUNING_MODES = ("adaptive", "fixed")
+DOWNLOAD_TUNING = getenv("DOWNLOAD_TUNING", "fixed")
+MAX_ADAPTIVE_DOWNLOADS = int(getenv("MAX_ADAPTIVE_DOWNLOADS", 32))
+# Large files are downloaded by this number of concurrent ranged requests
+DOWNLOAD_SEGMENTS = int(getenv("DOWNLOAD_SEGMENTS", 1))
+# "curl", "requests" or "async" (requires aiohttp), the best installed one by default
+DOWNLOAD_BACKEND = getenv("DOWNLOAD_BACKEND", "")
+# Downloaded files are written by blocks of this size (aligned to it) and
+# optionally synced to disk when they are closed
+DOWNLOAD_WRITE_BLOCK_SIZE = int(getenv("DOWNLOAD_WRITE_BLOCK_SIZE", 1024**2))
+DOWNLOAD_FSYNC = getenv("DOWNLOAD_FSYNC", "0") != "0"
+# Download URLs are requested by batches of this number of samples
+DOWNLOAD_URLS_BATCH_SIZE = int(getenv("DOWNLOAD_URLS_BATCH_SIZE", 100))
+
+MAX_CONCURRENT_UPLOADS = 8
+CONCURRENT_UPLOADS = int(
+    getenv("CONCURRENT_UPLOADS", min(cpu_count() * 2, MAX_CONCURRENT_UPLOADS))
+)
+# Total size of files which may be transferred at the same time
+UPLOAD_BYTES_IN_FLIGHT = int(getenv("UPLOAD_BYTES_IN_FLIGHT", 16 * GB))
+
+# "adaptive" picks part size and threads from file size and measured throughput,
+# "fixed" uploads big files with at least 1GB parts in 5 threads
+UPLOAD_TUNING_MODES = ("adaptive", "fixed")
+UPLOAD_TUNING = getenv("UPLOAD_TUNING", "adaptive")
+# Read parts of uploaded files through memory maps
+UPLOAD_MMAP = getenv("UPLOAD_MMAP", "1") != "0"
+# Uploads of identical files are reused during this time (seconds), a local
+# estimate shorter than the time uploaded files are kept by the service
+UPLOAD_CACHE = getenv("UPLOAD_CACHE", "1") != "0"
+UPLOAD_CACHE_TTL = int(getenv("UPLOAD_CACHE_TTL", 24 * 60 * 60))
+
+# Transfer rate limits like "500K", "10M" (bytes per second), 0 means no limit:
+# total rate of all uploads/downloads and rate of a single file
+UPLOAD_RATE_LIMIT = getenv("UPLOAD_RATE_LIMIT", "0")
+UPLOAD_FILE_RATE_LIMIT = getenv("UPLOAD_FILE_RATE_LIMIT", "0")
+DOWNLOAD_RATE_LIMIT = getenv("DOWNLOAD_RATE_LIMIT", "0")
+DOWNLOAD_FILE_RATE_LIMIT = getenv("DOWNLOAD_FILE_RATE_LIMIT", "0")
+# Files of "upload --sync" modified during this time (seconds) may be still written,
+# they are uploaded by the next sync
+SYNC_SETTLE_TIME = int(getenv("SYNC_SETTLE_TIME", 60))
+
+# Requests to the API share a pool of this number of connections, they are
+# retried on connection errors and server errors and fail after the timeouts
+HTTP_POOL_SIZE = int(getenv("HTTP_POOL_SIZE", 16))
+HTTP_RETRIES = int(getenv("HTTP_RETRIES", 3))
+HTTP_CONNECT_TIMEOUT = float(getenv("HTTP_CONNECT_TIMEOUT", 30))
+HTTP_READ_TIMEOUT = float(getenv("HTTP_READ_TIMEOUT", 300))
+# Requests to the API use HTTP/2 if httpx with h2 is installed
+HTTP2 = getenv("HTTP2", "0") != "0"
+
+# Metadata of runs, folders of recursive listings and pages of folder items
+# are requested by this number of concurrent requests, metadata of runs is
+# reused during RUN_METADATA_CACHE_TTL seconds (0 disables the cache)
+CONCURRENT_METADATA_REQUESTS = int(getenv("CONCURRENT_METADATA_REQUESTS", 8))
+RUN_METADATA_CACHE_TTL = int(getenv("RUN_METADATA_CACHE_TTL", 60))
+
+# Directory for the CLI state kept between runs (e.g. journals of uploads)
+CACHE_DIR = getenv("COSMOSID_CACHE_DIR", join(expanduser("~"), ".cosmosid_cache"))
+# Responses of read-only endpoints (profile, workflows, runs) are kept in
+# CACHE_DIR and revalidated by ETag, the least recently used are removed
+# when their total size exceeds RESPONSE_CACHE_SIZE bytes
+RESPONSE_CACHE = getenv("RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_SIZE = int(getenv("RESPONSE_CACHE_SIZE", 32 * 1024**2))
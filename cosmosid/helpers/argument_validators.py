@@ -1,6 +1,8 @@
 from uuid import UUID
 from argparse import ArgumentTypeError
 
+from cosmosid.helpers.rate_limiter import parse_rate
+
 
 def uuid(param):
     try:
@@ -13,3 +15,10 @@ def is_primer(value):
     if isinstance(value, str) and not value.isalpha():
         raise ArgumentTypeError("Only letters are allowed")
     return value.upper() if isinstance(value, str) else value
+
+
+def rate(value):
+    try:
+        return parse_rate(value)
+    except ValueError:
+        raise ArgumentTypeError("Not a valid rate! Use e.g. 500K, 10M or 1G")
@@ -0,0 +1,324 @@
+"""Asyncio download backend, all files share one event loop and one connection pool."""
+import asyncio
+import atexit
+import logging
+import threading
+from functools import partial
+from os.path import getsize, isfile, join
+
+import aiohttp
+
+from cosmosid.config import CHUNK_SIZE, DOWNLOAD_WRITE_BLOCK_SIZE
+from cosmosid.helpers.downloader import SEGMENTS_STATE_SUFFIX, Downloader
+from cosmosid.helpers.exceptions import (
+    ChecksumMismatchError,
+    NonRecoverableDownloadError,
+    RecoverableDownloadError,
+)
+from cosmosid.helpers.thread_logger import ThreadLogger
+from cosmosid.helpers.writer import BlockWriter, truncate_incomplete
+
+LOGGER = logging.getLogger(__name__)
+TRIES = 4
+RETRY_DELAY = 3  # seconds, doubled after every try
+# connection attempts and stalled transfers fail after these timeouts
+TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+# received data is hashed and written by worker threads in batches of this size,
+# so CPU and disk work doesn't block transfers of the event loop
+WRITE_BATCH_SIZE = DOWNLOAD_WRITE_BLOCK_SIZE
+
+_lock = threading.Lock()
+_loop = None
+_session = None
+
+
+def _get_loop():
+    """Return the event loop shared by all downloads, it runs in a daemon thread."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="cosmosid-downloads", daemon=True
+            ).start()
+            atexit.register(_shutdown)
+    return _loop
+
+
+async def _get_session():
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0), timeout=TIMEOUT
+        )
+    return _session
+
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+def _shutdown():
+    run(_close_session())
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def run(coroutine):
+    """Run the coroutine on the shared event loop and wait for its result."""
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+    try:
+        return future.result()
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def _consume(writer, hasher, position, chunks):
+    """Hash and write the chunks received from ``position``."""
+    for chunk in chunks:
+        if hasher:
+            hasher.update(position, chunk)
+        writer.write(chunk)
+        position += len(chunk)
+
+
+async def load_file(
+    url, filename, filedir, real_file_size, display_loading, chunk_size, limiter=None
+):
+    """Load the file (or its rest from ``real_file_size``) by a single stream.
+
+    Resume and errors are handled as by ``Downloader._load_file_with_requests``.
+    The file is opened, hashed, written and verified by worker threads, the
+    next batch of data is received while the previous one is written.
+    :return: result of checksum verification
+    """
+    loop = asyncio.get_running_loop()
+    filepath = join(filedir, filename)
+    headers = {"Range": f"bytes={real_file_size}-"} if real_file_size else {}
+    session = await _get_session()
+    try:
+        async with session.get(url, headers=headers) as r:
+            Downloader._check_resumed_status_code(r.status)
+            if real_file_size and r.status != 206:
+                # ranges aren't supported, the file is loaded from scratch
+                real_file_size = 0
+            total_size = r.content_length
+            hasher = (
+                Downloader.create_hasher(
+                    filepath,
+                    r.headers.get("etag"),
+                    total_size + real_file_size,
+                    real_file_size,
+                )
+                if total_size is not None
+                else None
+            )
+            position = real_file_size
+            writer = await loop.run_in_executor(
+                None,
+                partial(
+                    BlockWriter,
+                    filepath,
+                    total_size + real_file_size if total_size is not None else None,
+                    real_file_size,
+                ),
+            )
+            # at most one batch of the file is written while the next one is received
+            pending = None
+            try:
+                batch, batch_size, batch_position = [], 0, position
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    batch.append(chunk)
+                    batch_size += len(chunk)
+                    position += len(chunk)
+                    if batch_size >= WRITE_BATCH_SIZE:
+                        if pending:
+                            await pending
+                        pending = loop.run_in_executor(
+                            None, _consume, writer, hasher, batch_position, batch
+                        )
+                        batch, batch_size, batch_position = [], 0, position
+                    if display_loading and total_size:
+                        Downloader.log(filename, position, total_size + real_file_size)
+                    if limiter:
+                        delay = limiter.reserve(len(chunk))
+                        if delay:
+                            await asyncio.sleep(delay)
+                if pending:
+                    await pending
+                pending = loop.run_in_executor(
+                    None, _consume, writer, hasher, batch_position, batch
+                )
+                await pending
+            finally:
+                if pending:
+                    # the writer is closed after its last write
+                    await asyncio.gather(pending, return_exceptions=True)
+                await loop.run_in_executor(None, writer.close)
+    except (
+        aiohttp.ClientPayloadError,
+        aiohttp.ClientConnectionError,
+        asyncio.TimeoutError,
+    ):
+        raise RecoverableDownloadError
+    except aiohttp.ClientError:
+        raise NonRecoverableDownloadError
+    checksum = await loop.run_in_executor(
+        None, Downloader.check_checksum, filepath, hasher
+    )
+    ThreadLogger().info(filename, "Completed.")
+    return checksum
+
+
+class AsyncDownloader:
+    """Downloads all files as tasks of the shared event loop.
+
+    Thousands of small files are loaded concurrently by a single thread and
+    a single connection pool. Segmented downloads (``segments`` > 1 or an
+    interrupted segmented download) are delegated to ``Downloader``.
+    """
+
+    def __init__(
+        self,
+        max_transfers,
+        display_loading=True,
+        limiter_factory=None,
+        segments=1,
+        on_complete=None,
+        controller=None,
+    ):
+        self.max_transfers = max_transfers
+        self.display_loading = display_loading
+        self.limiter_factory = limiter_factory
+        self.segments = segments or 1
+        # called with file name, error and checksum result of every file
+        self.on_complete = on_complete
+        # adapts the number of transfers, ``max_transfers`` is None then
+        self.controller = controller
+        self._active = 0
+        self._released = None
+
+    def _limit(self, demand):
+        if self.controller:
+            return self.controller.update(demand)
+        return self.max_transfers
+
+    async def _acquire(self):
+        # the caller is waiting for a transfer too
+        while self._active >= self._limit(self._active + 1):
+            self._released.clear()
+            try:
+                # the limit of the controller may grow without any release
+                await asyncio.wait_for(
+                    self._released.wait(),
+                    self.controller.interval if self.controller else None,
+                )
+            except asyncio.TimeoutError:
+                pass
+        self._active += 1
+
+    def _release(self):
+        self._active -= 1
+        self._released.set()
+
+    async def _load_with_retries(self, file, filedir, limiter):
+        filepath = join(filedir, file["file_name"])
+        delay = RETRY_DELAY
+        for tries in range(1, TRIES + 1):
+            truncate_incomplete(filepath)
+            real_size = getsize(filepath) if isfile(filepath) else 0
+            Downloader._validate(filepath, real_size, file["size"])
+            try:
+                return await load_file(
+                    file["url"],
+                    file["file_name"],
+                    filedir,
+                    real_size,
+                    self.display_loading,
+                    CHUNK_SIZE,
+                    limiter,
+                )
+            except RecoverableDownloadError as error:
+                if self.controller and not isinstance(error, ChecksumMismatchError):
+                    self.controller.backoff()
+                if tries == TRIES:
+                    raise
+                LOGGER.debug("%s: %s, retrying in %s seconds", filepath, error, delay)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _load(self, file, output_dir):
+        filedir = file.get("directory", output_dir)
+        filepath = join(filedir, file["file_name"])
+        limiter = self.limiter_factory() if self.limiter_factory else None
+        error = checksum = None
+        await self._acquire()
+        try:
+            if self.segments > 1 or isfile(filepath + SEGMENTS_STATE_SUFFIX):
+                checksum = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    partial(
+                        Downloader.load_file,
+                        file["url"],
+                        file["size"],
+                        file["file_name"],
+                        filedir,
+                        CHUNK_SIZE,
+                        self.display_loading,
+                        limiter=limiter,
+                        segments=self.segments,
+                        controller=self.controller,
+                    ),
+                )
+            else:
+                checksum = await self._load_with_retries(file, filedir, limiter)
+        except Exception as exc:
+            error = exc
+            message = str(error).strip() or type(error).__name__
+            ThreadLogger().info(file["file_name"], message)
+            LOGGER.error("%s: %s", filepath, message)
+        finally:
+            self._release()
+        if self.on_complete:
+            self.on_complete(file["file_name"], error, checksum)
+        return None if error or checksum is None else filepath
+
+    async def _download(self, files, output_dir, batches):
+        loop = asyncio.get_running_loop()
+        self._released = asyncio.Event()
+        tasks = {
+            asyncio.ensure_future(self._load(file, output_dir))
+            for file in files
+        }
+        paths = []
+        try:
+            while tasks or (batches and not batches.exhausted):
+                # files of the next batch are taken when the loop is about to idle
+                if (
+                    batches
+                    and not batches.exhausted
+                    and len(tasks) <= self._limit(len(tasks))
+                ):
+                    tasks.update(
+                        asyncio.ensure_future(self._load(file, output_dir))
+                        for file in await loop.run_in_executor(None, batches.next)
+                    )
+                    continue
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                paths.extend(task.result() for task in done if task.result())
+        finally:
+            for task in tasks:
+                task.cancel()
+        return paths
+
+    def download(self, files, output_dir, batches=None):
+        """Download files, dicts with 'url', 'size', 'file_name' (and 'directory').
+
+        Files of the next ``batches`` are added when the running ones are
+        about to finish.
+        :return: list of paths of downloaded files
+        """
+        return run(self._download(files, output_dir, batches))
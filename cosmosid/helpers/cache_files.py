@@ -0,0 +1,19 @@
+"""Files of the CLI state in CACHE_DIR, they are accessible only by the user."""
+import os
+
+from cosmosid.config import CACHE_DIR
+
+
+def make_cache_dir(directory):
+    """Create ``directory`` of CACHE_DIR (and CACHE_DIR) with mode 0700.
+
+    Modes of existing directories aren't changed.
+    """
+    os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+
+def open_cache_file(path, mode="w"):
+    """Open the file for writing, a new file is created with mode 0600."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    return os.fdopen(os.open(path, flags, 0o600), mode)
@@ -0,0 +1,185 @@
+"""Verification of downloaded files by S3 ETag."""
+import hashlib
+import logging
+import re
+
+from cosmosid.helpers.upload_cache import ContentHasher
+
+LOGGER = logging.getLogger(__name__)
+MB = 1024**2
+# S3 limits of multipart uploads
+MIN_PART_SIZE = 5 * MB
+MAX_PART_SIZE = 5 * 1024 * MB
+# a file is hashed with at most this number of assumed part sizes at once
+MAX_PART_SIZES = 3
+READ_BLOCK_SIZE = 8 * MB
+
+VERIFIED = "verified"
+CORRUPTED = "corrupted"
+UNVERIFIED = "unverified"
+
+
+def parse_etag(etag):
+    """Return MD5 hex digest and number of parts of the ETag.
+
+    ETag of single part upload is MD5 of the file, ETag of multipart upload
+    is MD5 of the concatenated MD5 digests of the parts with ``-<parts>``
+    suffix. None is returned for other ETags (e.g. of SSE-KMS objects).
+    """
+    match = re.fullmatch(r'(?:W/)?"?([0-9a-f]{32})(?:-(\d+))?"?', (etag or "").strip())
+    if not match:
+        return None
+    digest, parts = match.groups()
+    return digest, int(parts) if parts else None
+
+
+def part_size_candidates(size, parts):
+    """Return likely part sizes of multipart upload, the most likely first.
+
+    Part size isn't stored in the ETag, any part size which splits the file
+    to given number of parts is possible. Uploaders use whole megabytes,
+    round sizes are preferred.
+    """
+    low = max(-(-size // parts), MIN_PART_SIZE)
+    high = min((size - 1) // (parts - 1), MAX_PART_SIZE)
+    if low > high:
+        return []
+    candidates = {
+        unit * count
+        for unit in (MB, 1000**2)
+        for count in range(-(-low // unit), high // unit + 1)
+    }
+    if not candidates:
+        # file is split into equal parts
+        candidates = {low}
+
+    def roundness(part_size):
+        megabytes, remainder = divmod(part_size, MB)
+        power_of_two = not remainder and megabytes & (megabytes - 1) == 0
+        return (not power_of_two, bool(remainder), part_size % (64 * MB), part_size)
+
+    return sorted(candidates, key=roundness)
+
+
+class ETagHasher:
+    """Streaming MD5 hash of a file compatible with S3 ETag.
+
+    Parts of the file may be written in any order, every part is hashed when
+    its bytes are written from its beginning. Part size of multipart upload
+    is unknown, so the file is hashed with a few likely part sizes.
+    """
+
+    def __init__(self, etag, size):
+        self.etag = etag
+        self.size = size
+        parsed = parse_etag(etag)
+        self._digest, self._parts = parsed if parsed else (None, None)
+        # mismatch is reported only if the part size is certain
+        self._certain = True
+        if not parsed:
+            part_sizes = []
+        elif self._parts is None or self._parts == 1:
+            part_sizes = [max(size, 1)]
+        else:
+            part_sizes = part_size_candidates(size, self._parts)
+            self._certain = -(-size // self._parts) == (size - 1) // (self._parts - 1)
+        self._hashers = [
+            ContentHasher(size, part_size, hashlib.md5)
+            for part_size in part_sizes[:MAX_PART_SIZES]
+        ]
+
+    @property
+    def single_part(self):
+        return bool(self._digest) and self._parts is None
+
+    @property
+    def part_size(self):
+        """The most likely part size, downloaded segments are aligned to it."""
+        return self._hashers[0].block_size if self._hashers else None
+
+    def update(self, offset, data):
+        for hasher in self._hashers:
+            hasher.update(offset, data)
+
+    def update_from_file(self, filename, start, end):
+        """Hash bytes of the file which were written before."""
+        with open(filename, "rb") as file:
+            file.seek(start)
+            while start < end:
+                data = file.read(min(READ_BLOCK_SIZE, end - start))
+                if not data:
+                    break
+                self.update(start, data)
+                start += len(data)
+
+    def resume_offset(self, position, start=0):
+        """Return offset to hash the file from to continue hashing at position.
+
+        Parts completed before are restored by ``set_state``, bytes from the
+        first part starting at ``start`` or later without digest up to
+        ``position`` must be hashed again.
+        """
+        offset = position
+        for hasher in self._hashers:
+            hashed = hasher.hashed_blocks
+            index = -(-start // hasher.block_size)
+            while index * hasher.block_size < offset:
+                if index not in hashed:
+                    offset = index * hasher.block_size
+                    break
+                index += 1
+        return offset
+
+    def get_state(self):
+        return {
+            "etag": self.etag,
+            "parts": {
+                str(hasher.block_size): {
+                    str(index): digest.hex()
+                    for index, digest in hasher.hashed_blocks.items()
+                }
+                for hasher in self._hashers
+            },
+        }
+
+    def set_state(self, state):
+        if not state or state.get("etag") != self.etag:
+            return
+        for hasher in self._hashers:
+            for index, digest in state["parts"].get(str(hasher.block_size), {}).items():
+                hasher.add_block_digest(int(index), bytes.fromhex(digest))
+
+    def result(self):
+        """Return VERIFIED, CORRUPTED or UNVERIFIED."""
+        if not self._digest:
+            return UNVERIFIED
+        if not self.size:
+            return VERIFIED if self._digest == hashlib.md5().hexdigest() else CORRUPTED
+        complete = False
+        for hasher in self._hashers:
+            digests = hasher.block_digests()
+            if digests is None:
+                continue
+            complete = True
+            if self._parts is None:
+                digest = digests[0].hex()
+            else:
+                digest = hashlib.md5(b"".join(digests)).hexdigest()
+            if digest == self._digest:
+                return VERIFIED
+        if complete and self._certain:
+            return CORRUPTED
+        if complete:
+            LOGGER.warning(
+                "Checksum doesn't match ETag %s for assumed part sizes", self.etag
+            )
+        return UNVERIFIED
+
+
+def verify_file(filename, etag, size):
+    """Hash existing file and compare it with the ETag."""
+    hasher = ETagHasher(etag, size)
+    if not hasher.part_size and size:
+        return UNVERIFIED
+    hasher.update_from_file(filename, 0, size)
+    return hasher.result()
@@ -0,0 +1,47 @@
+"""Parallel gzip compression of sample files."""
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+
+COMPRESSION_BLOCK_SIZE = 16 * 1024**2
+# extensions of files which can be compressed and extensions of compressed files
+COMPRESSED_EXTENSIONS = {
+    "fastq": "fastq.gz",
+    "fq": "fastq.gz",
+    "fasta": "fasta.gz",
+    "fna": "fasta.gz",
+}
+
+
+def _gzip_member(block, level):
+    # wbits=31 writes gzip header with zero mtime, so output is reproducible
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+def gzip_file(
+    source, destination, workers=None, level=6, block_size=COMPRESSION_BLOCK_SIZE
+):
+    """Compress file into gzip file using several threads.
+
+    Every block of the source is compressed in a thread pool as a separate
+    gzip member, members are written in order of blocks (multi-member gzip
+    is a valid gzip file). Not more than 2 blocks per thread are kept in memory.
+    :return: size of the compressed file
+    """
+    workers = workers or cpu_count() or 1
+    compressed_size = 0
+    with open(source, "rb") as src, open(destination, "wb") as dst, ThreadPoolExecutor(
+        max_workers=workers
+    ) as executor:
+        pending = deque()
+        for block in iter(lambda: src.read(block_size), b""):
+            pending.append(executor.submit(_gzip_member, block, level))
+            if len(pending) >= 2 * workers:
+                compressed_size += dst.write(pending.popleft().result())
+        while pending:
+            compressed_size += dst.write(pending.popleft().result())
+        if not compressed_size:
+            compressed_size += dst.write(_gzip_member(b"", level))
+    return compressed_size
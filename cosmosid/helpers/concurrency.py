@@ -0,0 +1,134 @@
+"""Adaptive number of concurrent downloads."""
+import logging
+import threading
+import time
+
+from cosmosid.config import (
+    CONCURRENT_DOWNLOADS,
+    DOWNLOAD_TUNING,
+    MAX_ADAPTIVE_DOWNLOADS,
+)
+
+LOGGER = logging.getLogger(__name__)
+# throughput is measured over intervals of this length
+MEASURE_INTERVAL = 3.0  # seconds
+# throughput must grow by this fraction to count as improved
+MIN_GAIN = 0.05
+# after this number of intervals without change one more transfer is tried
+PROBE_INTERVALS = 5
+
+
+class ConcurrencyController:
+    """AIMD controller of the number of concurrent transfers.
+
+    Transferred bytes are reported as to a shared token bucket (``reserve``
+    never delays), so the controller is added to shared buckets of rate
+    limiters. Aggregate throughput is measured by intervals: the limit grows
+    by one while throughput improves, an added transfer which doesn't
+    improve it is taken back, and the limit is halved on server errors and
+    timeouts (at most once per interval).
+    """
+
+    def __init__(
+        self,
+        initial,
+        maximum,
+        minimum=1,
+        interval=MEASURE_INTERVAL,
+        clock=time.monotonic,
+    ):
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.interval = interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limit = min(max(initial, self.minimum), self.maximum)
+        self._bytes = 0
+        self._started = clock()
+        self._throughput = None
+        self._probing = False
+        self._stable = 0
+        self._backed_off = None
+
+    @property
+    def limit(self):
+        return self._limit
+
+    def reserve(self, amount):
+        """Count transferred bytes, the transfer is never delayed."""
+        with self._lock:
+            self._bytes += amount
+        return 0
+
+    def update(self, demand):
+        """Evaluate throughput of the finished interval, return the limit.
+
+        :param demand: number of running and waiting transfers, throughput
+            of an interval when fewer transfers could run than allowed
+            doesn't depend on the limit, so the limit doesn't change then
+        """
+        with self._lock:
+            now = self._clock()
+            elapsed = now - self._started
+            if elapsed < self.interval:
+                return self._limit
+            throughput = self._bytes / elapsed
+            self._bytes = 0
+            self._started = now
+            if demand >= self._limit:
+                self._evaluate(throughput)
+            return self._limit
+
+    def _evaluate(self, throughput):
+        previous, self._throughput = self._throughput, throughput
+        if previous is None or throughput > previous * (1 + MIN_GAIN):
+            self._set_limit(self._limit + 1)
+            self._probing = True
+        elif self._probing:
+            # the last added transfer didn't improve throughput
+            self._set_limit(self._limit - 1)
+            self._probing = False
+            self._stable = 0
+        else:
+            # conditions may change, one more transfer is tried from time to time
+            self._stable += 1
+            if self._stable >= PROBE_INTERVALS:
+                self._set_limit(self._limit + 1)
+                self._probing = True
+                self._stable = 0
+
+    def _set_limit(self, limit):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit != self._limit:
+            LOGGER.debug("Concurrent downloads: %s -> %s", self._limit, limit)
+        self._limit = limit
+
+    def backoff(self):
+        """Halve the limit after a server error or a timeout."""
+        with self._lock:
+            now = self._clock()
+            if self._backed_off is not None and now - self._backed_off < self.interval:
+                # failures of the concurrent transfers are caused by the same overload
+                return
+            self._backed_off = now
+            self._set_limit(self._limit // 2)
+            self._throughput = None
+            self._probing = False
+            self._stable = 0
+            self._bytes = 0
+            self._started = now
+
+
+def concurrency_controller(concurrent_downloads=None, tuning=None, scale=1):
+    """Controller of downloads for ``tuning`` mode, None if it's "fixed".
+
+    ``concurrent_downloads`` given by the user is the upper limit, the
+    controller starts from CONCURRENT_DOWNLOADS. ``scale`` is the number of
+    transfers of a file (e.g. segments).
+    """
+    if (tuning or DOWNLOAD_TUNING) == "fixed":
+        return None
+    maximum = concurrent_downloads or MAX_ADAPTIVE_DOWNLOADS
+    return ConcurrencyController(
+        min(CONCURRENT_DOWNLOADS, maximum) * scale, maximum * scale, minimum=scale
+    )
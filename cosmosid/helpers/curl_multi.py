@@ -0,0 +1,456 @@
+"""Download engine driving all transfers by a single pycurl multi handle."""
+import logging
+import os
+import time
+from collections import deque
+from os.path import getsize, isfile, join
+
+import pycurl
+from requests import Session
+
+from cosmosid.helpers.downloader import (
+    MIN_SEGMENT_SIZE,
+    SEGMENTS_STATE_SUFFIX,
+    STATE_SAVE_INTERVAL,
+    Downloader,
+)
+from cosmosid.helpers.exceptions import (
+    ChecksumMismatchError,
+    NonRecoverableDownloadError,
+    RecoverableDownloadError,
+)
+from cosmosid.helpers.thread_logger import ThreadLogger
+from cosmosid.helpers.writer import BlockWriter, truncate_incomplete
+
+LOGGER = logging.getLogger(__name__)
+TRIES = 4
+RETRY_DELAY = 3  # seconds, doubled after every try
+SELECT_TIMEOUT = 1.0  # seconds
+# transfer is restarted if it's slower than 1 byte/s during this time
+LOW_SPEED_TIME = 60  # seconds
+
+
+class _Job:
+    """Download of a single file, it's loaded by one or several transfers."""
+
+    def __init__(self, url, size, filename, filedir):
+        self.url = url
+        self.size = size
+        self.filename = filename
+        self.path = join(filedir, filename)
+        truncate_incomplete(self.path)
+        # [start, end, position] of every segment, None for single stream
+        self.segments = None
+        # loaded size of single stream download
+        self.position = getsize(self.path) if isfile(self.path) else 0
+        # ranges aren't supported, the file is loaded again by a single stream
+        self.restart = False
+        # ETag hasher, it's created by the first response of single stream
+        self.hasher = None
+        self.hasher_created = False
+        self.checksum_retried = False
+        self.checksum = None
+        # writers of segments by their starts
+        self.writers = {}
+        self.file = None
+        self.pending = 0
+        self.error = None
+        self.state_saved = time.monotonic()
+
+    @property
+    def loaded(self):
+        if self.segments is None:
+            return self.position
+        return sum(position - start for start, _, position in self.segments)
+
+    def save_state(self, force=False):
+        if self.segments is None:
+            return
+        if force or time.monotonic() - self.state_saved > STATE_SAVE_INTERVAL:
+            # saved positions must not include buffered data
+            for writer in self.writers.values():
+                writer.flush()
+            Downloader._save_segments_state(
+                self.path, self.size, self.segments, self.hasher
+            )
+            self.state_saved = time.monotonic()
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class _Transfer:
+    """Single request of a whole file or of its segment."""
+
+    def __init__(self, job, segment=None):
+        self.job = job
+        self.segment = segment
+        self.tries = 0
+        self.not_before = 0
+        # offset of the first requested byte
+        self.offset = 0
+        self.ranges_unsupported = False
+        self.status_code = 0
+        self.headers = {}
+        self.curl = None
+
+    def on_header(self, line):
+        line = line.decode("iso-8859-1")
+        # status line of every response, including redirects
+        if line.startswith("HTTP/"):
+            parts = line.split()
+            self.status_code = (
+                int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+            )
+            self.headers = {}
+        elif ":" in line:
+            name, value = line.split(":", 1)
+            self.headers[name.strip().lower()] = value.strip()
+
+
+class CurlMultiDownloader:
+    """Downloads files and their segments from a single event loop.
+
+    Transfers share the connection cache of the multi handle and are
+    multiplexed over HTTP/2 connections when the server supports it, so
+    hundreds of concurrent transfers don't need hundreds of threads.
+    """
+
+    def __init__(
+        self,
+        max_transfers,
+        display_loading=True,
+        limiter_factory=None,
+        segments=1,
+        on_complete=None,
+        controller=None,
+    ):
+        self.max_transfers = max_transfers
+        self.display_loading = display_loading
+        self.limiter_factory = limiter_factory
+        self.segments = segments or 1
+        # called with file name, error and checksum result of every file
+        self.on_complete = on_complete
+        # adapts the number of transfers instead of ``max_transfers``
+        self.controller = controller
+        self.multi = pycurl.CurlMulti()
+        if hasattr(pycurl, "PIPE_MULTIPLEX"):
+            self.multi.setopt(pycurl.M_PIPELINING, pycurl.PIPE_MULTIPLEX)
+        self.multi.setopt(pycurl.M_MAX_TOTAL_CONNECTIONS, max_transfers)
+        self._free_handles = []
+        self._limiters = {}
+        # ETags of segmented files are requested before the segments are planned
+        self._session = Session()
+
+    def _plan_segments(self, job, state_exists):
+        """Return segments of the file, None if it's loaded by a single stream."""
+        size, etag = Downloader.probe(self._session, job.url)
+        if size != job.size:
+            return None
+        state = Downloader._load_segments_state(job.path, job.size, etag)
+        if state:
+            job.hasher = Downloader._resume_hasher(job.path, etag, job.size, state)
+            job.hasher_created = True
+            return state["segments"]
+        if job.size < 2 * MIN_SEGMENT_SIZE:
+            return None
+        hasher = Downloader.create_hasher(job.path, etag, job.size)
+        if hasher and hasher.single_part:
+            # MD5 of single part upload can be computed only sequentially
+            return None
+        job.hasher = hasher
+        job.hasher_created = True
+        Downloader._preallocate(job.path, job.size)
+        return Downloader._split_segments(
+            job.size, self.segments, hasher.part_size if hasher else 1
+        )
+
+    def _plan(self, job):
+        """Split the job to transfers, return them."""
+        Downloader._validate(job.path, job.position, job.size)
+        state_exists = isfile(job.path + SEGMENTS_STATE_SUFFIX)
+        if job.size and (state_exists or self.segments > 1):
+            segments = self._plan_segments(job, state_exists)
+            if segments:
+                job.segments = segments
+                job.save_state(force=True)
+                return [
+                    _Transfer(job, segment)
+                    for segment in segments
+                    if segment[2] < segment[1]
+                ]
+            if state_exists:
+                self._restart_single(job)
+        return [_Transfer(job)]
+
+    @staticmethod
+    def _restart_single(job):
+        """Load the file from scratch by a single stream."""
+        job.close()
+        job.segments = None
+        job.position = 0
+        job.restart = False
+        job.error = None
+        job.hasher = None
+        job.hasher_created = False
+        for path in (job.path + SEGMENTS_STATE_SUFFIX, job.path):
+            if isfile(path):
+                os.remove(path)
+
+    def _get_handle(self):
+        if self._free_handles:
+            curl = self._free_handles.pop()
+            curl.reset()
+        else:
+            curl = pycurl.Curl()
+        if hasattr(pycurl, "CURL_HTTP_VERSION_2TLS"):
+            curl.setopt(pycurl.HTTP_VERSION, pycurl.CURL_HTTP_VERSION_2TLS)
+        curl.setopt(pycurl.FOLLOWLOCATION, True)
+        curl.setopt(pycurl.CONNECTTIMEOUT, 30)
+        curl.setopt(pycurl.LOW_SPEED_LIMIT, 1)
+        curl.setopt(pycurl.LOW_SPEED_TIME, LOW_SPEED_TIME)
+        curl.setopt(pycurl.NOSIGNAL, True)
+        return curl
+
+    def _start(self, transfer):
+        job = transfer.job
+        curl = self._get_handle()
+        curl.setopt(pycurl.URL, job.url)
+        if transfer.segment:
+            _, end, transfer.offset = transfer.segment
+            curl.setopt(pycurl.RANGE, "%d-%d" % (transfer.offset, end - 1))
+        else:
+            transfer.offset = job.position
+            if job.file is None:
+                job.file = BlockWriter(job.path, job.size, transfer.offset)
+            if transfer.offset:
+                curl.setopt(pycurl.RESUME_FROM_LARGE, transfer.offset)
+        limiter = self._limiters.get(job.path)
+        if limiter and limiter.bucket.rate:
+            transfers = len(job.segments) if job.segments else 1
+            curl.setopt(
+                pycurl.MAX_RECV_SPEED_LARGE, max(1, limiter.bucket.rate // transfers)
+            )
+        transfer.ranges_unsupported = False
+        transfer.status_code = 0
+        curl.setopt(pycurl.HEADERFUNCTION, transfer.on_header)
+        curl.setopt(pycurl.WRITEFUNCTION, lambda data: self._write(transfer, data))
+        transfer.curl = curl
+        curl.transfer = transfer
+        self.multi.add_handle(curl)
+
+    def _write(self, transfer, data):
+        """Write received data, return 0 to abort the transfer."""
+        job = transfer.job
+        status_code = transfer.status_code
+        if status_code >= 400:
+            # body is an error description, the transfer fails by status code
+            return 0
+        if status_code != 206 and (
+            transfer.offset or (job.segments and transfer.segment[1] != job.size)
+        ):
+            # the whole file is sent instead of the requested range
+            transfer.ranges_unsupported = True
+            return 0
+        if job.segments is not None:
+            segment = transfer.segment
+            writer = job.writers.get(segment[0])
+            if writer is None:
+                writer = job.writers[segment[0]] = BlockWriter(
+                    job.path, offset=segment[2], truncate=False
+                )
+            writer.write(data)
+            if job.hasher:
+                job.hasher.update(segment[2], data)
+            segment[2] += len(data)
+            job.save_state()
+        else:
+            if not job.hasher_created:
+                job.hasher_created = True
+                if "content-length" in transfer.headers:
+                    job.file.flush()
+                    job.hasher = Downloader.create_hasher(
+                        job.path,
+                        transfer.headers.get("etag"),
+                        job.position + int(transfer.headers["content-length"]),
+                        job.position,
+                    )
+            if job.hasher:
+                job.hasher.update(job.position, data)
+            job.file.write(data)
+            job.position += len(data)
+        limiter = self._limiters.get(job.path)
+        if limiter:
+            limiter.consume_shared(len(data))
+        if self.display_loading:
+            Downloader.log(job.filename, job.loaded, job.size)
+        return None
+
+    def _finish(self, transfer, curl_error=None):
+        """Handle finished transfer, return transfers to retry."""
+        job = transfer.job
+        curl = transfer.curl
+        status_code = curl.getinfo(pycurl.RESPONSE_CODE)
+        self.multi.remove_handle(curl)
+        curl.transfer = None
+        self._free_handles.append(curl)
+        error = None
+        if transfer.ranges_unsupported:
+            job.restart = True
+        elif status_code == 416 and not transfer.segment:
+            pass  # the file is already loaded
+        elif 500 <= status_code < 600:
+            error = RecoverableDownloadError(f"Server error {status_code}")
+        elif 400 <= status_code < 500:
+            error = NonRecoverableDownloadError(f"Request failed with {status_code}")
+        elif curl_error:
+            error = RecoverableDownloadError(curl_error)
+        elif transfer.segment and transfer.segment[2] < transfer.segment[1]:
+            error = RecoverableDownloadError("Segment is not loaded completely")
+        elif not transfer.segment and job.size and job.position < job.size:
+            error = RecoverableDownloadError("File is not loaded completely")
+        if isinstance(error, RecoverableDownloadError) and self.controller:
+            self.controller.backoff()
+        if isinstance(error, RecoverableDownloadError) and transfer.tries + 1 < TRIES:
+            transfer.tries += 1
+            transfer.not_before = time.monotonic() + RETRY_DELAY * 2 ** (
+                transfer.tries - 1
+            )
+            LOGGER.debug("%s: %s, retrying", job.filename, error)
+            return [transfer]
+        job.pending -= 1
+        if error is not None:
+            job.error = job.error or error
+        if job.pending:
+            return []
+        if job.restart:
+            LOGGER.debug(
+                "%s: ranges aren't supported, loading by a single stream", job.filename
+            )
+            self._restart_single(job)
+            job.pending = 1
+            return [_Transfer(job)]
+        if job.error is None:
+            job.close()
+            try:
+                job.checksum = Downloader.check_checksum(job.path, job.hasher)
+            except ChecksumMismatchError as mismatch:
+                if job.segments is not None:
+                    os.remove(job.path + SEGMENTS_STATE_SUFFIX)
+                if not job.checksum_retried:
+                    LOGGER.warning("%s, loading it again", mismatch)
+                    self._restart_single(job)
+                    job.checksum_retried = True
+                    job.pending = 1
+                    return [_Transfer(job)]
+                job.error = mismatch
+                job.segments = None
+        self._complete(job)
+        return []
+
+    def _complete(self, job):
+        job.save_state(force=True)
+        job.close()
+        if job.error is None and job.segments is not None:
+            os.remove(job.path + SEGMENTS_STATE_SUFFIX)
+        elif job.error is not None and job.segments is None and not job.position:
+            os.remove(job.path)
+        if job.error is None:
+            ThreadLogger().info(job.filename, "Completed.")
+        else:
+            ThreadLogger().info(job.filename, str(job.error).strip())
+            LOGGER.error("%s: %s", job.path, job.error)
+        if self.on_complete:
+            self.on_complete(job.filename, job.error, job.checksum)
+
+    def _add_jobs(self, files, output_dir, jobs, queue):
+        for file in files:
+            job = _Job(file["url"], file["size"], file["file_name"], output_dir)
+            try:
+                transfers = self._plan(job)
+            except Exception as error:
+                ThreadLogger().info(job.filename, str(error).strip())
+                if self.on_complete:
+                    self.on_complete(job.filename, error, None)
+                continue
+            if self.limiter_factory:
+                self._limiters[job.path] = self.limiter_factory()
+            job.pending = len(transfers)
+            jobs.append(job)
+            if not transfers:
+                self._complete(job)
+            queue.extend(transfers)
+
+    def download(self, files, output_dir, batches=None):
+        """Download files, dicts with 'url', 'size' and 'file_name'.
+
+        Files of the next ``batches`` (an object with ``exhausted``,
+        ``ready()`` and ``next()``) are added when the queue runs low and the
+        batch is received, or when there is nothing else to do.
+        :return: list of paths of downloaded files
+        """
+        jobs = []
+        queue = deque()
+        self._add_jobs(files, output_dir, jobs, queue)
+
+        active = 0
+        try:
+            while queue or active or (batches and not batches.exhausted):
+                max_transfers = (
+                    self.controller.update(active + len(queue))
+                    if self.controller
+                    else self.max_transfers
+                )
+                if (
+                    batches
+                    and not batches.exhausted
+                    and len(queue) < max_transfers
+                    and (batches.ready() or not active)
+                ):
+                    self._add_jobs(batches.next(), output_dir, jobs, queue)
+                now = time.monotonic()
+                for _ in range(len(queue)):
+                    if active >= max_transfers:
+                        break
+                    transfer = queue.popleft()
+                    if transfer.not_before > now or transfer.job.error:
+                        if transfer.job.error:
+                            transfer.job.pending -= 1
+                            if not transfer.job.pending:
+                                self._complete(transfer.job)
+                        else:
+                            queue.append(transfer)
+                        continue
+                    self._start(transfer)
+                    active += 1
+                while self.multi.perform()[0] == pycurl.E_CALL_MULTI_PERFORM:
+                    pass
+                while True:
+                    queued, succeeded, failed = self.multi.info_read()
+                    for curl in succeeded:
+                        active -= 1
+                        queue.extend(self._finish(curl.transfer))
+                    for curl, _, message in failed:
+                        active -= 1
+                        queue.extend(self._finish(curl.transfer, message))
+                    if not queued:
+                        break
+                if active:
+                    self.multi.select(SELECT_TIMEOUT)
+                elif queue:
+                    time.sleep(0.1)
+        finally:
+            for job in jobs:
+                if job.pending:
+                    job.save_state(force=True)
+                job.close()
+            for curl in self._free_handles:
+                curl.close()
+            self.multi.close()
+            self._session.close()
+        return [job.path for job in jobs if job.error is None and job.pending == 0]
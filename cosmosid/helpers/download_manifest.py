@@ -0,0 +1,171 @@
+"""Manifest of samples downloaded to a directory, it allows to resume a batch."""
+import json
+import logging
+import os
+import threading
+import time
+
+from cosmosid.helpers.checksum import UNVERIFIED
+from cosmosid.helpers.downloader import SEGMENTS_STATE_SUFFIX
+from cosmosid.utils import presigned_url_expiry
+
+LOGGER = logging.getLogger(__name__)
+MANIFEST_NAME = ".cosmosid_downloads.json"
+# URL which expires sooner is requested again, large files take a while
+URL_EXPIRATION_MARGIN = 15 * 60  # seconds
+MANIFEST_SAVE_INTERVAL = 1  # seconds
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+class DownloadManifest:
+    """On-disk state of samples downloaded to ``output_dir``.
+
+    Keeps sample id, URL with its expiration time, size, loaded bytes,
+    checksum and status of every file, so an interrupted batch requests
+    URLs only of the samples which have incomplete files (or whose URLs
+    expired) and loads only the incomplete files.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._saved = 0
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                self._state = json.load(manifest_file)
+        except (OSError, ValueError):
+            self._state = {"samples": {}, "files": {}}
+
+    def _path(self, file_name):
+        return os.path.join(self.output_dir, file_name)
+
+    def _is_completed(self, file_name):
+        entry = self._state["files"].get(file_name)
+        path = self._path(file_name)
+        return (
+            entry is not None
+            and entry["status"] == COMPLETED
+            and os.path.isfile(path)
+            and os.path.getsize(path) == entry["size"]
+            and not os.path.isfile(path + SEGMENTS_STATE_SUFFIX)
+        )
+
+    def _has_valid_url(self, file_name):
+        entry = self._state["files"][file_name]
+        if entry["status"] == FAILED:
+            # URL may be rejected, it's requested again
+            return False
+        expires = entry.get("url_expires")
+        return expires is None or expires > time.time() + URL_EXPIRATION_MARGIN
+
+    def completed_files(self, samples_ids):
+        """Return paths of files of the samples which are loaded completely."""
+        return [
+            self._path(file_name)
+            for sample_id in samples_ids
+            for file_name in self._state["samples"].get(sample_id, [])
+            if self._is_completed(file_name)
+        ]
+
+    def split_samples(self, samples_ids):
+        """Split samples to the loaded, the resumable and the ones to request.
+
+        :return: ids of samples which are loaded completely, files of samples
+            which can be resumed with URLs of the manifest and ids of samples
+            to request URLs for (new samples, samples with expired URLs or
+            failed files)
+        """
+        loaded, files, request = [], [], []
+        with self._lock:
+            for sample_id in samples_ids:
+                file_names = self._state["samples"].get(sample_id)
+                if not file_names:
+                    request.append(sample_id)
+                    continue
+                incomplete = [
+                    name for name in file_names if not self._is_completed(name)
+                ]
+                if not incomplete:
+                    loaded.append(sample_id)
+                elif all(self._has_valid_url(name) for name in incomplete):
+                    files.extend(self._file(name) for name in incomplete)
+                else:
+                    request.append(sample_id)
+        return loaded, files, request
+
+    def _file(self, file_name):
+        entry = self._state["files"][file_name]
+        return {"file_name": file_name, "url": entry["url"], "size": entry["size"]}
+
+    def add_files(self, sample_id, files):
+        """Record files of the sample with fresh URLs, return the incomplete ones."""
+        incomplete = []
+        with self._lock:
+            if sample_id is not None:
+                self._state["samples"][sample_id] = [f["file_name"] for f in files]
+            for file in files:
+                entry = self._state["files"].setdefault(
+                    file["file_name"],
+                    {"loaded": 0, "checksum": None, "status": PENDING},
+                )
+                entry.update(
+                    sample_id=sample_id,
+                    url=file["url"],
+                    url_expires=presigned_url_expiry(file["url"]),
+                    size=file["size"],
+                )
+                if not self._is_completed(file["file_name"]):
+                    entry["status"] = PENDING
+                    incomplete.append(file)
+        return incomplete
+
+    def _loaded_bytes(self, file_name):
+        path = self._path(file_name)
+        try:
+            with open(path + SEGMENTS_STATE_SUFFIX, "r") as state_file:
+                segments = json.load(state_file)["segments"]
+            return sum(position - start for start, _, position in segments)
+        except (OSError, ValueError, KeyError):
+            return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    def finish(self, file_name, error=None, checksum=None):
+        """Record result of the file download.
+
+        The file is completed only with result of its checksum verification,
+        a download without error and result was interrupted.
+        """
+        with self._lock:
+            entry = self._state["files"].get(file_name)
+            if entry is None:
+                return
+            if error is None and checksum is None:
+                # the file is loaded again by the next run
+                entry.update(status=PENDING, loaded=self._loaded_bytes(file_name))
+            elif error is None or isinstance(error, FileExistsError):
+                # existing file of the expected size is treated as loaded before
+                entry.update(
+                    status=COMPLETED,
+                    loaded=entry["size"],
+                    checksum=checksum or UNVERIFIED,
+                )
+            else:
+                entry.update(status=FAILED, loaded=self._loaded_bytes(file_name))
+        self.save()
+
+    def save(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._saved < MANIFEST_SAVE_INTERVAL:
+                return
+            for file_name, entry in self._state["files"].items():
+                if entry["status"] != COMPLETED:
+                    entry["loaded"] = self._loaded_bytes(file_name)
+            tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(self._state, manifest_file)
+            os.replace(tmp_path, self.manifest_path)
+            self._saved = time.monotonic()
+        LOGGER.debug("Download manifest is saved to %s", self.manifest_path)
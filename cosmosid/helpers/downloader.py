@@ -1,14 +1,30 @@
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from importlib.util import find_spec
 from os.path import getsize, isfile, join
 
-from requests import Session, Timeout
+from requests import RequestException, Session, Timeout
+from requests.adapters import HTTPAdapter
 
+from cosmosid.config import DOWNLOAD_BACKEND, DOWNLOAD_SEGMENTS
+from cosmosid.helpers.checksum import CORRUPTED, UNVERIFIED, ETagHasher
 from cosmosid.helpers.exceptions import (
+    ChecksumMismatchError,
     NonRecoverableDownloadError,
     RecoverableDownloadError,
     RangeNotSatisfiableError,
 )
 from cosmosid.helpers.thread_logger import ThreadLogger
+from cosmosid.helpers.writer import (
+    BlockWriter,
+    preallocate,
+    truncate_incomplete,
+    write_at,
+)
 from cosmosid.utils import retry
 
 IS_PYCURL_INSTALLED = find_spec("pycurl")
@@ -16,6 +32,19 @@ IS_PYCURL_INSTALLED = find_spec("pycurl")
 if IS_PYCURL_INSTALLED:
     import pycurl
 
+IS_AIOHTTP_INSTALLED = find_spec("aiohttp")
+DOWNLOAD_BACKENDS = ("curl", "requests", "async")
+
+LOGGER = logging.getLogger(__name__)
+
+# resume state of segmented download is kept next to the file
+SEGMENTS_STATE_SUFFIX = ".cosmosid-state"
+MIN_SEGMENT_SIZE = 64 * 1024**2
+STATE_SAVE_INTERVAL = 1  # seconds
+# streamed file fails after this number of tries without progress
+STREAM_TRIES = 4
+STREAM_RETRY_DELAY = 3  # seconds, doubled after every try
+
 
 class Downloader:
     @staticmethod
@@ -31,8 +60,9 @@ class Downloader:
 
     @staticmethod
     def _validate(filepath, real_size, expected_size):
-        if expected_size == real_size:
-            # TODO: it would be better to check hash sum
+        # file of segmented download has full size until all segments are loaded
+        if expected_size == real_size and not isfile(filepath + SEGMENTS_STATE_SUFFIX):
+            # checksum is verified while the file is loaded, see --verify-only
             raise FileExistsError(f"Destination File exists: {filepath}")
 
     @staticmethod
@@ -44,6 +74,17 @@ class Downloader:
         elif 400 <= status_code < 500:
             raise NonRecoverableDownloadError
 
+    @classmethod
+    def _check_resumed_status_code(cls, status_code):
+        """Check response to the request of the rest of the file.
+
+        416 means the file is already loaded completely.
+        """
+        try:
+            cls._check_status_code(status_code)
+        except RangeNotSatisfiableError:
+            raise FileExistsError() from None
+
     @classmethod
     def log(cls, filename: str, loaded_size: float, total_size: float, *args, **kwargs):
         if total_size:
@@ -51,13 +92,58 @@ class Downloader:
                 filename, cls._get_loading_line(loaded_size, total_size)
             )
 
+    @staticmethod
+    def create_hasher(filepath, etag, size, loaded=0):
+        """Return ETag hasher of the file, None if the ETag can't be checked.
+
+        Bytes loaded before (``loaded``) are hashed from the file, the rest
+        is hashed while it's written.
+        """
+        if not etag or size is None:
+            return None
+        hasher = ETagHasher(etag, size)
+        if not hasher.part_size:
+            return None
+        if loaded:
+            hasher.update_from_file(filepath, 0, loaded)
+        return hasher
+
+    @staticmethod
+    def check_checksum(filepath, hasher):
+        """Remove the file and raise ChecksumMismatchError if it's corrupted."""
+        result = hasher.result() if hasher else UNVERIFIED
+        if result == CORRUPTED:
+            os.remove(filepath)
+            raise ChecksumMismatchError(
+                f"Checksum of {filepath} doesn't match, the file is removed"
+            )
+        LOGGER.debug("Checksum of %s is %s", filepath, result)
+        return result
+
+    @staticmethod
+    def get_backend(backend=None):
+        """Return name of the backend, DOWNLOAD_BACKEND or the best installed one."""
+        backend = backend or DOWNLOAD_BACKEND
+        if not backend:
+            return "curl" if IS_PYCURL_INSTALLED else "requests"
+        if backend not in DOWNLOAD_BACKENDS:
+            raise ValueError(f"Unknown download backend: {backend}")
+        if backend == "curl" and not IS_PYCURL_INSTALLED:
+            raise ValueError('"curl" download backend requires pycurl')
+        if backend == "async" and not IS_AIOHTTP_INSTALLED:
+            raise ValueError(
+                '"async" download backend requires aiohttp, '
+                "install it by: pip install cosmosid_cli[async]"
+            )
+        return backend
+
     @classmethod
-    def get_downloader(cls):
-        return (
-            cls._load_file_with_curl
-            if IS_PYCURL_INSTALLED
-            else cls._load_file_with_requests
-        )
+    def get_downloader(cls, backend=None):
+        return {
+            "curl": cls._load_file_with_curl,
+            "requests": cls._load_file_with_requests,
+            "async": cls._load_file_with_aiohttp,
+        }[cls.get_backend(backend)]
 
     @classmethod
     @retry(RecoverableDownloadError, raise_error=True)
@@ -69,26 +155,104 @@ class Downloader:
         filedir,
         chunk_size=4 * 1024**2,
         display_loading=True,
+        limiter=None,
+        segments=None,
+        backend=None,
+        controller=None,
     ):
+        """Load the file, return result of its checksum verification.
+
+        Server errors and timeouts are reported to the concurrency ``controller``.
+        """
         filepath = join(filedir, filename)
+        truncate_incomplete(filepath)
         real_size = getsize(filepath) if isfile(filepath) else 0
         cls._validate(filepath, real_size, expected_size)
-        cls.get_downloader()(
-            url, filename, filedir, real_size, display_loading, chunk_size
-        )
+        segments = segments or DOWNLOAD_SEGMENTS
+        try:
+            if segments > 1 or isfile(filepath + SEGMENTS_STATE_SUFFIX):
+                checksum = cls._load_file_segmented(
+                    url,
+                    filename,
+                    filedir,
+                    segments,
+                    display_loading,
+                    chunk_size,
+                    limiter,
+                )
+                if checksum:
+                    return checksum
+                real_size = getsize(filepath) if isfile(filepath) else 0
+            return cls.get_downloader(backend)(
+                url,
+                filename,
+                filedir,
+                real_size,
+                display_loading,
+                chunk_size,
+                limiter=limiter,
+            )
+        except ChecksumMismatchError:
+            raise
+        except RecoverableDownloadError:
+            if controller:
+                controller.backoff()
+            raise
 
     @classmethod
     def _load_file_with_curl(
-        cls, url, filename, filedir, real_file_size, display_loading, *args
+        cls,
+        url,
+        filename,
+        filedir,
+        real_file_size,
+        display_loading,
+        *args,
+        limiter=None,
     ):
+        filepath = join(filedir, filename)
         curl = pycurl.Curl()
         curl.setopt(pycurl.URL, url)
         curl.setopt(pycurl.RESUME_FROM, real_file_size)
+        headers = {}
+        # writer and hasher of the file are created by the first data
+        loading = {"writer": None, "hasher": None, "status": 0}
+
+        def on_header(line):
+            line = line.decode("iso-8859-1")
+            if line.startswith("HTTP/"):
+                headers.clear()
+                parts = line.split()
+                loading["status"] = (
+                    int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+                )
+            elif ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        def on_data(data):
+            if loading["status"] >= 400:
+                # body is an error description, the transfer fails by status code
+                return 0
+            if loading["writer"] is None:
+                size = None
+                if "content-length" in headers:
+                    size = real_file_size + int(headers["content-length"])
+                    loading["hasher"] = cls.create_hasher(
+                        filepath, headers.get("etag"), size, real_file_size
+                    )
+                loading["writer"] = BlockWriter(filepath, size, real_file_size)
+            writer = loading["writer"]
+            if loading["hasher"]:
+                loading["hasher"].update(writer.position, data)
+            if limiter:
+                limiter.consume(len(data))
+            return writer.write(data)
+
+        curl.setopt(pycurl.HEADERFUNCTION, on_header)
         try:
-            with open(
-                join(filedir, filename), "ab" if real_file_size else "wb"
-            ) as file:
-                curl.setopt(pycurl.WRITEDATA, file)
+            curl.setopt(pycurl.WRITEFUNCTION, on_data)
+            try:
                 if display_loading:
                     curl.setopt(pycurl.NOPROGRESS, False)
                     curl.setopt(
@@ -100,9 +264,20 @@ class Downloader:
                         ),
                     )
                 curl.perform()
-                curl.close()
-        except pycurl.error:
-            cls._check_status_code(pycurl.RESPONSE_CODE)
+            except pycurl.error:
+                cls._check_resumed_status_code(curl.getinfo(pycurl.RESPONSE_CODE))
+                raise RecoverableDownloadError
+            finally:
+                if loading["writer"]:
+                    loading["writer"].close()
+            status_code = curl.getinfo(pycurl.RESPONSE_CODE)
+        finally:
+            curl.close()
+        cls._check_resumed_status_code(status_code)
+        if loading["writer"] is None and not real_file_size:
+            # empty file
+            BlockWriter(filepath).close()
+        return cls.check_checksum(filepath, loading["hasher"])
 
     @classmethod
     def _load_file_with_requests(
@@ -113,33 +288,335 @@ class Downloader:
         real_file_size,
         display_loading,
         chunk_size=8 * 1024**2,
+        limiter=None,
     ):
         with Session() as session:
             headers = {"Range": "bytes=%d-" % real_file_size}
             r = session.get(url, headers=headers, timeout=3, stream=True)
-            try:
-                cls._check_status_code(r.status_code)
-            except RangeNotSatisfiableError:
-                raise FileExistsError()
+            cls._check_resumed_status_code(r.status_code)
             total_size = float(r.headers["content-length"])
             thread_logger = ThreadLogger()
-            with open(
-                join(filedir, filename), "ab" if real_file_size else "wb"
+            filepath = join(filedir, filename)
+            hasher = cls.create_hasher(
+                filepath,
+                r.headers.get("etag"),
+                int(total_size) + real_file_size,
+                real_file_size,
+            )
+            position = real_file_size
+            with BlockWriter(
+                filepath, int(total_size) + real_file_size, real_file_size
             ) as file:
                 try:
                     for i, chunk in enumerate(r.iter_content(chunk_size=chunk_size)):
-                        cls._check_status_code(r.status_code)
                         if display_loading:
                             cls.log(
                                 filename,
                                 i * chunk_size + real_file_size,
                                 total_size + real_file_size,
                             )
+                        if hasher:
+                            hasher.update(position, chunk)
+                        position += len(chunk)
                         file.write(chunk)
-                    thread_logger.info(filename, "Completed.")
-                except RangeNotSatisfiableError:
-                    return
+                        if limiter:
+                            limiter.consume(len(chunk))
                 except Timeout:
                     raise RecoverableDownloadError
                 except Exception:
                     raise NonRecoverableDownloadError
+            checksum = cls.check_checksum(filepath, hasher)
+            thread_logger.info(filename, "Completed.")
+            return checksum
+
+    @classmethod
+    def _load_file_with_aiohttp(
+        cls,
+        url,
+        filename,
+        filedir,
+        real_file_size,
+        display_loading,
+        chunk_size,
+        limiter=None,
+    ):
+        # the module requires aiohttp and imports this one
+        from cosmosid.helpers import async_downloader
+
+        return async_downloader.run(
+            async_downloader.load_file(
+                url,
+                filename,
+                filedir,
+                real_file_size,
+                display_loading,
+                chunk_size,
+                limiter,
+            )
+        )
+
+    @classmethod
+    def stream_file(cls, url, output, chunk_size=4 * 1024**2, limiter=None):
+        """Write the file to ``output`` (a binary stream) instead of the disk.
+
+        Interrupted transfer is resumed from the written position. The data
+        is hashed while it's written and compared with the ETag in the end,
+        written data can't be taken back, so a mismatch is an error.
+        :return: result of checksum verification
+        """
+        progress = {"position": 0, "hasher": None}
+        tries, delay = 0, STREAM_RETRY_DELAY
+        while True:
+            position = progress["position"]
+            try:
+                cls._stream_file(url, output, chunk_size, limiter, progress)
+                break
+            except RecoverableDownloadError as error:
+                if progress["position"] > position:
+                    # the stream moves, only failures in a row are counted
+                    tries, delay = 0, STREAM_RETRY_DELAY
+                tries += 1
+                if tries == STREAM_TRIES:
+                    raise
+                LOGGER.debug(
+                    "%s, retrying in %s seconds", str(error) or "Stream failed", delay
+                )
+                time.sleep(delay)
+                delay *= 2
+        hasher = progress["hasher"]
+        checksum = hasher.result() if hasher else UNVERIFIED
+        if checksum == CORRUPTED:
+            raise NonRecoverableDownloadError(
+                f"Checksum of the streamed data doesn't match ETag {hasher.etag}"
+            )
+        return checksum
+
+    @classmethod
+    def _stream_file(cls, url, output, chunk_size, limiter, progress):
+        position = progress["position"]
+        headers = {"Range": "bytes=%d-" % position} if position else {}
+        total_size = None
+        with Session() as session:
+            try:
+                r = session.get(url, headers=headers, timeout=10, stream=True)
+                cls._check_status_code(r.status_code)
+                if position and r.status_code != 206:
+                    raise NonRecoverableDownloadError(
+                        "Ranges aren't supported, the stream can't be resumed"
+                    )
+                if "content-length" in r.headers:
+                    total_size = position + int(r.headers["content-length"])
+                    if not position:
+                        progress["hasher"] = ETagHasher(
+                            r.headers.get("etag"), total_size
+                        )
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if progress["hasher"]:
+                        progress["hasher"].update(position, chunk)
+                    output.write(chunk)
+                    position += len(chunk)
+                    progress["position"] = position
+                    if limiter:
+                        limiter.consume(len(chunk))
+            except RangeNotSatisfiableError:
+                # the previous try stopped after the last byte
+                return
+            except (Timeout, RequestException):
+                raise RecoverableDownloadError
+        if total_size is not None and position < total_size:
+            raise RecoverableDownloadError("Stream is not loaded completely")
+
+    @staticmethod
+    def probe(session, url):
+        """Request the first byte of the file.
+
+        :return: size of the file (None if server doesn't support ranged
+            requests) and its ETag
+        """
+        try:
+            r = session.get(
+                url, headers={"Range": "bytes=0-0"}, timeout=10, stream=True
+            )
+            r.close()
+        except Timeout:
+            raise RecoverableDownloadError
+        Downloader._check_status_code(r.status_code)
+        etag = r.headers.get("etag")
+        content_range = r.headers.get("content-range", "")
+        if r.status_code != 206 or "/" not in content_range:
+            return None, etag
+        total = content_range.rsplit("/", 1)[1]
+        return (int(total) if total.isdigit() else None), etag
+
+    @staticmethod
+    def _split_segments(size, segments, align=1):
+        """Split file to ``[start, end, position]`` segments, end is exclusive.
+
+        Boundaries of segments are multiples of ``align`` (part size of the
+        uploaded file), so every part is hashed by a single segment.
+        """
+        segments = max(1, min(segments, size // MIN_SEGMENT_SIZE, -(-size // align)))
+        bounds = [
+            min(size, round(size * i / segments / align) * align)
+            for i in range(segments)
+        ] + [size]
+        return [
+            [start, end, start] for start, end in zip(bounds, bounds[1:]) if start < end
+        ]
+
+    @staticmethod
+    def _load_segments_state(filepath, size, etag=None):
+        """Return state of segmented download of unchanged file or None."""
+        try:
+            with open(filepath + SEGMENTS_STATE_SUFFIX, "r") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return None
+        if (
+            state.get("size") != size
+            or not isfile(filepath)
+            or getsize(filepath) != size
+        ):
+            return None
+        if etag and state.get("checksum") and state["checksum"]["etag"] != etag:
+            # the file was changed on the server
+            return None
+        return state
+
+    @staticmethod
+    def _save_segments_state(filepath, size, segments, hasher=None):
+        state_path = filepath + SEGMENTS_STATE_SUFFIX
+        state = {"size": size, "segments": segments}
+        if hasher:
+            state["checksum"] = hasher.get_state()
+        with open(state_path + ".tmp", "w") as state_file:
+            json.dump(state, state_file)
+        os.replace(state_path + ".tmp", state_path)
+
+    @classmethod
+    def _resume_hasher(cls, filepath, etag, size, state):
+        """Return hasher of partially loaded segments, None if ETag can't be checked."""
+        hasher = cls.create_hasher(filepath, etag, size)
+        if hasher and state:
+            hasher.set_state(state.get("checksum"))
+            for start, _, position in state["segments"]:
+                offset = hasher.resume_offset(position, start)
+                if offset < position:
+                    hasher.update_from_file(filepath, offset, position)
+        return hasher
+
+    @staticmethod
+    def _preallocate(filepath, size):
+        with open(filepath, "wb") as file:
+            preallocate(file.fileno(), size)
+
+    @classmethod
+    def _load_file_segmented(
+        cls,
+        url,
+        filename,
+        filedir,
+        segments_count,
+        display_loading,
+        chunk_size,
+        limiter=None,
+    ):
+        """Load file by several concurrent ranged requests.
+
+        The file is preallocated and every segment is written at its offset.
+        Positions of segments are saved to the state file next to the file,
+        so interrupted download is resumed by segments.
+        :return: result of checksum verification, False if the file can't
+            be loaded by segments
+        """
+        filepath = join(filedir, filename)
+        state_path = filepath + SEGMENTS_STATE_SUFFIX
+        with Session() as session:
+            adapter = HTTPAdapter(pool_maxsize=segments_count)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            size, etag = cls.probe(session, url)
+            state = size is not None and cls._load_segments_state(filepath, size, etag)
+            if state:
+                segments = state["segments"]
+                hasher = cls._resume_hasher(filepath, etag, size, state)
+            else:
+                if isfile(state_path):
+                    # the state doesn't match the file, load it from scratch
+                    os.remove(state_path)
+                    if isfile(filepath):
+                        os.remove(filepath)
+                if size is None or size < 2 * MIN_SEGMENT_SIZE:
+                    return False
+                hasher = cls.create_hasher(filepath, etag, size)
+                if hasher and hasher.single_part:
+                    # MD5 of single part upload can be computed only sequentially
+                    return False
+                segments = cls._split_segments(
+                    size, segments_count, hasher.part_size if hasher else 1
+                )
+                cls._preallocate(filepath, size)
+                cls._save_segments_state(filepath, size, segments, hasher)
+
+            lock = threading.Lock()
+            failed = threading.Event()
+            last_saved = [time.monotonic()]
+
+            def progress():
+                loaded = sum(position - start for start, _, position in segments)
+                if display_loading:
+                    cls.log(filename, loaded, size)
+                if time.monotonic() - last_saved[0] > STATE_SAVE_INTERVAL:
+                    cls._save_segments_state(filepath, size, segments, hasher)
+                    last_saved[0] = time.monotonic()
+
+            def load_segment(segment):
+                _, end, position = segment
+                if position >= end:
+                    return
+                fd = os.open(filepath, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+                try:
+                    r = session.get(
+                        url,
+                        headers={"Range": "bytes=%d-%d" % (position, end - 1)},
+                        timeout=10,
+                        stream=True,
+                    )
+                    cls._check_status_code(r.status_code)
+                    if r.status_code != 206:
+                        raise NonRecoverableDownloadError
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        if failed.is_set():
+                            return
+                        write_at(fd, chunk, segment[2])
+                        if hasher:
+                            hasher.update(segment[2], chunk)
+                        with lock:
+                            segment[2] += len(chunk)
+                            progress()
+                        if limiter:
+                            limiter.consume(len(chunk))
+                except (Timeout, RequestException):
+                    failed.set()
+                    raise RecoverableDownloadError
+                except Exception:
+                    failed.set()
+                    raise
+                finally:
+                    os.close(fd)
+
+            try:
+                with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                    for future in [
+                        executor.submit(load_segment, seg) for seg in segments
+                    ]:
+                        future.result()
+            finally:
+                with lock:
+                    cls._save_segments_state(filepath, size, segments, hasher)
+        if any(position < end for _, end, position in segments):
+            raise RecoverableDownloadError
+        os.remove(state_path)
+        checksum = cls.check_checksum(filepath, hasher)
+        ThreadLogger().info(filename, "Completed.")
+        return checksum
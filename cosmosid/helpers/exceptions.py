@@ -118,3 +118,7 @@ class NonRecoverableDownloadError(DownloadError):
 
 class RangeNotSatisfiableError(DownloadError):
     pass
+
+
+class ChecksumMismatchError(RecoverableDownloadError):
+    pass
@@ -1,5 +1,9 @@
 from argparse import ArgumentParser
 
+from cosmosid.config import DOWNLOAD_TUNING, DOWNLOAD_TUNING_MODES
+from cosmosid.helpers import argument_validators
+from cosmosid.helpers.downloader import DOWNLOAD_BACKENDS
+
 
 def directory(parser: ArgumentParser, **kwargs):
     parser.add_argument(
@@ -37,3 +41,47 @@ def concurrent_download(
             **(concurrent_downloads_kwargs or {}),
         })
     )
+
+
+def rate_limit(parser: ArgumentParser, transfer="download"):
+    parser.add_argument(
+        "--rate-limit",
+        action="store",
+        type=argument_validators.rate,
+        default=None,
+        help=f"Limit total {transfer} rate, bytes per second with optional K, M, G "
+             f"suffix, e.g. 10M. Default: {transfer.upper()}_RATE_LIMIT env variable "
+             "or no limit",
+    )
+    parser.add_argument(
+        "--file-rate-limit",
+        action="store",
+        type=argument_validators.rate,
+        default=None,
+        help=f"Limit {transfer} rate of every file, e.g. 2M. "
+             f"Default: {transfer.upper()}_FILE_RATE_LIMIT env variable or no limit",
+    )
+
+
+def download_backend(parser: ArgumentParser):
+    parser.add_argument(
+        "--backend",
+        action="store",
+        choices=DOWNLOAD_BACKENDS,
+        default=None,
+        help="Download backend, \"async\" requires aiohttp. "
+             "Default: DOWNLOAD_BACKEND env variable or curl if pycurl is installed",
+    )
+
+
+def download_tuning(parser: ArgumentParser):
+    parser.add_argument(
+        "--download-tuning",
+        choices=DOWNLOAD_TUNING_MODES,
+        type=str,
+        default=DOWNLOAD_TUNING,
+        help="adaptive - number of concurrent downloads grows while throughput "
+             "improves (up to --concurrent-downloads if it's given) and is halved on "
+             "server errors, fixed - --concurrent-downloads files are downloaded at "
+             "once. Default: %(default)s",
+    )
@@ -0,0 +1,136 @@
+"""Token bucket limiters of upload and download rates."""
+import re
+import threading
+import time
+
+from cosmosid.config import (
+    DOWNLOAD_FILE_RATE_LIMIT,
+    DOWNLOAD_RATE_LIMIT,
+    UPLOAD_FILE_RATE_LIMIT,
+    UPLOAD_RATE_LIMIT,
+)
+
+RATE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+
+def parse_rate(value):
+    """Convert rate like ``500K``, ``10M`` or ``1.5G`` to bytes per second.
+
+    Plain numbers are bytes per second, ``0`` or empty value means no limit.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value or 0
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*", value, re.I
+    )
+    if not match:
+        raise ValueError(f"Invalid rate: {value}")
+    number, unit = match.groups()
+    return int(float(number) * RATE_UNITS[unit.upper()])
+
+
+class TokenBucket:
+    """Thread safe token bucket, one token is one byte.
+
+    Bucket holds up to ``burst`` tokens (a second of transfer by default).
+    Transfers may take more tokens than the bucket holds, the debt is
+    repaid by waiting, so chunks of any size keep the average rate.
+    ``rate`` may be changed by ``set_rate`` while transfers are running.
+    """
+
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self._rate = 0
+        self._burst = 0
+        self._tokens = 0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate, burst=None):
+        """Set rate in bytes per second, 0 disables the limit."""
+        with self._lock:
+            self._rate = max(int(rate or 0), 0)
+            self._burst = burst or self._rate
+            self._tokens = min(self._tokens, self._burst)
+            self._updated = time.monotonic()
+
+    def reserve(self, amount):
+        """Take ``amount`` tokens and return seconds to wait for them."""
+        with self._lock:
+            if not self._rate:
+                return 0
+            now = time.monotonic()
+            self._tokens = min(
+                self._burst, self._tokens + (now - self._updated) * self._rate
+            )
+            self._updated = now
+            self._tokens -= amount
+            return -self._tokens / self._rate if self._tokens < 0 else 0
+
+    def consume(self, amount):
+        """Block until ``amount`` bytes may be transferred."""
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+
+UPLOAD_BUCKET = TokenBucket(parse_rate(UPLOAD_RATE_LIMIT))
+DOWNLOAD_BUCKET = TokenBucket(parse_rate(DOWNLOAD_RATE_LIMIT))
+
+
+class RateLimiter:
+    """Limiter of a single transfer.
+
+    Transfer is limited by its own rate and by rates of ``shared`` buckets
+    (e.g. total rate of all uploads). Waits for all the buckets overlap.
+    """
+
+    def __init__(self, rate=0, shared=()):
+        self.bucket = TokenBucket(rate)
+        self._buckets = (self.bucket, *shared)
+
+    def consume(self, amount):
+        self._consume(amount, self._buckets)
+
+    def reserve(self, amount):
+        """Take tokens of all the buckets, return seconds to wait for them.
+
+        Lets asynchronous transfers wait without blocking the event loop.
+        """
+        if amount <= 0:
+            return 0
+        return max(bucket.reserve(amount) for bucket in self._buckets)
+
+    def consume_shared(self, amount):
+        """Consume tokens of shared buckets only, own rate is limited by the caller."""
+        self._consume(amount, self._buckets[1:])
+
+    @staticmethod
+    def _consume(amount, buckets):
+        if amount <= 0 or not buckets:
+            return
+        delay = max(bucket.reserve(amount) for bucket in buckets)
+        if delay:
+            time.sleep(delay)
+
+
+def upload_limiter(rate=None):
+    """Limiter of a file upload, ``rate`` defaults to UPLOAD_FILE_RATE_LIMIT."""
+    return RateLimiter(
+        parse_rate(UPLOAD_FILE_RATE_LIMIT if rate is None else rate), (UPLOAD_BUCKET,)
+    )
+
+
+def download_limiter(rate=None, controller=None):
+    """Limiter of a file download, ``rate`` defaults to DOWNLOAD_FILE_RATE_LIMIT.
+
+    Transferred bytes are also reported to the concurrency ``controller``.
+    """
+    return RateLimiter(
+        parse_rate(DOWNLOAD_FILE_RATE_LIMIT if rate is None else rate),
+        (DOWNLOAD_BUCKET, controller) if controller else (DOWNLOAD_BUCKET,),
+    )
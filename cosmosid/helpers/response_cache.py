@@ -0,0 +1,155 @@
+"""On-disk cache of responses of read-only API endpoints."""
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from cosmosid.config import (
+    CACHE_DIR,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_SIZE,
+)
+from cosmosid.helpers.cache_files import make_cache_dir, open_cache_file
+
+LOGGER = logging.getLogger(__name__)
+# paths of cached endpoints and time (seconds) their responses are fresh,
+# stale responses with ETag are revalidated by conditional requests; the
+# profile isn't cached, its balance must be actual (see ``store_value``), and
+# runs change their status, they are cached only by the process (RUNS_CACHE)
+ENDPOINT_TTLS = ((re.compile(r"/api/workflow/v1/workflows$"), 10 * 60),)
+ENTRY_SUFFIX = ".json"
+
+
+class ResponseCache:
+    """Cache of successful GET responses keyed by URL with query and API key.
+
+    Every response is a file of ``directory``, the least recently used files
+    are removed when their total size exceeds ``max_size``. Responses are
+    shared by concurrent processes, files are replaced atomically.
+    """
+
+    def __init__(
+        self,
+        directory=os.path.join(CACHE_DIR, "responses"),
+        max_size=RESPONSE_CACHE_SIZE,
+        ttls=ENDPOINT_TTLS,
+        clock=time.time,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self._ttls = ttls
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def ttl(self, method, url):
+        """Return TTL of the endpoint, None if its responses aren't cached."""
+        if method.upper() != "GET":
+            return None
+        path = urlparse(url).path.rstrip("/")
+        for pattern, ttl in self._ttls:
+            if pattern.search(path):
+                return ttl
+        return None
+
+    @staticmethod
+    def key(url, headers):
+        api_key = CaseInsensitiveDict(headers or {}).get("X-Api-Key", "")
+        return hashlib.sha256(f"{url}\n{api_key}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def load(self, key):
+        """Return the cached entry, a dict with "expires", "etag" and the response."""
+        path = self._path(key)
+        try:
+            with open(path, "r") as entry_file:
+                entry = json.load(entry_file)
+            # access time of the entry for LRU eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def fresh(self, entry):
+        return entry["expires"] > self._clock()
+
+    def store(self, key, response, ttl):
+        entry = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "content": base64.b64encode(response.content).decode(),
+            "etag": response.headers.get("etag"),
+            "expires": self._clock() + ttl,
+        }
+        self._save(key, entry)
+
+    def store_value(self, key, value, ttl):
+        """Keep a value derived from a response (e.g. user id) apart from it."""
+        self._save(key, {"value": value, "expires": self._clock() + ttl})
+
+    def refresh(self, key, entry, ttl):
+        """Keep the entry for the next ``ttl`` after it was revalidated."""
+        entry["expires"] = self._clock() + ttl
+        self._save(key, entry)
+
+    def _save(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            make_cache_dir(self.directory)
+            with open_cache_file(tmp_path) as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            # the cache is an optimization, requests don't fail because of it
+            LOGGER.debug("Response isn't cached: %s", error)
+            return
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
+
+    @staticmethod
+    def response(entry):
+        """Build the response of the cached entry."""
+        response = requests.Response()
+        response.status_code = entry["status_code"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response._content = base64.b64decode(entry["content"])
+        response.url = entry["url"]
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.request = requests.Request("GET", entry["url"]).prepare()
+        return response
+
+
+def default_response_cache():
+    """Return the cache of responses, None if it's disabled by RESPONSE_CACHE."""
+    return ResponseCache() if RESPONSE_CACHE else None
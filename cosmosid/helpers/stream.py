@@ -0,0 +1,128 @@
+"""Output of downloaded data to stdout or named pipes instead of files."""
+import logging
+import os
+import stat
+import sys
+import zlib
+from contextlib import contextmanager
+
+LOGGER = logging.getLogger(__name__)
+# output path which means stdout
+STDOUT = "-"
+GZIP_MAGIC = b"\x1f\x8b"
+# gzip or zlib header is detected automatically
+GZIP_WBITS = 32 + zlib.MAX_WBITS
+
+
+def is_stream(path):
+    """Check if the path is stdout ("-") or a named pipe."""
+    if path == STDOUT:
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def _stdout_handlers():
+    loggers = [logging.getLogger()] + [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    return {
+        handler
+        for logger in loggers
+        for handler in logger.handlers
+        if isinstance(handler, logging.StreamHandler)
+        and getattr(handler, "stream", None) is sys.__stdout__
+    }
+
+
+@contextmanager
+def reserve_stdout():
+    """Keep stdout for the data, logs and messages go to stderr meanwhile."""
+    handlers = _stdout_handlers()
+    stdout, sys.stdout = sys.stdout, sys.stderr
+    for handler in handlers:
+        handler.setStream(sys.stderr)
+    try:
+        yield
+    finally:
+        sys.stdout = stdout
+        for handler in handlers:
+            handler.setStream(sys.__stdout__)
+
+
+@contextmanager
+def open_stream(path):
+    """Open stdout ("-") or a named pipe for binary data.
+
+    If the reader exits before the end (e.g. ``| head``), the rest of the
+    data is dropped silently.
+    """
+    try:
+        if path == STDOUT:
+            with reserve_stdout():
+                yield sys.__stdout__.buffer
+                sys.__stdout__.buffer.flush()
+        else:
+            with open(path, "wb") as output:
+                yield output
+    except BrokenPipeError:
+        LOGGER.debug("Reader of %s is closed", path)
+        if path == STDOUT:
+            # the interpreter mustn't fail flushing stdout at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.__stdout__.fileno())
+
+
+class GunzipWriter:
+    """Writes gzipped data decompressed, data without gzip header as is.
+
+    Concatenated gzip members (e.g. of ``cat a.gz b.gz``) are all
+    decompressed.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._head = b""
+        self._detected = False
+        self._decompressor = None
+        self._compressed = False
+        # the current gzip member received some data
+        self._started = False
+
+    def write(self, data):
+        size = len(data)
+        if not self._detected:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return size
+            data, self._head = self._head, b""
+            self._detected = True
+            if data.startswith(GZIP_MAGIC):
+                self._compressed = True
+                self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        if not self._compressed:
+            self.output.write(data)
+            return size
+        while data:
+            self._started = True
+            self.output.write(self._decompressor.decompress(data))
+            if not self._decompressor.eof:
+                break
+            # the next gzip member may follow
+            data = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            self._started = False
+        return size
+
+    def finish(self):
+        """Write the rest of the data, the output stays open."""
+        if self._head:
+            self.output.write(self._head)
+            self._head = b""
+        if self._compressed:
+            self.output.write(self._decompressor.flush())
+            if self._started and not self._decompressor.eof:
+                raise zlib.error("Compressed data is truncated")
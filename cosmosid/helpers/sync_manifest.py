@@ -0,0 +1,98 @@
+"""Manifest of a synchronized directory, it allows to upload only new files."""
+import hashlib
+import json
+import logging
+import os
+import time
+
+from cosmosid.config import CACHE_DIR
+from cosmosid.helpers.cache_files import make_cache_dir, open_cache_file
+from cosmosid.helpers.upload_cache import ContentHasher, UploadCache
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SyncManifest:
+    """On-disk state of a directory uploaded by ``cosmosid upload --sync``.
+
+    Keeps size, mtime and content digest of every uploaded file and the
+    samples they were uploaded as. A sample is uploaded again only if its
+    set of files changed or content of any file changed. Unchanged files
+    cost a single stat, the content is hashed only if size or mtime changed.
+    """
+
+    directory = os.path.join(CACHE_DIR, "sync")
+
+    def __init__(self, path, base_url, api_key, parent_id=None):
+        self.path = os.path.abspath(path)
+        self._base_url = base_url
+        self._api_key = api_key
+        manifest_id = hashlib.sha1(
+            "\n".join([self.path, base_url, api_key, parent_id or ""]).encode()
+        ).hexdigest()
+        self.manifest_path = os.path.join(self.directory, f"{manifest_id}.json")
+        self._changed = False
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                self._state = json.load(manifest_file)
+        except (OSError, ValueError):
+            self._state = {"path": self.path, "files": {}, "samples": {}}
+
+    @staticmethod
+    def _sample_key(files):
+        return "\n".join(sorted(os.path.basename(f) for f in files))
+
+    def _file_unchanged(self, filename):
+        entry = self._state["files"].get(os.path.basename(filename))
+        if not entry:
+            return False
+        stat = os.stat(filename)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return True
+        if entry["size"] != stat.st_size:
+            return False
+        # the file was touched or copied again, compare its content
+        if ContentHasher.from_file(filename).hexdigest() != entry["digest"]:
+            return False
+        entry["mtime"] = stat.st_mtime
+        self._changed = True
+        return True
+
+    def is_uploaded(self, files):
+        """Check if the sample of the files was uploaded and files are unchanged."""
+        if self._sample_key(files) not in self._state["samples"]:
+            return False
+        return all(self._file_unchanged(filename) for filename in files)
+
+    def add(self, files, sample_name, upload_keys):
+        """Record the sample uploaded from the files."""
+        cache = UploadCache(self._base_url, self._api_key)
+        for filename in files:
+            stat = os.stat(filename)
+            digest = (
+                cache.digest(filename) or ContentHasher.from_file(filename).hexdigest()
+            )
+            self._state["files"][os.path.basename(filename)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "digest": digest,
+            }
+        self._state["samples"][self._sample_key(files)] = {
+            "sample_name": sample_name,
+            "upload_keys": upload_keys,
+            "uploaded": time.time(),
+        }
+        self._changed = True
+
+    def save(self):
+        if not self._changed:
+            return
+        make_cache_dir(self.directory)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open_cache_file(tmp_path) as manifest_file:
+            json.dump(self._state, manifest_file)
+        os.replace(tmp_path, self.manifest_path)
+        self._changed = False
+        LOGGER.debug(
+            "Sync manifest of %s is saved to %s", self.path, self.manifest_path
+        )
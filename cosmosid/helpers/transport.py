@@ -0,0 +1,193 @@
+"""HTTP transport of the API classes: one connection pool, retries and timeouts."""
+
+import logging
+import threading
+import time
+from importlib.util import find_spec
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from cosmosid.config import (
+    HTTP2,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRIES,
+)
+from cosmosid.helpers.response_cache import default_response_cache
+
+IS_HTTP2_INSTALLED = bool(find_spec("httpx") and find_spec("h2"))
+LOGGER = logging.getLogger(__name__)
+BACKOFF_FACTOR = 0.3
+# responses with these statuses are retried, Retry-After is respected
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# requests which may be sent again after the server got them
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class Transport:
+    """Thread-safe HTTP client with requests-like ``get``, ``post`` and ``request``.
+
+    All requests share a pool of keep-alive connections. Connection errors
+    and server errors of idempotent requests are retried with exponential
+    backoff, the last response is returned as is. Requests without
+    ``timeout`` get the default (connect, read) timeouts. Responses are
+    ``requests.Response`` and errors are ``requests`` exceptions with HTTP/2
+    too; streamed requests always use HTTP/1.1. GET responses of endpoints
+    known to ``cache`` are served from it while they are fresh.
+    """
+
+    def __init__(
+        self,
+        pool_size=HTTP_POOL_SIZE,
+        retries=HTTP_RETRIES,
+        timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+        http2=HTTP2,
+        cache=None,
+    ):
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            max_retries=Retry(
+                total=retries,
+                connect=retries,
+                read=retries,
+                status=retries,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=IDEMPOTENT_METHODS,
+                raise_on_status=False,
+            ),
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._http2 = None
+        if http2 and not IS_HTTP2_INSTALLED:
+            LOGGER.warning(
+                "HTTP/2 requires httpx with h2: pip install cosmosid_cli[http2]"
+            )
+        elif http2:
+            import httpx
+
+            self._httpx = httpx
+            self._http2 = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size),
+                transport=httpx.HTTPTransport(http2=True, retries=retries),
+            )
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        ttl = (
+            self.cache.ttl(method, url)
+            if self.cache and not kwargs.get("stream")
+            else None
+        )
+        if not ttl:
+            return self._send(method, url, **kwargs)
+        full_url = (
+            requests.Request(method, url, params=kwargs.get("params")).prepare().url
+        )
+        key = self.cache.key(full_url, kwargs.get("headers"))
+        entry = self.cache.load(key)
+        if entry and self.cache.fresh(entry):
+            return self.cache.response(entry)
+        if entry and entry.get("etag"):
+            kwargs["headers"] = dict(kwargs.get("headers") or {})
+            kwargs["headers"]["If-None-Match"] = entry["etag"]
+        response = self._send(method, url, **kwargs)
+        if response.status_code == 304 and entry:
+            self.cache.refresh(key, entry, ttl)
+            return self.cache.response(entry)
+        if response.status_code == 200:
+            self.cache.store(key, response, ttl)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        if self._http2 is not None and not kwargs.get("stream"):
+            return self._request_http2(method.upper(), url, **kwargs)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def _request_http2(
+        self, method, url, timeout=None, data=None, stream=False, **kwargs
+    ):
+        httpx = self._httpx
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        if isinstance(data, (str, bytes)):
+            kwargs["content"] = data
+        elif data is not None:
+            kwargs["data"] = data
+        delay = BACKOFF_FACTOR
+        for tries in range(self.retries + 1):
+            try:
+                response = self._http2.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TimeoutException as error:
+                raise requests.Timeout(str(error)) from error
+            except httpx.TransportError as error:
+                raise requests.ConnectionError(str(error)) from error
+            if (
+                response.status_code not in RETRY_STATUSES
+                or method not in IDEMPOTENT_METHODS
+                or tries == self.retries
+            ):
+                return self._to_requests_response(method, response)
+            time.sleep(self._retry_after(response) or delay)
+            delay *= 2
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("retry-after", ""))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _to_requests_response(method, response):
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers)
+        result._content = response.content
+        result.url = str(response.url)
+        result.reason = response.reason_phrase
+        result.encoding = response.encoding
+        result.elapsed = response.elapsed
+        result.request = requests.Request(method, result.url).prepare()
+        return result
+
+    def close(self):
+        self.session.close()
+        if self._http2 is not None:
+            self._http2.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_lock = threading.Lock()
+_default = None
+
+
+def default_transport():
+    """Return the transport of API objects created without one."""
+    global _default
+    with _lock:
+        if _default is None:
+            _default = Transport(cache=default_response_cache())
+    return _default
@@ -0,0 +1,57 @@
+"""In-memory cache of API responses which expire after a short time."""
+import threading
+import time
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """Thread-safe cache of values loaded by key, each value expires after ``ttl``.
+
+    Concurrent loads of the same key are deduplicated: the first caller runs
+    the loader and the others wait for its result. Only values accepted by
+    ``cacheable`` are kept, so failed responses are requested again.
+    """
+
+    def __init__(self, ttl, cacheable=None, clock=time.monotonic):
+        self.ttl = ttl
+        self._cacheable = cacheable or (lambda value: value is not None)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._values = {}
+        self._pending = {}
+
+    def get(self, key, loader):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self._clock():
+                    return value
+                del self._values[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            value = loader()
+        except BaseException as error:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._pending[key]
+            if self.ttl > 0 and self._cacheable(value):
+                self._values[key] = (self._clock() + self.ttl, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop the cached value of ``key`` or all values."""
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
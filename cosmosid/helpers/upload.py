@@ -1,5 +1,11 @@
+import mmap
+import os
 
 from s3transfer.manager import TransferManager
+from s3transfer.utils import invoke_progress_callbacks
+
+# pages of the part which were already sent are released by this step
+RELEASE_STEP = 4 * 1024**2
 
 
 class CosmosIdTransferManager(TransferManager):
@@ -8,4 +14,133 @@ class CosmosIdTransferManager(TransferManager):
             client, config=None, osutil=None, executor_cls=None)
 
     def _register_handlers(self):
-        pass
\ No newline at end of file
+        pass
+
+
+class MmapFileChunk:
+    """Part of a file read through a memory map.
+
+    It has the interface of s3transfer's ReadFileChunk, but read() returns
+    views of the mapped file instead of copies, so the part is streamed to
+    the socket without being materialised in Python memory. Pages which were
+    already sent are released to keep RSS small. Read bytes are passed to
+    ``hasher`` (see ContentHasher) if it's given.
+    """
+
+    def __init__(
+        self,
+        filename,
+        start_byte,
+        chunk_size,
+        callbacks=None,
+        enable_callbacks=True,
+        close_callbacks=None,
+        hasher=None,
+    ):
+        self._mmap = None
+        self._start_byte = start_byte
+        self._hasher = hasher
+        with open(filename, "rb") as file:
+            full_file_size = os.fstat(file.fileno()).st_size
+            self._size = max(min(chunk_size, full_file_size - start_byte), 0)
+            # offset of the map must be a multiple of ALLOCATIONGRANULARITY
+            self._map_start = start_byte % mmap.ALLOCATIONGRANULARITY
+            if self._size:
+                self._mmap = mmap.mmap(
+                    file.fileno(),
+                    self._map_start + self._size,
+                    access=mmap.ACCESS_READ,
+                    offset=start_byte - self._map_start,
+                )
+                if hasattr(self._mmap, "madvise"):
+                    self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._amount_read = 0
+        self._released = 0
+        self._callbacks = callbacks or []
+        self._callbacks_enabled = enable_callbacks
+        self._close_callbacks = close_callbacks
+
+    def _release_sent_pages(self):
+        if not hasattr(self._mmap, "madvise"):
+            return
+        # data returned by the previous read() is already sent
+        sent = self._map_start + self._amount_read
+        release_to = sent - sent % mmap.PAGESIZE
+        if release_to - self._released >= RELEASE_STEP:
+            self._mmap.madvise(
+                mmap.MADV_DONTNEED, self._released, release_to - self._released
+            )
+            self._released = release_to
+
+    def read(self, amount=None):
+        amount_left = max(self._size - self._amount_read, 0)
+        amount_to_read = amount_left if amount is None else min(amount_left, amount)
+        if not amount_to_read:
+            return b""
+        self._release_sent_pages()
+        start = self._map_start + self._amount_read
+        data = memoryview(self._mmap)[start:start + amount_to_read]
+        if self._hasher:
+            self._hasher.update(self._start_byte + self._amount_read, data)
+        self._amount_read += amount_to_read
+        if self._callbacks_enabled:
+            invoke_progress_callbacks(self._callbacks, amount_to_read)
+        return data
+
+    def signal_transferring(self):
+        self.enable_callback()
+
+    def signal_not_transferring(self):
+        self.disable_callback()
+
+    def enable_callback(self):
+        self._callbacks_enabled = True
+
+    def disable_callback(self):
+        self._callbacks_enabled = False
+
+    def seek(self, where, whence=0):
+        if whence not in (0, 1, 2):
+            raise ValueError(f"invalid whence ({whence}, should be 0, 1 or 2)")
+        if whence == 1:
+            where += self._amount_read
+        elif whence == 2:
+            where += self._size
+        where = max(where, 0)
+        if self._callbacks_enabled:
+            # rewind the progress as well
+            amount = min(where, self._size) - min(self._amount_read, self._size)
+            invoke_progress_callbacks(self._callbacks, bytes_transferred=amount)
+        self._amount_read = where
+        # pages before the new position stay released, madvise needs aligned start
+        self._released = min(
+            self._released,
+            (self._map_start + where) // mmap.PAGESIZE * mmap.PAGESIZE,
+        )
+
+    def tell(self):
+        return self._amount_read
+
+    def close(self):
+        if self._close_callbacks is not None and self._callbacks_enabled:
+            for callback in self._close_callbacks:
+                callback()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # a view of the map is still referenced, it's closed by GC
+                pass
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def __iter__(self):
+        # see s3transfer.utils.ReadFileChunk.__iter__
+        return iter([])
@@ -0,0 +1,213 @@
+"""Cache of uploaded files, it allows to reuse uploads of identical files."""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from cosmosid.config import CACHE_DIR, UPLOAD_CACHE_TTL
+from cosmosid.helpers.cache_files import make_cache_dir, open_cache_file
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOGGER = logging.getLogger(__name__)
+# Parts of multipart uploads are multiples of this block
+HASH_BLOCK_SIZE = 1024**2
+# guards the cache file shared by all UploadCache objects of the process
+_LOCK = threading.Lock()
+
+
+class ContentHasher:
+    """Streaming hash of a file which may be read by parts in any order.
+
+    Every block of the file is hashed with ``algorithm`` (sha256 by default)
+    when its bytes are read, digest of the file is sha256 of the digests of
+    all blocks. A block is hashed again if it's read again from its beginning.
+    """
+
+    def __init__(self, size, block_size=HASH_BLOCK_SIZE, algorithm=hashlib.sha256):
+        self.size = size
+        self.block_size = block_size
+        self._algorithm = algorithm
+        self._blocks_count = max(1, -(-size // block_size))
+        self._pending = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def _block_size(self, index):
+        return min(self.block_size, self.size - index * self.block_size)
+
+    def update(self, offset, data):
+        data = memoryview(data)
+        with self._lock:
+            while data:
+                index, block_offset = divmod(offset, self.block_size)
+                piece = data[:self.block_size - block_offset]
+                pending = self._pending.get(index)
+                if block_offset == 0:
+                    pending = [self._algorithm(), 0]
+                    self._pending[index] = pending
+                    self._digests.pop(index, None)
+                if pending and pending[1] == block_offset:
+                    pending[0].update(piece)
+                    pending[1] += len(piece)
+                    if pending[1] == self._block_size(index):
+                        self._digests[index] = pending[0].digest()
+                        del self._pending[index]
+                else:
+                    # the block wasn't read from its beginning
+                    self._pending.pop(index, None)
+                offset += len(piece)
+                data = data[len(piece):]
+
+    def block_digests(self):
+        """Return digests of all blocks, None if not all blocks were read."""
+        with self._lock:
+            if len(self._digests) != self._blocks_count:
+                return None
+            return [self._digests[i] for i in range(self._blocks_count)]
+
+    @property
+    def hashed_blocks(self):
+        """Digests of blocks which are read completely by their indexes."""
+        with self._lock:
+            return dict(self._digests)
+
+    def add_block_digest(self, index, digest):
+        """Restore digest of the block hashed before."""
+        with self._lock:
+            self._digests[index] = digest
+
+    def hexdigest(self):
+        """Return digest of the file, None if not all blocks were read."""
+        with self._lock:
+            if not self.size:
+                return hashlib.sha256().hexdigest()
+            if len(self._digests) != self._blocks_count:
+                return None
+            return hashlib.sha256(
+                b"".join(self._digests[i] for i in range(self._blocks_count))
+            ).hexdigest()
+
+    @classmethod
+    def from_file(cls, filename):
+        size = os.path.getsize(filename)
+        hasher = cls(size)
+        with open(filename, "rb") as file:
+            offset = 0
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                hasher.update(offset, block)
+                offset += len(block)
+        return hasher
+
+
+class UploadCache:
+    """Content addressed cache of uploaded files.
+
+    Maps file path, size and mtime to content digest, and the digest to the
+    upload key, which can be reused in import workflow until it expires. The
+    import API doesn't tell how long uploaded files are kept, so uploads
+    expire after ``ttl`` since they were made, a local estimate which must
+    be shorter than the storage time of the service.
+
+    The cache file is shared by threads and processes, it's changed under
+    the process lock and an exclusive lock of ``path`` + ".lock".
+    """
+
+    path = os.path.join(CACHE_DIR, "upload_cache.json")
+
+    def __init__(self, base_url, api_key, ttl=UPLOAD_CACHE_TTL):
+        self._account = hashlib.sha1(f"{base_url}\n{api_key}".encode()).hexdigest()
+        self._ttl = ttl
+
+    @contextmanager
+    def _locked(self):
+        with _LOCK:
+            if fcntl is None:
+                yield
+                return
+            try:
+                make_cache_dir(os.path.dirname(self.path))
+                lock_file = open_cache_file(f"{self.path}.lock")
+            except OSError as error:
+                LOGGER.debug("Upload cache isn't locked: %s", error)
+                yield
+                return
+            with lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            cache = {}
+        now = time.time()
+        cache["uploads"] = {
+            digest: upload
+            for digest, upload in cache.get("uploads", {}).items()
+            if upload["expires"] > now
+        }
+        digests = {key.rsplit(":", 1)[1] for key in cache["uploads"]}
+        cache["files"] = {
+            file_key: digest
+            for file_key, digest in cache.get("files", {}).items()
+            if digest in digests
+        }
+        return cache
+
+    def _save(self, cache):
+        make_cache_dir(os.path.dirname(self.path))
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open_cache_file(tmp_path) as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _file_key(filename):
+        stat = os.stat(filename)
+        return f"{os.path.abspath(filename)}:{stat.st_size}:{stat.st_mtime}"
+
+    def _upload_key(self, digest, size):
+        return f"{self._account}:{size}:{digest}"
+
+    def lookup(self, filename):
+        """Return upload key of the file identical to given one."""
+        size = os.path.getsize(filename)
+        with self._locked():
+            cache = self._load()
+        digest = cache["files"].get(self._file_key(filename))
+        if digest is None:
+            prefix = f"{self._account}:{size}:"
+            if not any(key.startswith(prefix) for key in cache["uploads"]):
+                return None
+            # a file of the same size was uploaded, compare content
+            digest = ContentHasher.from_file(filename).hexdigest()
+        upload = cache["uploads"].get(self._upload_key(digest, size))
+        return upload and upload["upload_key"]
+
+    def digest(self, filename):
+        """Return digest of the uploaded file if it's unchanged since the upload."""
+        with self._locked():
+            cache = self._load()
+        return cache["files"].get(self._file_key(filename))
+
+    def add(self, filename, digest, upload_key):
+        size = os.path.getsize(filename)
+        with self._locked():
+            cache = self._load()
+            cache["files"][self._file_key(filename)] = digest
+            cache["uploads"][self._upload_key(digest, size)] = {
+                "upload_key": upload_key,
+                "expires": time.time() + self._ttl,
+            }
+            self._save(cache)
@@ -0,0 +1,114 @@
+"""Journal of multipart uploads, it allows to resume interrupted uploads."""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from cosmosid.config import CACHE_DIR
+from cosmosid.helpers.cache_files import make_cache_dir, open_cache_file
+
+LOGGER = logging.getLogger(__name__)
+
+
+class UploadJournal:
+    """On-disk state of a multipart upload of a single file.
+
+    The journal is identified by the file path and the account, and it is
+    valid only while the size and the modification time of the file are
+    unchanged. A journal of the previous version of the file is kept in
+    ``stale`` so its upload can be aborted.
+    """
+
+    directory = os.path.join(CACHE_DIR, "uploads")
+
+    def __init__(self, filename, base_url, api_key):
+        self.filename = os.path.abspath(filename)
+        stat = os.stat(self.filename)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        journal_id = hashlib.sha1(
+            "\n".join([self.filename, base_url, api_key]).encode()
+        ).hexdigest()
+        self.path = os.path.join(self.directory, f"{journal_id}.json")
+        self.parts_added = 0
+        self.stale = None
+        self._lock = threading.Lock()
+        self._state = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as journal_file:
+                state = json.load(journal_file)
+        except (OSError, ValueError):
+            return
+        if state.get("size") == self.size and state.get("mtime") == self.mtime:
+            self._state = state
+        else:
+            self.stale = state
+
+    def _save(self):
+        make_cache_dir(self.directory)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open_cache_file(tmp_path) as journal_file:
+            json.dump(self._state, journal_file)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def sources(self):
+        if not self._state:
+            return None
+        return {
+            "upload_source": self._state["upload_source"],
+            "upload_key": self._state["upload_key"],
+        }
+
+    @property
+    def chunksize(self):
+        return self._state.get("chunksize")
+
+    @property
+    def upload_id(self):
+        return self._state.get("upload_id")
+
+    @property
+    def parts(self):
+        return self._state.get("parts", {})
+
+    def start(self, sources, chunksize):
+        with self._lock:
+            self._state = {
+                "filename": self.filename,
+                "size": self.size,
+                "mtime": self.mtime,
+                "upload_source": sources["upload_source"],
+                "upload_key": sources["upload_key"],
+                "chunksize": chunksize,
+                "upload_id": None,
+                "parts": {},
+            }
+            self._save()
+
+    def set_upload_id(self, upload_id):
+        with self._lock:
+            self._state["upload_id"] = upload_id
+            self._save()
+
+    def get_etag(self, part_number):
+        return self.parts.get(str(part_number))
+
+    def add_part(self, part_number, etag):
+        with self._lock:
+            self._state["parts"][str(part_number)] = etag
+            self.parts_added += 1
+            self._save()
+
+    def remove(self):
+        with self._lock:
+            self._state = {}
+            self.stale = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
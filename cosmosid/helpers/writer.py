@@ -0,0 +1,205 @@
+"""Writer of downloaded files by large aligned blocks to preallocated files."""
+import os
+import threading
+
+from cosmosid.config import DOWNLOAD_FSYNC, DOWNLOAD_WRITE_BLOCK_SIZE
+
+# marks a preallocated file which is being written, the file has its full
+# size but the content is valid only up to the size recorded in the marker
+ALLOCATED_SUFFIX = ".cosmosid-alloc"
+
+
+class BufferPool:
+    """Pool of reusable write buffers, at most ``size`` idle buffers are kept."""
+
+    def __init__(self, size=32):
+        self._size = size
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, block_size):
+        with self._lock:
+            buffers = self._buffers.get(block_size)
+            if buffers:
+                return buffers.pop()
+        return bytearray(block_size)
+
+    def release(self, buffer):
+        with self._lock:
+            buffers = self._buffers.setdefault(len(buffer), [])
+            if len(buffers) < self._size:
+                buffers.append(buffer)
+
+
+BUFFER_POOL = BufferPool()
+
+
+def preallocate(fd, size):
+    """Reserve ``size`` bytes of the file, so it isn't fragmented by appends."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            # not supported by the file system (e.g. some NFS versions)
+            pass
+    os.ftruncate(fd, max(size, os.fstat(fd).st_size))
+
+
+def write_at(fd, data, offset):
+    data = memoryview(data)
+    while data:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, data, offset)
+        else:
+            # every writer has own descriptor, so seek is safe
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, data)
+        data = data[written:]
+        offset += written
+
+
+def truncate_incomplete(path):
+    """Truncate the file left preallocated by an interrupted process.
+
+    It's truncated to the size recorded in its marker, so the download is
+    resumed from there. The file is removed if the size can't be read.
+    """
+    marker = path + ALLOCATED_SUFFIX
+    if not os.path.isfile(marker):
+        return
+    with open(marker) as marker_file:
+        recorded = marker_file.read().strip()
+    if os.path.isfile(path):
+        if recorded.isdigit() and int(recorded) <= os.path.getsize(path):
+            os.truncate(path, int(recorded))
+        else:
+            os.remove(path)
+    os.remove(marker)
+
+
+class BlockWriter:
+    """Sequential writer of a file by large blocks aligned to ``block_size``.
+
+    Chunks of any size are collected in a pooled buffer and written by whole
+    blocks, chunks of a block or more are written without copying. The file
+    is preallocated to ``expected_size``. The written size is recorded in
+    the marker of the file after every block and the file is truncated to it
+    on close, so an interrupted download is resumed from its end.
+    Writing from ``offset`` keeps the file, it's truncated by default only
+    if it's written from the beginning.
+    """
+
+    def __init__(
+        self,
+        path,
+        expected_size=None,
+        offset=0,
+        block_size=DOWNLOAD_WRITE_BLOCK_SIZE,
+        fsync=DOWNLOAD_FSYNC,
+        pool=BUFFER_POOL,
+        truncate=None,
+    ):
+        self.path = path
+        self.block_size = block_size
+        self.position = offset
+        self._flushed = offset
+        self._fsync = fsync
+        self._pool = pool
+        self._buffer = None
+        self._buffered = 0
+        self._marker = None
+        # small files don't take a whole block from the pool
+        self._buffer_size = (
+            min(block_size, expected_size - offset) if expected_size else block_size
+        )
+        if truncate is None:
+            truncate = not offset
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if truncate:
+            flags |= os.O_TRUNC
+        self._fd = os.open(path, flags, 0o666)
+        self._preallocated = bool(expected_size and expected_size > offset)
+        if self._preallocated:
+            self._marker = os.open(
+                path + ALLOCATED_SUFFIX,
+                os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0),
+                0o666,
+            )
+            self._mark()
+            preallocate(self._fd, expected_size)
+
+    @property
+    def flushed(self):
+        """Size of the data written to the file."""
+        return self._flushed
+
+    def write(self, data):
+        data = memoryview(data)
+        size = len(data)
+        while data:
+            # the first block ends at an aligned offset
+            limit = self.block_size - self._flushed % self.block_size
+            if not self._buffered and len(data) >= limit:
+                blocks = (
+                    limit + (len(data) - limit) // self.block_size * self.block_size
+                )
+                write_at(self._fd, data[:blocks], self._flushed)
+                self._flushed += blocks
+                self._mark()
+                self.position += blocks
+                data = data[blocks:]
+                continue
+            if self._buffer is None:
+                self._buffer = (
+                    self._pool.acquire(self.block_size)
+                    if self._buffer_size == self.block_size
+                    else bytearray(max(self._buffer_size, 0))
+                )
+            piece = data[:limit - self._buffered]
+            self._buffer[self._buffered:self._buffered + len(piece)] = piece
+            self._buffered += len(piece)
+            self.position += len(piece)
+            data = data[len(piece):]
+            if self._buffered == limit:
+                self.flush()
+        return size
+
+    def flush(self):
+        if self._buffered:
+            write_at(self._fd, memoryview(self._buffer)[:self._buffered], self._flushed)
+            self._flushed += self._buffered
+            self._buffered = 0
+            self._mark()
+
+    def _mark(self):
+        # the size has fixed width, so the marker is rewritten in place
+        if self._marker is not None:
+            write_at(self._marker, b"%020d" % self._flushed, 0)
+
+    def close(self):
+        if self._fd is None:
+            return
+        try:
+            self.flush()
+        finally:
+            if self._buffer is not None:
+                if len(self._buffer) == self.block_size:
+                    self._pool.release(self._buffer)
+                self._buffer = None
+            if self._preallocated:
+                os.ftruncate(self._fd, self._flushed)
+            if self._fsync:
+                os.fsync(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            if self._marker is not None:
+                os.close(self._marker)
+                self._marker = None
+                os.remove(self.path + ALLOCATED_SUFFIX)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
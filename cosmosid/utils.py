@@ -10,7 +10,9 @@ import typing
 import uuid
 import re
 from datetime import datetime as dt
+from datetime import timezone
 from functools import wraps
+from urllib.parse import parse_qs, urlparse
 
 import requests
 from cosmosid.helpers.exceptions import ValidationError
@@ -172,7 +174,11 @@ def retry(
 
 
 def requests_retry_session(
-        retries=3, backoff_factor=0.3, status_forcelist=(500, 502, 504), session=None
+        retries=3,
+        backoff_factor=0.3,
+        status_forcelist=(500, 502, 504),
+        session=None,
+        pool_maxsize=10,
 ):
     session = session or requests.Session()
     retry_handle = Retry(
@@ -182,12 +188,31 @@ def requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry_handle)
+    adapter = HTTPAdapter(max_retries=retry_handle, pool_maxsize=pool_maxsize)
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
+def presigned_url_expiry(url):
+    """Return expiration time (unix timestamp) of S3 pre-signed URL.
+
+    Supports signature V4 (X-Amz-Date + X-Amz-Expires) and V2 (Expires)
+    URLs, returns None if URL has no expiration.
+    """
+    query = parse_qs(urlparse(url).query)
+    try:
+        if "X-Amz-Date" in query and "X-Amz-Expires" in query:
+            signed = dt.strptime(query["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ")
+            signed = signed.replace(tzinfo=timezone.utc).timestamp()
+            return signed + int(query["X-Amz-Expires"][0])
+        if "Expires" in query:
+            return int(query["Expires"][0])
+    except ValueError:
+        pass
+    return None
+
+
 def progress(count, total, status=""):
     length = 60
     completed = int(round(length * count / float(total)))
@@ -0,0 +1,108 @@
+"""Micro-benchmark of reconciliation of download errors and samples.
+
+SamplesDownloader.handle_data must scale linearly with the number of
+samples: time per sample is printed for growing responses and the script
+fails if it grows more than MAX_GROWTH times. ``--baseline`` also times the
+former quadratic implementation for comparison.
+
+    python scripts/benchmark_handle_data.py [--baseline] [sizes ...]
+"""
+import argparse
+import sys
+import timeit
+
+from cosmosid.api.download import SamplesDownloader
+
+DEFAULT_SIZES = (1000, 2000, 4000, 10000, 100000)
+MAX_GROWTH = 3
+BASELINE_MAX_SIZE = 10000
+
+
+def make_response(size):
+    """Response for ``size`` samples, half of them failed with duplicate errors."""
+    samples = []
+    errors = []
+    for i in range(size):
+        sample_id = f"sample-{i}"
+        samples.append(
+            {
+                "sample_id": sample_id,
+                "files": [
+                    {"file_name": f"{sample_id}_R{r}.fq.gz", "url": "u", "size": 1}
+                    for r in (1, 2)
+                ],
+            }
+        )
+        if i % 2:
+            error = {"sample_id": sample_id, "error": "Sample is not available"}
+            errors.extend([error, dict(error)])
+    return {"samples": samples, "errors": errors}
+
+
+def baseline_handle_data(data):
+    """Implementation before errors and samples were reconciled by sets.
+
+    It compared ids of failed samples with whole samples, so it didn't drop
+    samples which are dicts, only the errors are the same.
+    """
+    errors = []
+    for error in data.get("errors", []):
+        if error not in errors:
+            errors.append(error)
+    samples = data.get("samples")
+    result = samples.copy()
+    for error in errors:
+        for sample in samples:
+            if error["sample_id"] == sample:
+                result.remove(sample)
+    errors_texts = ["{error} ({sample_id})".format(**error) for error in errors]
+    files = [
+        {
+            "sample_id": sample.get("sample_id", sample.get("id")),
+            "file_name": file["file_name"],
+            "url": file["url"],
+            "size": file["size"],
+        }
+        for sample in result
+        for file in sample.get("files", [])
+    ]
+    return errors_texts, files
+
+
+def measure(func, data, number=None, repeat=5):
+    number = number or max(1, 100000 // len(data["samples"]))
+    return min(timeit.repeat(lambda: func(data), number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--baseline", action="store_true", help="time the former implementation"
+    )
+    args = parser.parse_args()
+
+    header = f"{'n':>8} {'after':>10} {'us/sample':>10}"
+    print(header + (f" {'before':>10}" if args.baseline else ""))
+    per_sample = []
+    for size in sorted(args.sizes):
+        data = make_response(size)
+        seconds = measure(SamplesDownloader.handle_data, data)
+        per_sample.append(seconds / size)
+        row = f"{size:>8} {seconds:>9.4f}s {seconds / size * 1e6:>10.3f}"
+        if args.baseline and size <= BASELINE_MAX_SIZE:
+            expected_errors, _ = baseline_handle_data(data)
+            errors, files = SamplesDownloader.handle_data(data)
+            assert errors == expected_errors and len(files) == size
+            before = measure(baseline_handle_data, data, number=1, repeat=1)
+            row += f" {before:>9.3f}s"
+        elif args.baseline:
+            row += f" {'-':>10}"
+        print(row)
+    growth = max(per_sample) / min(per_sample)
+    print(f"time per sample grows {growth:.1f} times (limit {MAX_GROWTH})")
+    return 0 if growth <= MAX_GROWTH else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -40,6 +40,10 @@ setup(
     packages=find_packages(exclude=['contrib', 'docs', '*tests*']),
     python_requires='>=3.5, <4',
     install_requires=_get_requirements(),
+    extras_require={
+        'async': ['aiohttp>=3.7'],
+        'http2': ['httpx[http2]>=0.18'],
+    },
     package_data={
         'cosmosid': ['logger_config.yaml', ],
     },